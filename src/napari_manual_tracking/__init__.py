@@ -4,9 +4,11 @@ from ._trackpy_detection import TrackpyDetector
 from ._trackpy_linking import TrackpyLinker
 from ._manual_tracker import ManualDivisionTracker
 from ._plot_tracking_results import MeasureLabelTracks
+from .utilities._batch_edit import BatchLabelEditor
 __all__ = (
     "TrackpyDetector",
     "TrackpyLinker",
     "ManualDivisionTracker",
     "MeasureLabelTracks",
+    "BatchLabelEditor",
 )
@@ -6,100 +6,191 @@ import napari
 import pandas           as pd
 import numpy            as np
 
-from typing             import List
-from skimage                                import measure
-from skimage.io         import imread
-from matplotlib.colors  import to_rgba
+from typing             import List, Dict, Tuple, Set
 from napari.utils       import DirectLabelColormap
+from napari.qt.threading import create_worker
+from napari.utils.notifications import show_info, show_warning
 
 from pathlib            import Path as PathL
-from qtpy.QtCore        import Signal, Qt
+from qtpy.QtCore        import Signal, Qt, QAbstractTableModel, QModelIndex, QTimer
 from qtpy.QtGui         import QColor
-from qtpy.QtWidgets     import QTableWidget, QAbstractItemView, QMessageBox, QTableWidgetItem, QScrollArea, QGroupBox, QLabel, QTabWidget, QHBoxLayout, QVBoxLayout, QPushButton, QWidget, QFileDialog, QLineEdit, QSpinBox
+from qtpy.QtWidgets     import QTableView, QAbstractItemView, QMessageBox, QScrollArea, QGroupBox, QLabel, QTabWidget, QHBoxLayout, QVBoxLayout, QPushButton, QWidget, QFileDialog, QLineEdit, QSpinBox, QCheckBox, QProgressBar, QComboBox
 
 from .utilities._plot_widget                      import PlotWidget
+from .utilities._lazy_stack                       import LazyTiffStack, LazyZarrStack
+from .utilities._label_store                      import LABEL_FORMATS, zarr_available, has_zarr_labels, create_zarr_labels, open_zarr_labels, recover_zarr_labels, write_zarr_snapshot
+from .utilities._atomic_save                      import write_snapshot
+from .utilities._label_index                      import LabelIndex, paint_regions, union_boxes
+from .utilities._edit_history                     import EditHistory, SparseEdit
+from .utilities._lineage_graph                    import LineageGraph
+from .utilities._label_stats                      import label_areas, label_areas_in_boxes, label_area_table
+from .utilities._batch_edit                       import BatchLabelEditor, affected_labels
+from .utilities._event_coalescer                  import EventCoalescer
+from .utilities._edit_journal                     import EditJournal, JournalRecord, append_before
+from .utilities._label_dtype                      import smallest_label_dtype, promoted_label_dtype, compact_labels, memory_report
+from .utilities._tiff_index                       import index_tiff_directory, list_tiff_files
+from .utilities._parallel_read                    import read_tiff_stack, DEFAULT_READ_WORKERS
+from .utilities._consistency                      import check_label_directory, repair_label_directory
 
 icon_root = PathL(__file__).parent / "utilities/icons"
 
-class TableWidget(QTableWidget):
-    """QTable widget with functions for updating the table with a pandas dataframe, and sending a signal upon update.
+class ParentLabelsModel(QAbstractTableModel):
+    """Table model for the 'label' and 'parent' columns of a lineage graph, backed by numpy arrays. The model keeps its own copy of the arrays and follows the graph row by row, using the labels the graph reports as changed. Row colors are computed from the labels colormap only when a row is displayed."""
+
+    parent_changed = Signal(int, int) # label, new parent value
+
+    # Follow the lineage row by row as long as fewer labels than this fraction of the rows changed, rebuild the table otherwise.
+    MAX_ROW_UPDATE_FRACTION = 0.25
+
+    def __init__(self):
+        super().__init__()
+        self.labels = np.array([], dtype = int)
+        self.parents = np.array([], dtype = int)
+        self.cmap = None
+        self.editable = False
+        self._colors = {} # label -> QColor, filled lazily
+        self._lineage = None # lineage graph the table was last synchronized with
+        self._version = None # and its version at that moment
+
+    def rowCount(self, parent = None) -> int:
+        return len(self.labels)
+
+    def columnCount(self, parent = None) -> int:
+        return 2
+
+    def headerData(self, section:int, orientation, role = Qt.DisplayRole):
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal:
+            return ['label', 'parent'][section]
+        return super().headerData(section, orientation, role)
+
+    def data(self, index:QModelIndex, role = Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        label = int(self.labels[index.row()])
+        if role in (Qt.DisplayRole, Qt.EditRole):
+            return str(label if index.column() == 0 else int(self.parents[index.row()]))
+        if role == Qt.BackgroundRole and label > 0 and self.cmap is not None:
+            return self._label_color(label)
+        return None
+
+    def _label_color(self, label:int) -> QColor:
+        """Return the color of a label in the napari labels layer, computing it the first time it is needed"""
+
+        if label not in self._colors:
+            label_color = np.asarray(self.cmap.map(label)).ravel()
+            self._colors[label] = QColor(int(label_color[0] * 255), int(label_color[1] * 255), int(label_color[2] * 255))
+        return self._colors[label]
+
+    def flags(self, index:QModelIndex):
+        flags = super().flags(index)
+        if self.editable and index.column() == 1: # only the parent column can be edited
+            flags |= Qt.ItemIsEditable
+        return flags
+
+    def setData(self, index:QModelIndex, value, role = Qt.EditRole) -> bool:
+        if role != Qt.EditRole or index.column() != 1:
+            return False
+        try:
+            new_value = int(value)
+        except ValueError:
+            print('Please enter numerical values!')
+            return False
+        self.parents[index.row()] = new_value
+        self.dataChanged.emit(index, index)
+        self.parent_changed.emit(int(self.labels[index.row()]), new_value)
+        return True
+
+    def set_cmap(self, cmap: napari.utils.Colormap) -> None:
+        """Change the colormap used for the row colors"""
+
+        if cmap is not self.cmap:
+            self.cmap = cmap
+            self._colors = {}
+            if self.rowCount() > 0:
+                self.dataChanged.emit(self.index(0, 0), self.index(self.rowCount() - 1, 1), [Qt.BackgroundRole])
+
+    def update_from_lineage(self, lineage:LineageGraph) -> None:
+        """Bring the table up to date with the lineage graph. Only the rows of the labels that changed since the last update are touched and signalled to the view; the table is rebuilt if it follows another graph or too many labels changed."""
+
+        if lineage is self._lineage and lineage.version == self._version:
+            return
+        changed = lineage.changed_since(self._version) if lineage is self._lineage else None
+        if changed is None or len(changed) > self.MAX_ROW_UPDATE_FRACTION * len(self.labels):
+            self._reset(lineage)
+            return
+
+        for label in sorted(changed):
+            row = int(np.searchsorted(self.labels, label))
+            present = row < len(self.labels) and self.labels[row] == label
+            parent = lineage.parent(label)
+            if present and parent is None:
+                self.beginRemoveRows(QModelIndex(), row, row)
+                self.labels = np.delete(self.labels, row)
+                self.parents = np.delete(self.parents, row)
+                self.endRemoveRows()
+            elif not present and parent is not None:
+                self.beginInsertRows(QModelIndex(), row, row)
+                self.labels = np.insert(self.labels, row, label)
+                self.parents = np.insert(self.parents, row, parent)
+                self.endInsertRows()
+            elif present and self.parents[row] != parent:
+                self.parents[row] = parent
+                self.dataChanged.emit(self.index(row, 1), self.index(row, 1))
+        self._version = lineage.version
+
+    def _reset(self, lineage:LineageGraph) -> None:
+        """Replace the content of the table with a copy of the parent table of the lineage graph"""
+
+        df = lineage.to_dataframe()
+        self.beginResetModel()
+        self.labels = df['label'].to_numpy(dtype = int, copy = True)
+        self.parents = df['parent'].to_numpy(dtype = int, copy = True)
+        self._lineage = lineage
+        self._version = lineage.version
+        self.endResetModel()
+
+class TableWidget(QTableView):
+    """Table view with functions for updating the table from the lineage graph, and sending a signal when a parent is edited.
     
     """
     
-    table_changed = Signal(pd.DataFrame)
+    table_changed = Signal(int, int) # label, new parent value
 
-    def __init__(self, df:pd.DataFrame):
-        super().__init__()
-        self.df = df
+    def __init__(self, parent:QWidget = None):
+        super().__init__(parent)
         self.initUI()
        
     def initUI(self):
         """Initialize an empty table with columns 'label' and 'parent'"""
         
-        self.setColumnCount(2)
-        self.setHorizontalHeaderLabels(['label', 'parent'])
-        self.itemChanged.connect(self.table_cell_changed)
+        self.table_model = ParentLabelsModel()
+        self.setModel(self.table_model)
+        self.table_model.parent_changed.connect(self.table_cell_changed)
         self.active = False
         self.setMinimumWidth(250)
 
     def _enable_editing(self) -> None:
         """Enable editing of the table widget"""
 
+        self.table_model.editable = True
         self.setEditTriggers(QAbstractItemView.AllEditTriggers)
     
     def _disable_editing(self) -> None:
         """Disable editing of the table widget"""
 
+        self.table_model.editable = False
         self.setEditTriggers(QAbstractItemView.NoEditTriggers)
-    
-    def _color_table(self, colors) -> None:
-        """Apply the colors of the napari label image to the table"""
-
-        for i in range(self.rowCount()):
-            label = int(self.item(i, 0).text())
-            if label > 0: 
-                label_color = colors[label]
-                scaled_color = (int(label_color[0] * 255), int(label_color[1] * 255), int(label_color[2] * 255))              
-                for j in range(self.columnCount()):
-                    self.item(i, j).setBackground(QColor(*scaled_color))
-
-    def _populate_table(self, df:pd.DataFrame, cmap: napari.utils.Colormap):
-        """Update the table with a pandas dataframe, overwriting the old associated dataframe."""
-
-        self.itemChanged.disconnect(self.table_cell_changed)
-        self.df = df
-        n_rows, n_cols = df.shape
-        self.setRowCount(n_rows)
-        self.setColumnCount(n_cols)
-        for i in range(n_rows):
-            for j in range(n_cols):
-                item = QTableWidgetItem(str(df.iat[i, j]))
-                # Set the ItemIsEditable flag only for the second column
-                if j == 1:
-                    item.setFlags(item.flags() | Qt.ItemIsEditable)
-
-                self.setItem(i, j, item)
-
-        label_colors = {}
-        for label in self.df['label'].unique():
-            if label > 0:
-                label_colors[label] = cmap.map(label)
-
-        self._color_table(label_colors)
-        self.itemChanged.connect(self.table_cell_changed)   
-
-    def table_cell_changed(self, item:QTableWidgetItem):
-        """Update the dataframe with manually entered values, and send out a signal with the updated dataframe"""
-        
-        row = item.row()
-        col = item.column()
-        new_value = item.text()
-        try:
-            new_value = int(new_value)
-            self.df.iat[row, col] = new_value
-        except ValueError:
-            print('Please enter numerical values!')
-        self.table_changed.emit(self.df)
+
+    def _populate_table(self, lineage:LineageGraph, cmap: napari.utils.Colormap):
+        """Update the table with the parents of the lineage graph"""
+
+        self.table_model.set_cmap(cmap)
+        self.table_model.update_from_lineage(lineage)
+
+    def table_cell_changed(self, label:int, new_value:int):
+        """Send out a signal with the manually entered parent of a label"""
+
+        self.table_changed.emit(label, new_value)
 
 class ManualDivisionTracker(QWidget):
     """QWidget for manually correcting the tracks by updating label values in a 4D Labels layer
@@ -110,19 +201,37 @@ class ManualDivisionTracker(QWidget):
         super().__init__()
         self.viewer = napari_viewer
         self.viewer.layers.clear() # ensure the viewer is clean
-        self.parent_labels = pd.DataFrame()
         self.raw_data1_dir = ''
         self.label_dir = ''
         self.tab_widget = QTabWidget(self)
         self.include_raw_data2 = False
         self.running = False
-        self.label_df = pd.DataFrame({'time_point': pd.Series(dtype = 'int'), 'label': pd.Series(dtype = 'int'), 'parent': pd.Series(dtype = 'int'), 'cell': pd.Series(dtype = 'str')})
+        self.dirty_frames = set() # time points that were edited since the last save
+        self.annotations_changed = False # whether LabelAnnotations.csv needs to be rewritten on the next save
+        self.save_worker = None
+        self.save_requested = False
+        self.label_store = None # zarr array holding the labels, None if they are stored as tif files
+        self.edit_history = EditHistory()
+        self.lineage = LineageGraph() # label -> parent for all labels, the only place where parents are stored
+        self.update_coalescer = EventCoalescer(self._update_labels) # combines the paint events that follow each other quickly
+        self.journal = None # crash-recovery journal in the label directory
+        self.journal_regions = {} # time point -> region edited since the last autosave (None for the full frame)
+        self.journal_parents = {} # parents at the last autosave
+        self.journal_version = None # lineage version at the last autosave
+        self.journal_worker = None
+        self.autosave_timer = QTimer(self)
+        self.autosave_timer.timeout.connect(self._autosave)
+        self.current_time_point = 0 # time point the time window was last centered on
+        self.viewer.dims.events.current_step.connect(self._on_time_point_changed)
+        self.label_df = pd.DataFrame({'time_point': pd.Series(dtype = 'int'), 'label': pd.Series(dtype = 'int'), 'cell': pd.Series(dtype = 'str')}) # one row per label per time point, see _label_table for the parent column
 
         settings_layout = QVBoxLayout()
 
         # colormap options 
         self.colormap_options = ['All', 'Tracked', 'Lineage', 'Non-connected cells']
         self.colormap_selection_index = 0
+        self.cmap_cache = {} # (display mode, selected label) -> colormap
+        self.cmap_cache_version = None # lineage version the cached colormaps belong to
 
         # Create widgets for user input and settings. 
 
@@ -152,14 +261,62 @@ class ManualDivisionTracker(QWidget):
         label_dirbtn = QPushButton('Select directory')
         self.label_path = QLineEdit()
         self.label_path.textChanged.connect(self._update_label_dir)
+        self.check_table_btn = QPushButton('Check table')
+        self.check_table_btn.setToolTip('Compare LabelAnnotations.csv with the label images in this directory, and repair the table if needed')
+        self.check_table_btn.clicked.connect(self._check_label_table)
         labelbox_layout.addWidget(label_dirbtn)
         labelbox_layout.addWidget(self.label_path)
+        labelbox_layout.addWidget(self.check_table_btn)
         label_dirbtn.clicked.connect(self._on_get_label_dir)
         labelbox.setLayout(labelbox_layout)
 
+        # Loading options: load all data into memory, or read time points on demand.
+        loading_box = QGroupBox('Loading')
+        loading_box_layout = QVBoxLayout()
+        self.lazy_loading_checkbox = QCheckBox('Load time points on demand (for large data)')
+        cache_size_layout = QHBoxLayout()
+        self.cache_size_spin = QSpinBox()
+        self.cache_size_spin.setMinimum(1)
+        self.cache_size_spin.setMaximum(1000)
+        self.cache_size_spin.setValue(8)
+        cache_size_layout.addWidget(QLabel('Time points kept in memory'))
+        cache_size_layout.addWidget(self.cache_size_spin)
+        window_layout = QHBoxLayout()
+        self.window_checkbox = QCheckBox('Only keep time points around the current one')
+        self.window_checkbox.setToolTip('With on-demand loading, keep only the time points within this distance of the current time point in memory, and read the ones ahead in the background. Edited time points are saved when they leave the window.')
+        self.window_spin = QSpinBox()
+        self.window_spin.setMinimum(1)
+        self.window_spin.setMaximum(100)
+        self.window_spin.setValue(2)
+        window_layout.addWidget(self.window_checkbox)
+        window_layout.addWidget(self.window_spin)
+        self.window_checkbox.toggled.connect(self._on_window_toggled)
+        self.window_spin.valueChanged.connect(lambda _: self._update_time_window(direction = 0))
+        read_workers_layout = QHBoxLayout()
+        self.read_workers_spin = QSpinBox()
+        self.read_workers_spin.setMinimum(1)
+        self.read_workers_spin.setMaximum(64)
+        self.read_workers_spin.setValue(DEFAULT_READ_WORKERS)
+        self.read_workers_spin.setToolTip('Number of files that are read at the same time when loading all data into memory')
+        read_workers_layout.addWidget(QLabel('Reading threads'))
+        read_workers_layout.addWidget(self.read_workers_spin)
+        label_format_layout = QHBoxLayout()
+        self.label_format_combo = QComboBox()
+        self.label_format_combo.addItems(LABEL_FORMATS if zarr_available() else LABEL_FORMATS[:1])
+        self.label_format_combo.setToolTip('Format of new label data. Existing label data is always kept in its own format.' + ('' if zarr_available() else ' Install the zarr package to store labels in chunked, compressed Zarr format.'))
+        label_format_layout.addWidget(QLabel('Label format'))
+        label_format_layout.addWidget(self.label_format_combo)
+        loading_box_layout.addWidget(self.lazy_loading_checkbox)
+        loading_box_layout.addLayout(cache_size_layout)
+        loading_box_layout.addLayout(window_layout)
+        loading_box_layout.addLayout(read_workers_layout)
+        loading_box_layout.addLayout(label_format_layout)
+        loading_box.setLayout(loading_box_layout)
+
         settings_layout.addWidget(raw_data1_box)
         settings_layout.addWidget(raw_data2_box)
         settings_layout.addWidget(labelbox)
+        settings_layout.addWidget(loading_box)
         
         # Start / stop buttons
         StartStopBox = QGroupBox('Start / Stop editing')
@@ -225,9 +382,43 @@ class ManualDivisionTracker(QWidget):
         convert_swap_layout.addLayout(convert_layout)
         convert_swap_layout.addLayout(swap_layout)
 
+        # Undo / redo of convert, swap and parent table edits.
+        undo_redo_layout = QHBoxLayout()
+        self.undo_btn = QPushButton('Undo')
+        self.undo_btn.clicked.connect(self._undo)
+        self.undo_btn.setEnabled(False)
+        self.redo_btn = QPushButton('Redo')
+        self.redo_btn.clicked.connect(self._redo)
+        self.redo_btn.setEnabled(False)
+        undo_redo_layout.addWidget(self.undo_btn)
+        undo_redo_layout.addWidget(self.redo_btn)
+
+        history_limit_layout = QHBoxLayout()
+        self.history_limit_spin = QSpinBox()
+        self.history_limit_spin.setMinimum(1)
+        self.history_limit_spin.setMaximum(100000)
+        self.history_limit_spin.setValue(256)
+        self.history_limit_spin.valueChanged.connect(lambda value: self._report_dropped_edits(self.edit_history.set_max_bytes(value * 1024 ** 2)))
+        history_limit_layout.addWidget(QLabel('Undo history limit (MB)'))
+        history_limit_layout.addWidget(self.history_limit_spin)
+
+        # Paint events arriving within this window are processed together.
+        update_delay_layout = QHBoxLayout()
+        self.update_delay_spin = QSpinBox()
+        self.update_delay_spin.setMinimum(0)
+        self.update_delay_spin.setMaximum(5000)
+        self.update_delay_spin.setSingleStep(50)
+        self.update_delay_spin.setValue(100)
+        self.update_delay_spin.valueChanged.connect(self.update_coalescer.set_interval)
+        update_delay_layout.addWidget(QLabel('Update table and plot after painting (ms)'))
+        update_delay_layout.addWidget(self.update_delay_spin)
+
         edit_box_layout.addWidget(source_label_widget)
         edit_box_layout.addWidget(target_label_widget)
         edit_box_layout.addLayout(convert_swap_layout)
+        edit_box_layout.addLayout(undo_redo_layout)
+        edit_box_layout.addLayout(history_limit_layout)
+        edit_box_layout.addLayout(update_delay_layout)
         edit_box.setLayout(edit_box_layout)
 
         settings_layout.addWidget(edit_box)
@@ -237,6 +428,20 @@ class ManualDivisionTracker(QWidget):
         self.savebtn.clicked.connect(self._save)
         self.savebtn.setEnabled(False)
         settings_layout.addWidget(self.savebtn)
+        self.save_progress = QProgressBar()
+        self.save_progress.setVisible(False)
+        settings_layout.addWidget(self.save_progress)
+
+        # Edits are written to a recovery journal in the label directory in between saves.
+        autosave_layout = QHBoxLayout()
+        self.autosave_spin = QSpinBox()
+        self.autosave_spin.setMinimum(0)
+        self.autosave_spin.setMaximum(3600)
+        self.autosave_spin.setValue(30)
+        self.autosave_spin.valueChanged.connect(self._set_autosave_interval)
+        autosave_layout.addWidget(QLabel('Autosave edits to recovery journal every (s, 0 = off)'))
+        autosave_layout.addWidget(self.autosave_spin)
+        settings_layout.addLayout(autosave_layout)
         
         # Create tab widget that holds the table in the first tab and the settings in the second tab 
 
@@ -338,13 +543,33 @@ class ManualDivisionTracker(QWidget):
         else:
             self.startbtn.setEnabled(False)
 
-    def _update_parent_labels(self, df:pd.DataFrame) -> None:
-        """Update the parent_labels object, the table, and the plot"""
+    def _check_label_table(self) -> None:
+        """Compare LabelAnnotations.csv with the label images on disk, and offer to repair the table if they differ"""
 
-        self.parent_labels = df 
-        self.label_df['parent'] = self.label_df['label'].map(self.parent_labels.set_index('label')['parent'])
-        self.plot_widget.props = self.label_df       
-        self.plot_widget._update_plot()
+        if self.running:
+            QMessageBox.information(self, 'Check table', 'Please stop editing first, the table is checked against the saved label images.')
+            return
+        if not os.path.exists(os.path.join(self.label_dir, 'LabelAnnotations.csv')):
+            QMessageBox.information(self, 'Check table', 'The label directory does not contain a LabelAnnotations.csv file yet, it is created when you start editing.')
+            return
+
+        report = check_label_directory(self.label_dir)
+        if report.is_consistent:
+            QMessageBox.information(self, 'Check table', report.summary())
+            return
+        answer = QMessageBox.question(self, 'Check table', report.summary() + '\n\nDo you want to repair LabelAnnotations.csv? Its rows are made to match the label images. Labels whose parent does not exist, and one label of every cycle in the lineage, get parent 0.', QMessageBox.Yes | QMessageBox.No)
+        if answer == QMessageBox.Yes:
+            repair_label_directory(self.label_dir, report)
+            show_info(f'Repaired LabelAnnotations.csv in {self.label_dir}')
+
+    def _update_parent_labels(self, label:int, parent:int) -> None:
+        """Apply the parent entered in the table to the lineage graph, and update the plot"""
+
+        edit = self._begin_edit('Edit parent table', labels = [], time_points = [])
+        self.lineage.set_parent(label, parent)
+        self.annotations_changed = True
+        self._commit_edit(edit)
+        self._update_plot()
    
     def _convert_label(self, all:bool) -> None:
         """Change the label value of a particular label to a new value from the current time point onwards (all is False) or for all time points (all is True)."""
@@ -352,52 +577,10 @@ class ManualDivisionTracker(QWidget):
         source_label = self.source_label_spin.value()
         target_label = self.target_label_spin.value()
         time_start = int(self.viewer.dims.current_step[0])
+        time_points = range(self.labels.data.shape[0]) if all else range(time_start, self.labels.data.shape[0])
 
-        # update self.label_df based on self.parent_labels just in case there are any inconsistencies (dirty fix)
-        self.label_df = pd.merge(self.label_df, self.parent_labels[['label', 'parent']], on='label', how='left', suffixes=('', '_new'))
-        self.label_df['parent'] = self.label_df['parent_new']
-        self.label_df.drop('parent_new', axis=1, inplace=True)
-
-        if target_label == 0:
-            # the user wants to remove this label entirely
-            if all: 
-                self.labels.data[self.labels.data == source_label] = target_label
-                self.label_df = self.label_df[self.label_df['label'] != source_label]
-            else:
-                self.labels.data[time_start:, :, :, :][self.labels.data[time_start:, :, :, :] == source_label] = target_label    
-                mask = (self.label_df['label'] != source_label) & (self.label_df['time_point'] <= time_start)        
-                self.label_df = self.label_df[mask]
-            
-            # remove source_label from parent_labels
-            self.parent_labels = self.parent_labels[self.parent_labels['label'] != source_label]
-            self.table_widget._populate_table(self.parent_labels, self.cmap)    
-
-        else: 
-            # Update both the labels layer and the dataframe
-            if all:
-                self.labels.data[self.labels.data == source_label] = target_label
-                self.label_df.loc[self.label_df['label'] == source_label, "label"] = target_label
-            else:  
-                self.labels.data[time_start:, :, :, :][self.labels.data[time_start:, :, :, :] == source_label] = target_label
-                self.label_df.loc[(self.label_df['time_point'] >= time_start) & (self.label_df['label'] == source_label), "label"] = target_label
-
-            # If the new label did not exist yet in the parent_labels dataframe, add it now, and remove any that are no longer in the self.label_df.
-            if not target_label in self.parent_labels['label'].values:
-                self.parent_labels.loc[len(self.parent_labels.index)] = [target_label, 0]
-                self.parent_labels = self.parent_labels[self.parent_labels['label'].isin(self.label_df['label'])]
-                self.table_widget._populate_table(self.parent_labels, self.cmap)        
-
-        # update self.label_df based on self.parent_labels just in case there are any inconsistencies (dirty fix)
-        self.label_df = pd.merge(self.label_df, self.parent_labels[['label', 'parent']], on='label', how='left', suffixes=('', '_new'))
-        self.label_df['parent'] = self.label_df['parent_new']
-        self.label_df.drop('parent_new', axis=1, inplace=True)
-        
-        # Call plot update
-        self.plot_widget.props = self.label_df       
-        self.plot_widget._update_plot()
-    
-        # update the labels
-        self.labels.data = self.labels.data
+        # A target label of 0 removes the source label. 
+        self.apply_operations([('convert', source_label, target_label, time_points)], description = f'Convert {source_label} to {target_label}')
 
     def _swap_label(self, all:bool) -> None:
         """Change the label value of a particular label to a new value from the current time point onwards (all is False) or for all time points (all is True)."""
@@ -406,77 +589,255 @@ class ManualDivisionTracker(QWidget):
         target_label = self.target_label_spin.value()
         time_start = int(self.viewer.dims.current_step[0])
         
-        # If any of the two labels did not yet exist in self.parent_labels, the swap is invalid
-        if not (source_label in self.parent_labels['label'].values and target_label in self.parent_labels['label'].values): 
+        # If any of the two labels did not yet exist in the parent table, the swap is invalid
+        if not (source_label in self.lineage and target_label in self.lineage): 
             print('Invalid source or target label!')
             warnings.warn('Invalid source or target label!')
             return
 
-        # update self.label_df based on self.parent_labels just in case there are any inconsistencies (dirty fix)
-        self.label_df = pd.merge(self.label_df, self.parent_labels[['label', 'parent']], on='label', how='left', suffixes=('', '_new'))
-        self.label_df['parent'] = self.label_df['parent_new']
-        self.label_df.drop('parent_new', axis=1, inplace=True)
+        time_points = range(self.labels.data.shape[0]) if all else range(time_start, self.labels.data.shape[0])
+        self.apply_operations([('swap', source_label, target_label, time_points)], description = f'Swap {source_label} and {target_label}')
 
-        # Swap source and target label in the array and in the pandas df
-        if all:
+    def apply_operations(self, operations:List[tuple], description:str = 'Batch edit') -> None:
+        """Apply a list of label corrections ('convert', 'swap', 'delete' and 'set_parent' operations, see BatchLabelEditor) in a single pass as one undoable edit, and refresh the table, plot and labels layer once at the end"""
 
-            # swap in the array
-            mask = (self.labels.data == source_label)
-            self.labels.data[self.labels.data == target_label] = source_label
-            self.labels.data[mask] = target_label
+        labels, time_points = affected_labels(operations, self.labels.data.shape[0])
+        new_values = [int(v) for operation in operations if operation[0] in ('convert', 'swap') for v in operation[1:3]]
+        if len(new_values) > 0:
+            self._ensure_label_capacity(max(new_values))
+        edit = self._begin_edit(description, labels = labels, time_points = time_points)
+        editor = BatchLabelEditor(self.labels.data, self.label_df, self.lineage, self.label_index)
+        regions = editor.apply(operations, edit)
+        self.label_df = editor.label_df
+        for t, box in regions.items():
+            self._mark_dirty([t], box)
+        self.annotations_changed = True
 
-            # swap in self.label_df
-            mask_source = self.label_df['label'] == source_label
-            mask_target = self.label_df['label'] == target_label
+        self.table_widget._populate_table(self.lineage, self.cmap)
+        self._commit_edit(edit)
 
-            self.label_df.loc[mask_target, 'label'] = source_label
-            self.label_df.loc[mask_source, 'label'] = target_label
+        # Call plot update
+        self._update_plot()
 
-            # Swap 'parent' values
-            source_parent = self.parent_labels.loc[self.parent_labels['label'] == source_label, 'parent'].values[0]
-            target_parent = self.parent_labels.loc[self.parent_labels['label'] == target_label, 'parent'].values[0]
+        # update the labels
+        self.labels.data = self.labels.data
 
-            self.label_df.loc[mask_target, 'parent'] = source_parent
-            self.label_df.loc[mask_source, 'parent'] = target_parent
-          
-        else:          
-            mask = (self.labels.data[time_start:, :, :, :] == source_label)
-            self.labels.data[time_start:, :, :, :][self.labels.data[time_start:, :, :, :] == target_label] = source_label
-            self.labels.data[time_start:, :, :, :][mask] = target_label
+    @property
+    def parent_labels(self) -> pd.DataFrame:
+        """The parent table (label, parent), derived from the lineage graph"""
 
-            mask_time_source = (self.label_df['time_point'] >= time_start) & (self.label_df['label'] == source_label)
-            mask_time_target = (self.label_df['time_point'] >= time_start) & (self.label_df['label'] == target_label)
+        return self.lineage.to_dataframe()
 
-            self.label_df.loc[mask_time_target, 'label'] = source_label
-            self.label_df.loc[mask_time_source, 'label'] = target_label
+    def _label_table(self) -> pd.DataFrame:
+        """Return self.label_df with the parent column of every row derived from the lineage graph"""
 
-            # Swap 'parent' values
-            source_parent = self.parent_labels.loc[self.parent_labels['label'] == source_label, 'parent'].values[0]
-            target_parent = self.parent_labels.loc[self.parent_labels['label'] == target_label, 'parent'].values[0]
+        return self.label_df.assign(parent = self.label_df['label'].map(self.lineage.parents).fillna(-1).astype(int))
 
-            self.label_df.loc[mask_time_target, 'parent'] = source_parent
-            self.label_df.loc[mask_time_source, 'parent'] = target_parent  
-        
-        self.parent_labels = self.parent_labels[self.parent_labels['label'].isin(self.label_df['label'])]
-        self.table_widget._populate_table(self.parent_labels, self.cmap)   
+    def _remove_missing_labels(self, labels:List[int]) -> None:
+        """Remove the given labels from the lineage graph if they no longer occur in self.label_df"""
 
-        # Call plot update
-        print('updating the plot')
-        self.plot_widget.props = self.label_df       
-        self.plot_widget._update_plot()
+        labels = [label for label in labels if label in self.lineage]
+        if len(labels) == 0:
+            return
+        present = np.isin(labels, self.label_df['label'].to_numpy())
+        for label, is_present in zip(labels, present):
+            if not is_present:
+                self.lineage.remove(label)
 
-        # update the labels
+    def _update_plot(self) -> None:
+        """Send the current label table to the plot widget and redraw it"""
+
+        self.plot_widget.update_data(self._label_table())
+
+    def _edit_rows(self, labels:np.ndarray, time_points:np.ndarray) -> pd.Series:
+        """Mask of the rows in self.label_df that belong to the given labels and time points"""
+
+        return self.label_df['label'].isin(labels) & self.label_df['time_point'].isin(time_points)
+
+    def _begin_edit(self, description:str, labels:List[int], time_points:List[int]) -> SparseEdit:
+        """Start recording an edit that affects the given labels and time points"""
+
+        self.update_coalescer.flush() # the recorded rows should include all painting done so far
+        edit = SparseEdit(description, labels, time_points, rows_before = None)
+        edit.rows_before = self.label_df[self._edit_rows(edit.labels, edit.time_points)].copy()
+        self.lineage.start_recording()
+        return edit
+
+    def _commit_edit(self, edit:SparseEdit) -> None:
+        """Finish recording an edit and add it to the undo history"""
+
+        edit.rows_after = self.label_df[self._edit_rows(edit.labels, edit.time_points)].copy()
+        edit.parents = self.lineage.stop_recording()
+        self._report_dropped_edits(self.edit_history.push(edit))
+        self._update_undo_buttons()
+
+    def _report_dropped_edits(self, n_dropped:int) -> None:
+        if n_dropped > 0:
+            show_info(f'Dropped the {n_dropped} oldest edit(s) from the undo history to stay within the memory limit')
+            self._update_undo_buttons()
+
+    def _update_undo_buttons(self) -> None:
+        """Enable the undo and redo buttons depending on the state of the history"""
+
+        self.undo_btn.setEnabled(self.running and self.edit_history.can_undo())
+        self.redo_btn.setEnabled(self.running and self.edit_history.can_redo())
+
+    def _undo(self) -> None:
+        """Revert the most recent convert, swap or parent table edit"""
+
+        self.update_coalescer.flush()
+        edit = self.edit_history.undo()
+        if edit is not None:
+            self._restore_edit(edit, undo = True)
+
+    def _redo(self) -> None:
+        """Apply the most recently reverted edit again"""
+
+        self.update_coalescer.flush()
+        edit = self.edit_history.redo()
+        if edit is not None:
+            self._restore_edit(edit, undo = False)
+
+    def _restore_edit(self, edit:SparseEdit, undo:bool) -> None:
+        """Write the old (undo) or new (redo) state of a recorded edit back to the labels layer, label table and parent table"""
+
+        show_info(('Undo: ' if undo else 'Redo: ') + edit.description)
+
+        # Restore the voxels.
+        for t, (flat_indices, old_values, new_values) in edit.voxels.items():
+            values = old_values if undo else new_values
+            coords = np.unravel_index(flat_indices, self.labels.data.shape[1:])
+            self.labels.data[(t,) + coords] = values
+            box = tuple(slice(int(c.min()), int(c.max()) + 1) for c in coords)
+            self.label_index.add_region(t, np.unique(values), box)
+            self._mark_dirty([t], box)
+
+        # Restore the rows of the label table.
+        rows = edit.rows_before if undo else edit.rows_after
+        self.label_df = pd.concat([self.label_df[~self._edit_rows(edit.labels, edit.time_points)], rows])
+
+        # Restore the parent table.
+        self.lineage.apply_changes(edit.parents, revert = undo)
+        self.annotations_changed = True
+
+        self.table_widget._populate_table(self.lineage, self.cmap)
+        self._update_plot()
         self.labels.data = self.labels.data
-    
+        self._update_undo_buttons()
+
+    def _mark_dirty(self, time_points:List[int], box:Tuple[slice, ...] = None) -> None:
+        """Register time points whose label image has to be rewritten on the next save, and the region (box, or None for the full frame) that has to go into the next autosave"""
+
+        for t in time_points:
+            t = int(t)
+            self.dirty_frames.add(t)
+            if t in self.journal_regions:
+                previous = self.journal_regions[t]
+                self.journal_regions[t] = None if previous is None or box is None else union_boxes(previous, box)
+            else:
+                self.journal_regions[t] = box
+        self.annotations_changed = True
+
+    def _on_labels_painted(self, event) -> None:
+        """Register a paint, fill or erase action on the labels layer: mark the painted regions for saving, grow the bounding boxes of the painted labels, and count the areas inside the regions again"""
+
+        if not self.running:
+            return
+        for t, (box, painted_labels) in paint_regions(event.value).items():
+            self._mark_dirty([t], box)
+            # The labels that were painted over are only known from an index built before the stroke, otherwise the time point is counted (and indexed) completely.
+            count_box = box if self.label_index.is_indexed(t) else None
+            self.label_index.add_region(t, painted_labels, box)
+            for label in painted_labels or {0}:
+                self.update_coalescer.add(t, label, count_box)
+
+    def _load_label_store(self) -> np.ndarray:
+        """Load the zarr label store into memory, or wrap it in a LazyZarrStack that reads the time points on demand"""
+
+        if self.lazy_loading_checkbox.isChecked():
+            return LazyZarrStack(self.label_store, cache_size = self.cache_size_spin.value())
+        return np.asarray(self.label_store[:])
+
+    def _prepare_label_data(self, data):
+        """Store labels that are loaded into memory in the smallest dtype that holds them. At least uint16 is used, so that new labels can be painted without promoting the data right away."""
+
+        if isinstance(data, np.ndarray):
+            compacted = compact_labels(data, minimum = np.uint16)
+            if compacted.dtype != data.dtype:
+                show_info(memory_report(data.shape, data.dtype, compacted.dtype))
+            return compacted
+        return data
+
+    def _ensure_label_capacity(self, max_label:int) -> None:
+        """Promote the label data to a larger dtype if max_label does not fit in the current one, so that it is not silently wrapped around"""
+
+        dtype = promoted_label_dtype(self.labels.data.dtype, max_label)
+        if dtype == self.labels.data.dtype:
+            return
+        show_info(memory_report(self.labels.data.shape, self.labels.data.dtype, dtype))
+        if isinstance(self.labels.data, LazyTiffStack):
+            self.labels.data.promote(dtype)
+            self.labels.data = self.labels.data
+        else:
+            self.labels.data = self.labels.data.astype(dtype)
+        # A zarr store is converted when saving, tif files are written in the new dtype when they are saved.
+
+    def _on_selected_label_changed(self, event) -> None:
+        """Make sure the newly selected label can be painted"""
+
+        if self.running:
+            self._ensure_label_capacity(int(self.labels.selected_label))
+
+    def _windowed_stacks(self) -> List[LazyTiffStack]:
+        """The data of the raw and label layers that is loaded on demand"""
+
+        layers = [self.raw_layer, self.labels]
+        if self.include_raw_data2 and hasattr(self, 'raw_data2_layer'):
+            layers.append(self.raw_data2_layer)
+        return [layer.data for layer in layers if isinstance(layer.data, LazyTiffStack)]
+
+    def _on_time_point_changed(self, event = None) -> None:
+        """Move the time window along with the time slider"""
+
+        if not self.running or len(self.viewer.dims.current_step) == 0:
+            return
+        t = int(self.viewer.dims.current_step[0])
+        if t == self.current_time_point:
+            return # another dimension was changed
+        direction = 1 if t > self.current_time_point else -1
+        self.current_time_point = t
+        self._update_time_window(direction)
+
+    def _on_window_toggled(self, checked:bool) -> None:
+        """Start keeping a time window in memory, or go back to keeping the most recently used time points"""
+
+        if not self.running:
+            return
+        if checked:
+            self._update_time_window(direction = 0)
+        else:
+            for stack in self._windowed_stacks():
+                stack.clear_window()
+
+    def _update_time_window(self, direction:int) -> None:
+        """Keep only the time points around the current one in memory and read the ones ahead in the background. Edited time points that left the window are saved, after which they are released."""
+
+        if not self.running or not self.window_checkbox.isChecked():
+            return
+        outside = set()
+        for stack in self._windowed_stacks():
+            outside.update(stack.set_window(self.current_time_point, self.window_spin.value(), direction))
+        if len(outside) > 0:
+            self._save(time_points = sorted(outside))
+
     def _load_image_data(self, directory:str, files:List[str]) -> np.ndarray:
-        """Load all tiff files in the specified directory as a numpy.ndarray"""
+        """Load all tiff files in the specified directory as a numpy.ndarray, or as a LazyTiffStack that reads the time points on demand"""
 
-        imgs = []
-        for f in files:
-            img = imread(os.path.join(directory, f))
-            imgs.append(img)
-        
-        return np.stack(imgs, axis = 0)
+        if self.lazy_loading_checkbox.isChecked():
+            return LazyTiffStack(directory, files, cache_size = self.cache_size_spin.value())
+
+        # The stack is allocated at once from the file headers, and the files are read in parallel.
+        return read_tiff_stack(directory, files, max_workers = self.read_workers_spin.value())
 
     def _show_empty_dir_message(self, directory:str) -> None:
         """Show a message in case the given directory does not contain tif files"""
@@ -488,78 +849,134 @@ class ManualDivisionTracker(QWidget):
         msg.setStandardButtons(QMessageBox.Ok)
         msg.exec_()
     
-    def _update_labels(self, time_point:int, label:int) -> None: 
-        """Update the current time point for all labels, and include the new one. Update parent_labels and the plot. Note that the first time the function is called, the data is not yet updated, so the user needs to click twice if a new label is introduced."""
+    def _show_file_problems_message(self, problems:List[str]) -> None:
+        """Show a message listing the tif files that do not match the others"""
+
+        msg = QMessageBox()
+        msg.setWindowTitle("Inconsistent tif files")
+        msg.setText("The tif files do not all have the same shape, or the label files do not match the raw data:\n" + "\n".join(problems[:10]) + ("\n..." if len(problems) > 10 else ""))
+        msg.setIcon(QMessageBox.Warning)
+        msg.setStandardButtons(QMessageBox.Ok)
+        msg.exec_()
+
+    def _update_labels(self, regions:Dict[int, Tuple[slice, ...]], painted_labels:Set[int]) -> None: 
+        """Update the areas at the given time points (time point -> painted region, or None for the full frame), and include the painted labels. Update parent_labels, the table and the plot once for the whole batch."""
+
+        for label in painted_labels:
+            self._register_label(label)
 
-        if label != 1: # label 1 is reserved for non-tracked labels
+        counted_labels = set(painted_labels)
+        for time_point, box in regions.items():
+            counted_labels.update(self._update_label_areas(time_point, box))
 
-            # If the label was in parent_labels with value -1, set it to 0 
-            if self.parent_labels[self.parent_labels['label'] == label].empty:
-                # Add a new row with label = label and parent = 0
-                self.parent_labels = pd.concat([self.parent_labels, pd.DataFrame({'label': [label], 'parent': [0]})], ignore_index=True)        
+        self._update_plot()
+        
+        # also update the parent table, removing any labels that no longer exist in the data. 
+        self._remove_missing_labels(counted_labels)
+        self.table_widget._populate_table(self.lineage, self.cmap)
+
+    def _register_label(self, label:int) -> None:
+        """Add a painted label to the parent table, or mark it as tracked if its parent was -1"""
+
+        if label not in (0, 1): # label 1 is reserved for non-tracked labels, and 0 is the background
+
+            # If the label was in the parent table with value -1, set it to 0 
+            parent = self.lineage.parent(label)
+            if parent is None:
                 print('add label to parent labels for ', label)
+                self.lineage.set_parent(label, 0)
 
-            elif self.parent_labels.loc[self.parent_labels['label'] == label, 'parent'].values[0] == -1:
+            elif parent == -1:
                 print('changing the -1 value to 0 for parent for label', label)
-                self.parent_labels.loc[self.parent_labels['label'] == label, 'parent'] = 0
-               
-            # Also update all other time points for this label, replacing the parent label
-            parent_value = self.parent_labels.loc[self.parent_labels['label'] == label, 'parent'].values[0]
-            self.label_df.loc[self.label_df['label'] == label, 'parent'] = parent_value
-
-        # update self.label_df at the current time point
-        area_df = pd.DataFrame(measure.regionprops_table(self.labels.data[time_point], properties = ['label', 'area']))
-        areas = area_df[area_df['label'] > 1]['area']
-        labels = np.unique(area_df[area_df['label'] > 1]['label'])
-        time_points = [time_point for _ in labels]
-        parents = [self.parent_labels.loc[self.parent_labels['label'] == l, 'parent'].values[0] for l in labels]
+                self.lineage.set_parent(label, 0)
+
+    def _update_label_areas(self, time_point:int, box:Tuple[slice, ...] = None) -> Set[int]:
+        """Count the areas at the given time point again. If the region (box) that was painted is known, only the labels whose bounding box overlaps with it are counted again. Returns the labels that were counted."""
+
+        frame = self.labels.data[time_point]
+        if box is not None:
+            # Only the labels that were painted, or that were (partly) painted over, can have changed.
+            self.label_index.ensure_indexed(self.labels.data, [time_point])
+            changed_boxes = self.label_index.labels_in_region(time_point, box)
+            areas = label_areas_in_boxes(frame, changed_boxes)
+            labels = np.array([label for label in areas if label > 1 and areas[label] > 0], dtype = int)
+            areas = np.array([areas[label] for label in labels], dtype = int)
+            replaced_rows = (self.label_df['time_point'] == time_point) & self.label_df['label'].isin(list(changed_boxes.keys()))
+        else:
+            self.label_index.index_frame(time_point, np.asarray(frame))
+            labels, areas = label_areas(frame)
+            areas = areas[labels > 1]
+            labels = labels[labels > 1]
+            replaced_rows = self.label_df['time_point'] == time_point
+
+        # Update the rows of the labels that were counted in self.label_df.
+        counted_labels = set(self.label_df.loc[replaced_rows, 'label'].astype(int)) | set(labels.astype(int))
         cells = ['Cell ' + str(label).zfill(5) for label in labels]
-        d = {'time_point': time_points, 'label': labels, 'parent': parents, 'cell': cells, 'area': areas}
-        df = pd.DataFrame(d)
-        self.label_df = self.label_df.loc[self.label_df['time_point'] != time_point] # remove all rows for the current time point from the dataframe...
-        self.label_df = pd.concat([self.label_df, df]) # ...to concatenate it with the updated data points at the current time point.
-        self.plot_widget.props = self.label_df       
-        self.plot_widget._update_plot()
-        
-        # also update the parent labels df, removing any labels that no longer exist in the data. 
-        self.parent_labels = self.parent_labels[self.parent_labels['label'].isin(self.label_df['label'])]
-        self.table_widget._populate_table(self.parent_labels, self.cmap)
+        df = pd.DataFrame({'time_point': time_point, 'label': labels, 'cell': cells, 'area': areas})
+        self.label_df = pd.concat([self.label_df.loc[~replaced_rows], df], ignore_index = True)
+        return counted_labels
     
     def _on_start(self) -> None:
         """Start the tracking procedure by loading all data and adding mouse callback"""
 
         self.viewer.layers.clear()
         
-        # Load the image data from the provided directories. 
-        raw_files = sorted([f for f in os.listdir(self.raw_data1_dir) if '.tif' in f])
-        if len(raw_files) > 0:
-            self.raw_layer = self.viewer.add_image(self._load_image_data(self.raw_data1_dir, raw_files))
-        else:
+        # Check the file headers of all directories before loading any data, so that mismatching files are reported right away.
+        raw_tiffs = index_tiff_directory(self.raw_data1_dir)
+        if len(raw_tiffs) == 0:
             self._show_empty_dir_message(self.raw_data1_dir)
             return False
-        
+        problems = raw_tiffs.validate()
+
         if self.include_raw_data2:
-            raw_files2 = sorted([f for f in os.listdir(self.raw_data2_dir) if '.tif' in f])
-            if len(raw_files2) > 0:
-                 self.raw_data2_layer = self.viewer.add_image(self._load_image_data(self.raw_data2_dir, raw_files2))
-            else:
+            raw_tiffs2 = index_tiff_directory(self.raw_data2_dir)
+            if len(raw_tiffs2) == 0:
                 self._show_empty_dir_message(self.raw_data2_dir)
                 return False
+            problems += raw_tiffs2.validate(frame_shape = raw_tiffs.frame_shape, n_frames = len(raw_tiffs))
+
+        # Complete or undo a save of the zarr label store that was interrupted.
+        if zarr_available() and recover_zarr_labels(self.label_dir):
+            show_info(f'recovered an interrupted save of the label store in {self.label_dir}')
+
+        label_tiffs = index_tiff_directory(self.label_dir)
+        if len(label_tiffs) > 0 and not has_zarr_labels(self.label_dir):
+            problems += label_tiffs.validate(frame_shape = raw_tiffs.frame_shape, n_frames = len(raw_tiffs), integer = True)
+        if len(problems) > 0:
+            self._show_file_problems_message(problems)
+            return False
+
+        # Load the image data from the provided directories. 
+        self.raw_layer = self.viewer.add_image(self._load_image_data(self.raw_data1_dir, raw_tiffs.files))
+        if self.include_raw_data2:
+            self.raw_data2_layer = self.viewer.add_image(self._load_image_data(self.raw_data2_dir, raw_tiffs2.files))
         
-        self.label_files = sorted([f for f in os.listdir(self.label_dir) if '.tif' in f])
-        if len(self.label_files) > 0:
-            self.labels = self.viewer.add_labels(self._load_image_data(self.label_dir, self.label_files))
+        self.label_files = label_tiffs.files
+        self.label_store = None
+        if has_zarr_labels(self.label_dir) or (len(self.label_files) == 0 and self.label_format_combo.currentText() == LABEL_FORMATS[1]):
+            if has_zarr_labels(self.label_dir):
+                self.label_store = open_zarr_labels(self.label_dir, mode = 'r+')
+            else:
+                # Create an empty store, only chunks that are painted in will take up disk space.
+                self.label_store = create_zarr_labels(self.label_dir, self.raw_layer.data.shape, smallest_label_dtype(0, minimum = np.uint16))
+            self.label_files = []
+            self.labels = self.viewer.add_labels(self._prepare_label_data(self._load_label_store()), name = os.path.basename(self.label_dir))
+        elif len(self.label_files) > 0:
+            self.labels = self.viewer.add_labels(self._prepare_label_data(self._load_image_data(self.label_dir, self.label_files)))
         else:
-            # Create empty label files in this directory, so that they can be filled in by the user.
-            label_data = []
+            # Create empty label files in this directory, so that they can be filled in by the user. The data is promoted to a larger dtype when a label does not fit.
+            empty_arr = np.zeros(self.raw_layer.data.shape[1:], dtype = smallest_label_dtype(0, minimum = np.uint16))
             for i in range(self.raw_layer.data.shape[0]):
-                empty_arr = np.zeros_like(self.raw_layer.data[0])
                 tifffile.imwrite(os.path.join(self.label_dir, (os.path.basename(self.label_dir) + "_TP" + str(i).zfill(4) + ".tif")), empty_arr)
-                label_data.append(empty_arr)
-            self.labels = self.viewer.add_labels(np.stack(label_data, axis = 0), name = os.path.basename(self.label_dir))
-            self.label_files = sorted([f for f in os.listdir(self.label_dir) if '.tif' in f])
+            self.label_files = list_tiff_files(self.label_dir)
+            self.labels = self.viewer.add_labels(self._prepare_label_data(self._load_image_data(self.label_dir, self.label_files)), name = os.path.basename(self.label_dir))
+        self.labels.events.selected_label.connect(self._on_selected_label_changed)
         
         self.cmap = self.labels.colormap # store the original cycliclabelcolormap
+        self.cmap_cache_version = None # new base colormap and lineage, drop the cached display colormaps
+        self.label_index = LabelIndex(self.labels.data.shape[0]) # time points are indexed the first time they are needed
+        self.dirty_frames = set()
+        self.annotations_changed = False
 
         # Activate / deactivate the buttons.
         self.stopbtn.setEnabled(True)
@@ -576,44 +993,39 @@ class ManualDivisionTracker(QWidget):
         # Load or create the label annotation dataframe.
         if os.path.exists(os.path.join(self.label_dir, 'LabelAnnotations.csv')):
             self.label_df = pd.read_csv(os.path.join(self.label_dir, 'LabelAnnotations.csv'))
-            self.label_df['parent'] = self.label_df['parent'].astype(int)
             self.label_df['label'] = self.label_df['label'].astype(int)
             self.label_df['cell'] = self.label_df['label'].apply(lambda x: f'Cell {str(x).zfill(5)}')
 
         else: 
-            for i in range(self.labels.data.shape[0]):
-                props = measure.regionprops_table(self.labels.data[i], properties = ['label', 'area'])
-                props['time_point'] = i
-                props['parent'] = -1
-                props = pd.DataFrame(props)
-                props['cell'] = props.apply(lambda row: 'Cell ' + str(row.label).zfill(5), axis = 1)
-                self.label_df = pd.concat([self.label_df, props])
+            # The label images on disk are identical to the loaded data at this point.
+            self.label_df = label_area_table(self.label_dir, self.label_files)
+            self.annotations_changed = True # the table does not exist on disk yet
+
+        # The parents are stored once per label in the lineage graph, not per time point.
+        self.lineage = LineageGraph.from_dataframe(self.label_df)
+        self.label_df = self.label_df.drop(columns = 'parent')
+        self._offer_journal_replay()
             
         if hasattr(self.labels, "properties"):
-            self.labels.properties = self.label_df
+            self.labels.properties = self._label_table()
         if hasattr(self.labels, "features"):
-            self.labels.features = self.label_df
+            self.labels.features = self._label_table()
 
         # Populate the parent_labels table widget.
-        existing_labels = self.label_df[['label', 'parent']].drop_duplicates().sort_values(by = 'label', axis = 0)
-        label_list = list(existing_labels['label'])
-        parent_list = list(existing_labels['parent'])
-        self.parent_labels = pd.DataFrame({'label': label_list, 'parent': parent_list})      
-        self.table_widget._populate_table(self.parent_labels, self.cmap)
+        self.table_widget._populate_table(self.lineage, self.cmap)
+        self.edit_history.clear()
+        self.update_coalescer.clear()
+        self._update_undo_buttons()
+        self._set_autosave_interval(self.autosave_spin.value())
+        self.current_time_point = int(self.viewer.dims.current_step[0])
+        self._update_time_window(direction = 0)
 
         # Add the plot widget
-        self.plot_widget = PlotWidget(self.label_df, self.labels)
+        self.plot_widget = PlotWidget(self._label_table(), self.labels, self.lineage)
         self.viewer.window.add_dock_widget(self.plot_widget,name='Lineage Tree',area='bottom')
 
-        # Add mouse click callback to fill bucket and paint brush events. 
-        def labels_updated(event): 
-            print('update labels was triggered!')
-            tp = int(self.viewer.dims.current_step[0])
-            current_label = int(self.labels.selected_label)
-            if self.running: 
-                self._update_labels(tp, current_label)
-
-        @self.labels.events.labels_update.connect(labels_updated)
+        # Follow the paint brush, fill bucket and eraser. The paint event reports the painted regions once per stroke.
+        self.labels.events.paint.connect(self._on_labels_painted)
         
         # Add custom key binding
         @self.labels.bind_key('s')
@@ -638,91 +1050,291 @@ class ManualDivisionTracker(QWidget):
         """Updates the colormap of the labels, using the current selection (all, tracked, lineage, or loose cells)."""
 
         self.labels.events.selected_label.disconnect(self._update_cmap)
-        self.labels.colormap = self.cmap
 
-        if not self.colormap_options[self.colormap_selection_index] == "All":           
-            if self.colormap_options[self.colormap_selection_index] == "Tracked": 
-                selection = self.parent_labels.loc[self.parent_labels['parent'] != -1, 'label'] # find all the labels that have a parent != -1
-            if self.colormap_options[self.colormap_selection_index] == "Lineage": 
-                selection = self._get_lineage(self.labels.selected_label)
-            if self.colormap_options[self.colormap_selection_index] == "Non-connected cells": 
-                selection = self.parent_labels.loc[self.parent_labels['parent'] == -1, 'label']
-            
-            self.labels.colormap = self._create_custom_direct_cmap(selection)
+        if self.colormap_options[self.colormap_selection_index] == "All":
+            self.labels.colormap = self.cmap
+        else:           
+            self.labels.colormap = self._get_display_cmap(self.colormap_options[self.colormap_selection_index])
 
             if self.colormap_options[self.colormap_selection_index] == "Lineage": 
                 self.labels.events.selected_label.connect(self._update_cmap)      
 
-    def _get_lineage(self, selected_label: int): 
+    def _get_display_cmap(self, mode:str) -> DirectLabelColormap:
+        """Return the colormap for a display mode, reusing the previous one as long as the parent table did not change"""
+
+        if self.cmap_cache_version != self.lineage.version:
+            self.cmap_cache = {} # the parent table changed, all cached colormaps are outdated
+            self.cmap_cache_version = self.lineage.version
+
+        key = (mode, int(self.labels.selected_label) if mode == "Lineage" else None)
+        if key in self.cmap_cache:
+            return self.cmap_cache[key]
+
+        if mode == "Tracked": 
+            selection = self.parent_labels.loc[self.parent_labels['parent'] != -1, 'label'] # find all the labels that have a parent != -1
+        if mode == "Lineage": 
+            selection = self._get_lineage(self.labels.selected_label)
+        if mode == "Non-connected cells": 
+            selection = self.parent_labels.loc[self.parent_labels['parent'] == -1, 'label']
+
+        self.cmap_cache[key] = self._create_custom_direct_cmap(selection)
+        return self.cmap_cache[key]
+
+    def _get_lineage(self, selected_label: int) -> List[int]: 
         """Get the entire lineage the current label belongs to"""
 
         if selected_label in [0, 1]:
             return []
-        try: 
-            parent = self.parent_labels.loc[self.parent_labels['label'] == selected_label, 'parent'].iloc[0]
-        except IndexError:
+        if selected_label not in self.lineage:
             print('this label does not exist in parent labels')
             return []
-
-        if parent == -1:
+        if self.lineage.parent(selected_label) == -1:
             print('this label has not been tracked yet and therefore does not belong to a lineage')
             return []
-        elif parent == 0:
-            y_axis_order = self._determine_label_plot_order([selected_label])      
-        else: 
-            while parent > 0:
-                new_parent = self.parent_labels.loc[self.parent_labels['label'] == parent, 'parent'].iloc[0]
-                if (new_parent == 0) or (new_parent == -1) :
-                    break
-                else:
-                    parent = new_parent
-            y_axis_order = self._determine_label_plot_order([parent])  
-        
-        return(y_axis_order)
+
+        return self.lineage.lineage(selected_label)
 
     def _determine_label_plot_order(self, starting_points: List[int]) -> List[int]:
         """Determines the y-axis order of the tree plot, from the starting points downward"""
-        
-        y_axis_order = [s for s in starting_points]
 
-        # Find the children of each of the starting points, and work down the tree.
-        while len(starting_points) > 0:
-            children_list = []
-            for l in starting_points:
-                children = list(self.parent_labels.loc[self.parent_labels['parent'] == l, 'label'])
-                for i, c in enumerate(children):
-                    [children_list.append(c)]
-                    y_axis_order.insert(y_axis_order.index(l) + i, c)
-            starting_points = children_list
-
-        return y_axis_order
+        return self.lineage.plot_order(starting_points)
 
     def _create_custom_direct_cmap(self, selected_labels: List[int]):
         """Create a custom direct colormap for the selected labels, and set all other other labels to transparent"""
         
+        selected_labels = np.asarray(selected_labels, dtype = int).ravel()
         color_dict_rgb = {None: (0.0, 0.0, 0.0, 0.0)}
-        for s in selected_labels:
-            color_dict_rgb[s] = to_rgba(self.labels.get_color(s))
-        print(color_dict_rgb)
+        if len(selected_labels) > 0:
+            # look up the colors of all labels at once in the original colormap of the layer
+            colors = np.asarray(self.cmap.map(selected_labels), dtype = float).reshape(len(selected_labels), 4)
+            color_dict_rgb.update(zip(selected_labels.tolist(), map(tuple, colors)))
         return DirectLabelColormap(color_dict=color_dict_rgb)
 
-    def _save(self, stop=False) -> None:
-        """Save the current labels layer and label dataframe"""
+    def _save(self, stop=False, time_points:List[int] = None) -> None:
+        """Save the current labels layer and label dataframe. If time_points is given, only the label images of those time points are saved (e.g. when they leave the time window), without the label dataframe."""
         
+        self.update_coalescer.flush()
         if stop:
             self.stopbtn.setEnabled(False)
             self.startbtn.setEnabled(True)
             self.running = False
             self.table_widget._disable_editing()
             self.savebtn.setEnabled(False)
+            self._update_undo_buttons()
+            self.autosave_timer.stop()
+
+        # Time points loaded on demand keep track of their own edits, include those as well.
+        if isinstance(self.labels.data, LazyTiffStack):
+            self.dirty_frames.update(self.labels.data.edited_frames)
+
+        # Nothing was edited since the last save, or a save or autosave is still running (its finished signal triggers a new save if needed).
+        partial = time_points is not None
+        saved_frames = sorted(self.dirty_frames.intersection(time_points) if partial else self.dirty_frames)
+        if len(saved_frames) == 0 and (partial or not self.annotations_changed):
+            return
+        if self.save_worker is not None or self.journal_worker is not None:
+            self.save_requested = True
+            return
+        self.save_requested = False
+
+        # Background reads must not touch the files that are about to be replaced.
+        for stack in self._windowed_stacks():
+            stack.wait_for_prefetch()
+
+        # Take a snapshot of the label images of the time points that were edited, so that the user can continue editing while saving.
+        frames = {i: np.array(self.labels.data[i, :, :, :], copy = True) for i in saved_frames}
+        self.dirty_frames.difference_update(saved_frames)
+
+        if partial:
+            # The other time points stay unsaved, so the journal is kept. The saved regions that are not in the journal yet are added first, so that replaying the journal after a crash cannot restore an older state of these time points.
+            regions = []
+            for t in saved_frames:
+                if t in self.journal_regions:
+                    box = self.journal_regions.pop(t)
+                    if box is None:
+                        box = tuple(slice(0, n) for n in frames[t].shape)
+                    regions.append((t, box, frames[t][box]))
+            record = JournalRecord(regions, {}, []) if len(regions) > 0 else None
+            result = None
+        else:
+            # Everything edited so far is part of this save, edits made while saving go into a new journal.
+            self.journal.rotate()
+            self.journal_regions = {}
+            self.journal_parents = dict(self.lineage.parents)
+            self.journal_version = self.lineage.version
+            record = None
+
+            # Add the parents from the lineage graph.
+            result = self._label_table()[['time_point', 'label', 'area', 'cell', 'parent']]
+            self.annotations_changed = False
+
+        # Write the snapshot in a background thread.
+        self.save_progress.setMaximum(len(frames) + 1)
+        self.save_progress.setValue(0)
+        self.save_progress.setFormat('Saving %v / %m')
+        self.save_progress.setVisible(True)
+        if self.label_store is not None:
+            # Only the chunks that changed are rewritten. If the labels were promoted to a larger dtype, the worker converts the store first.
+            stack = self.labels.data if isinstance(self.labels.data, LazyZarrStack) else None
+            task = write_zarr_snapshot(self.label_dir, frames, result, dtype = self.labels.data.dtype, stack = stack)
+        else:
+            task = write_snapshot(self.label_dir, {self.label_files[i]: frame for i, frame in frames.items()}, result)
+        self.save_worker = create_worker(append_before, self.journal, record, task)
+        self.save_worker.yielded.connect(self._on_save_progress)
+        self.save_worker.returned.connect(lambda store: self._on_save_finished(saved_frames, store, partial))
+        self.save_worker.errored.connect(lambda e: self._on_save_failed(saved_frames, e, partial))
+        self.save_worker.start()
+
+    def _set_autosave_interval(self, seconds:int) -> None:
+        """Change the autosave interval, 0 disables autosaving"""
+
+        self.autosave_timer.stop()
+        if seconds > 0:
+            self.autosave_timer.setInterval(seconds * 1000)
+            if self.running:
+                self.autosave_timer.start()
+
+    def _journal_parent_changes(self) -> Tuple[Dict[int, int], List[int]]:
+        """Return the parents that changed and the labels that were removed since the last autosave"""
+
+        if self.journal_version == self.lineage.version:
+            return {}, []
+        parents = self.lineage.parents
+        changed = {label: parent for label, parent in parents.items() if self.journal_parents.get(label) != parent}
+        removed = [label for label in self.journal_parents if label not in parents]
+        return changed, removed
+
+    def _autosave(self) -> None:
+        """Append the regions and parents edited since the previous autosave to the recovery journal, compressing and writing in a background thread"""
+
+        if not self.running or self.journal is None or self.journal_worker is not None or self.save_worker is not None:
+            return # try again at the next interval
+        self.update_coalescer.flush()
+        parents, removed = self._journal_parent_changes()
+        if len(self.journal_regions) == 0 and len(parents) == 0 and len(removed) == 0:
+            return
 
-        # Save all label image data.
-        for i in range(self.labels.data.shape[0]):
-            reconstructed_labels = self.labels.data[i, :, :, :]
-            tifffile.imwrite(os.path.join(self.label_dir, self.label_files[i]), reconstructed_labels, bigtiff=True)
+        # Copy the current content of the edited regions, so that the user can continue editing.
+        regions = []
+        for t, box in sorted(self.journal_regions.items()):
+            if box is None:
+                box = tuple(slice(0, n) for n in self.labels.data.shape[1:])
+            regions.append((t, box, np.array(self.labels.data[(t,) + box], copy = True)))
+        record = JournalRecord(regions, parents, removed)
+        previous_parents = self.journal_parents
+        self.journal_regions = {}
+        self.journal_parents = dict(self.lineage.parents)
+        self.journal_version = self.lineage.version
+
+        self.journal_worker = create_worker(self.journal.append, record)
+        self.journal_worker.errored.connect(lambda e: self._on_autosave_failed(record, previous_parents, e))
+        self.journal_worker.finished.connect(self._on_autosave_finished)
+        self.journal_worker.start()
+
+    def _on_autosave_finished(self) -> None:
+        """Start a save that was requested while the journal was being written"""
+
+        self.journal_worker = None
+        if self.save_requested and self.save_worker is None:
+            self._save()
+
+    def _on_autosave_failed(self, record:JournalRecord, previous_parents:Dict[int, int], error:Exception) -> None:
+        """Keep the regions and parents of a record that could not be written, so that they go into the next autosave"""
+
+        show_warning(f'autosave failed: {error}')
+        for t, box, _ in record.regions:
+            self._mark_dirty([t], box)
+        self.journal_parents = previous_parents
+        self.journal_version = None
+
+    def _offer_journal_replay(self) -> None:
+        """Open the recovery journal of the label directory, and offer to restore the edits in it if it is newer than the saved data"""
+
+        self.journal = EditJournal(os.path.join(self.label_dir, 'LabelAnnotations.journal'))
+        self.journal_regions = {}
+        self.journal_parents = dict(self.lineage.parents)
+        self.journal_version = self.lineage.version
+        if not self.journal.exists():
+            return
 
-        # Merge the dataframe with the information from parent_labels and save dataframe and plot.
-        self.parent_labels['parent'] = self.parent_labels['parent'].astype(int)
-        result = pd.merge(self.label_df[['time_point', 'label', 'area', 'cell']], self.parent_labels, on = 'label', how = 'left')
-        result['parent'] = result['parent'].fillna(-1)
-        result.to_csv(os.path.join(self.label_dir, 'LabelAnnotations.csv'), index = False)
+        # Only the table marks a complete save, label images are also written when they leave the time window while the journal is kept.
+        saved_files = [os.path.join(self.label_dir, 'LabelAnnotations.csv')]
+        if self.journal.is_newer_than(saved_files):
+            answer = QMessageBox.question(self, 'Recover unsaved edits', 'Edits that were not saved in a previous session were found in the label directory. Do you want to restore them?', QMessageBox.Yes | QMessageBox.No)
+            if answer == QMessageBox.Yes:
+                self._replay_journal()
+                return
+        self.journal.clear()
+
+    def _replay_journal(self) -> None:
+        """Write the regions and parents of all journal records back into the labels layer and the lineage graph"""
+
+        time_points = set()
+        for record in self.journal.records():
+            for t, box, data in record.regions:
+                if data.size > 0:
+                    self._ensure_label_capacity(int(data.max()))
+                self.labels.data[(t,) + box] = data
+                self._mark_dirty([t], box)
+                time_points.add(t)
+            for label, parent in record.parents.items():
+                self.lineage.set_parent(label, parent)
+            for label in record.removed_labels:
+                self.lineage.remove(label)
+        self.labels.refresh()
+        show_info(f'restored {len(time_points)} time points from the recovery journal')
+
+        for t in sorted(time_points):
+            self._update_label_areas(t) # the labels that were overwritten are not known, count and index the time points completely
+        self.annotations_changed = True
+
+        # The restored edits are in the journal already.
+        self.journal.compact()
+        self.journal_regions = {}
+        self.journal_parents = dict(self.lineage.parents)
+        self.journal_version = self.lineage.version
+
+    def _on_save_progress(self, progress) -> None:
+        """Update the progress bar with the number of files written"""
+
+        written, total = progress
+        self.save_progress.setMaximum(total)
+        self.save_progress.setValue(written)
+
+    def _on_save_finished(self, saved_frames:List[int], promoted_store = None, partial:bool = False) -> None:
+        """Release the saved time points, switch to the promoted zarr store if the save converted it, and start a new save if one was requested in the meantime"""
+
+        if promoted_store is not None:
+            self.label_store = promoted_store
+        if isinstance(self.labels.data, LazyTiffStack):
+            # the saved time points are on disk now and no longer need to be pinned in memory, unless they were edited again during the save
+            self.labels.data.mark_saved([t for t in saved_frames if t not in self.dirty_frames])
+        if not partial:
+            self.journal.commit_rotation()
+        self.save_worker = None
+        self.save_progress.setVisible(False)
+        if self.save_requested:
+            self._save()
+
+    def _on_save_failed(self, saved_frames:List[int], error:Exception, partial:bool = False) -> None:
+        """Restore the dirty state so that no edits get lost, and inform the user"""
+
+        self.dirty_frames.update(saved_frames)
+        self.save_worker = None
+
+        # Keep the journal of the edits that were not saved.
+        for t in saved_frames:
+            self._mark_dirty([t])
+        if not partial:
+            self.annotations_changed = True
+            self.journal.abort_rotation()
+            self.journal_parents = {}
+            self.journal_version = None
+        self.save_progress.setVisible(False)
+
+        msg = QMessageBox()
+        msg.setWindowTitle("Saving failed")
+        msg.setText(f"The label data could not be saved, the files on disk were left unchanged. This is the error: {error}")
+        msg.setIcon(QMessageBox.Warning)
+        msg.setStandardButtons(QMessageBox.Ok)
+        msg.exec_()
@@ -5,7 +5,6 @@ import pandas                       as pd
 import numpy                        as np
 
 from typing                             import Tuple, List
-from skimage.io                         import imread
 from qtpy.QtWidgets                     import QMessageBox, QGroupBox, QCheckBox, QWidget, QVBoxLayout, QHBoxLayout, QComboBox, QPushButton, QFileDialog, QLineEdit, QTabWidget
 
 from .utilities._checkboxWidget               import featuresCheckboxWidget
@@ -13,6 +12,8 @@ from .utilities._voxel_dimension_widget       import VoxelDimensionWidget
 from .utilities._measure_props                import calculate_extended_props
 from .utilities._plot_widget                  import PlotWidget
 from .utilities._table_widget                 import ColoredTableWidget
+from .utilities._label_store                  import has_zarr_labels, read_label_stack
+from .utilities._tiff_index                   import index_tiff_directory
 
 class MeasureLabelTracks(QWidget):
     """Measure the label properties in tracked 3D labels"""
@@ -94,13 +95,8 @@ class MeasureLabelTracks(QWidget):
     def _load_labels(self) -> np.ndarray:
         """Load the original label image, and create a new labels layer with tracked labels only"""
         
-        # Create a new labels layer holding the concatenated 4D array of label images.
-        stack = []
-        for f in self.files:
-            img = imread(os.path.join(self.labeldir, f))
-            stack.append(img)
-        
-        return np.stack(stack, axis = 0)
+        # Create a new labels layer holding the 4D array of label images.
+        return read_label_stack(self.labeldir, self.files)
     
     def _load_tracked_labels(self) -> napari.layers.Labels:
         """Filter labels based on tracked labels."""
@@ -154,17 +150,27 @@ class MeasureLabelTracks(QWidget):
             msg.exec_()
         
         else:
-            self.files = sorted([f for f in os.listdir(self.labeldir) if '.tif' in f and not f.startswith('.')])
+            tiffs = index_tiff_directory(self.labeldir)
+            self.files = tiffs.files
+            problems = tiffs.validate(integer = True) if len(self.files) > 0 and not has_zarr_labels(self.labeldir) else []
 
             # Check if the label directory contains tif images. 
-            if len(self.files) == 0:
+            if len(self.files) == 0 and not has_zarr_labels(self.labeldir):
                 msg = QMessageBox()
                 msg.setWindowTitle("No label files found")
-                msg.setText("The given label directory does not contain any .tif label images.")
+                msg.setText("The given label directory does not contain any .tif label images or a labels.zarr store.")
                 msg.setIcon(QMessageBox.Information)
                 msg.setStandardButtons(QMessageBox.Ok)
                 msg.exec_()
 
+            elif len(problems) > 0:
+                msg = QMessageBox()
+                msg.setWindowTitle("Inconsistent tif files")
+                msg.setText("The tif files do not all have the same shape:\n" + "\n".join(problems[:10]) + ("\n..." if len(problems) > 10 else ""))
+                msg.setIcon(QMessageBox.Warning)
+                msg.setStandardButtons(QMessageBox.Ok)
+                msg.exec_()
+
             else: 
                 # Load the data, create a labels layer
                 if self.labels is not None: 
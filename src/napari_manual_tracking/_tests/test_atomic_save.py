@@ -0,0 +1,47 @@
+import os
+import tifffile
+
+import numpy                as np
+import pandas               as pd
+import pytest
+
+from napari_manual_tracking.utilities import _atomic_save
+from napari_manual_tracking.utilities._atomic_save import write_snapshot
+
+def _write_originals(directory):
+    for t in range(3):
+        tifffile.imwrite(directory / f'labels_TP{t:04d}.tif', np.full((2, 3, 3), t, dtype = np.uint16))
+    pd.DataFrame({'label': [2]}).to_csv(directory / 'LabelAnnotations.csv', index = False)
+
+def _snapshot(directory):
+    return {f: (directory / f).read_bytes() for f in sorted(os.listdir(directory))}
+
+def test_write_snapshot_replaces_all_files(tmp_path):
+    _write_originals(tmp_path)
+    frames = {f'labels_TP{t:04d}.tif': np.full((2, 3, 3), 10 + t, dtype = np.uint16) for t in range(3)}
+    progress = list(write_snapshot(str(tmp_path), frames, pd.DataFrame({'label': [5]})))
+
+    assert progress == [(1, 4), (2, 4), (3, 4), (4, 4)]
+    assert sorted(os.listdir(tmp_path)) == ['LabelAnnotations.csv', 'labels_TP0000.tif', 'labels_TP0001.tif', 'labels_TP0002.tif']
+    assert [int(tifffile.imread(tmp_path / f)[0, 0, 0]) for f in frames] == [10, 11, 12]
+    assert pd.read_csv(tmp_path / 'LabelAnnotations.csv')['label'].tolist() == [5]
+
+def test_failure_partway_leaves_the_files_unchanged(tmp_path, monkeypatch):
+    _write_originals(tmp_path)
+    before = _snapshot(tmp_path)
+    imwrite = tifffile.imwrite
+    calls = []
+
+    def failing_imwrite(*args, **kwargs):
+        calls.append(args[0])
+        if len(calls) == 2:
+            raise OSError('disk full')
+        return imwrite(*args, **kwargs)
+
+    monkeypatch.setattr(_atomic_save.tifffile, 'imwrite', failing_imwrite)
+    frames = {f'labels_TP{t:04d}.tif': np.full((2, 3, 3), 10 + t, dtype = np.uint16) for t in range(3)}
+    with pytest.raises(OSError):
+        list(write_snapshot(str(tmp_path), frames, pd.DataFrame({'label': [5]})))
+
+    assert len(calls) == 2
+    assert _snapshot(tmp_path) == before # no file replaced and no temporary file left
@@ -0,0 +1,125 @@
+import numpy                as np
+import pandas               as pd
+
+from napari_manual_tracking.utilities._batch_edit import BatchLabelEditor
+from napari_manual_tracking.utilities._edit_history import SparseEdit
+from napari_manual_tracking.utilities._label_index import LabelIndex
+from napari_manual_tracking.utilities._label_stats import label_areas
+from napari_manual_tracking.utilities._lineage_graph import LineageGraph
+
+def _stack() -> np.ndarray:
+    """Four time points with labels 2, 3 and 4 in separate corners, and label 5 in the middle of the last two"""
+
+    data = np.zeros((4, 2, 12, 12), dtype = np.uint16)
+    data[:, :, 0:3, 0:3] = 2
+    data[:, :, 0:4, 8:12] = 3
+    data[:, 1, 9:12, 0:2] = 4
+    data[2:, 0, 5:7, 5:7] = 5
+    return data
+
+def _table(data:np.ndarray) -> pd.DataFrame:
+    rows = []
+    for t in range(data.shape[0]):
+        for label, area in zip(*label_areas(data[t])):
+            rows.append({'time_point': t, 'label': int(label), 'area': int(area), 'cell': 'Cell ' + str(label).zfill(5), 'parent': 0})
+    return pd.DataFrame(rows)
+
+def _naive(data:np.ndarray, operations) -> np.ndarray:
+    """Apply the operations one by one, frame by frame, over the full frames"""
+
+    data = data.copy()
+    for operation in operations:
+        kind = operation[0]
+        if kind == 'set_parent':
+            continue
+        if kind == 'delete':
+            operation = ('convert', operation[1], 0) + tuple(operation[2:])
+        time_points = operation[3] if len(operation) > 3 else range(data.shape[0])
+        for t in time_points:
+            frame = data[t]
+            a, b = frame == operation[1], frame == operation[2]
+            frame[a] = operation[2]
+            if kind == 'swap':
+                frame[b] = operation[1]
+    return data
+
+def _sorted_rows(df:pd.DataFrame) -> list:
+    return sorted(zip(df['time_point'].tolist(), df['label'].tolist(), df['area'].tolist()))
+
+def _check(operations) -> BatchLabelEditor:
+    data = _stack()
+    expected = _naive(data, operations)
+    editor = BatchLabelEditor(data, _table(data), LineageGraph({2: 0, 3: 2, 4: 2, 5: 0}))
+    editor.apply(operations)
+    np.testing.assert_array_equal(editor.data, expected)
+    assert _sorted_rows(editor.label_df) == _sorted_rows(_table(expected))
+    assert (editor.label_df['cell'] == 'Cell ' + editor.label_df['label'].astype(str).str.zfill(5)).all()
+    return editor
+
+def test_chained_convert_and_swap():
+    _check([('convert', 2, 7), ('swap', 7, 3), ('convert', 3, 9, [1, 2])])
+
+def test_swap_back_and_forth_is_a_no_op():
+    editor = _check([('swap', 2, 3), ('swap', 3, 2)])
+    np.testing.assert_array_equal(editor.data, _stack())
+
+def test_per_time_point_operations_compose():
+    editor = _check([('convert', 5, 4, [2]), ('swap', 4, 2, [0, 2, 3]), ('delete', 3, [3])])
+    assert 5 in editor.lineage # still present at time point 3
+    assert 3 in editor.lineage
+
+def test_convert_into_an_existing_label_merges_rows():
+    editor = _check([('convert', 4, 2)])
+    rows = editor.label_df[(editor.label_df['label'] == 2)]
+    assert len(rows) == 4 # one row per time point
+    assert rows['area'].tolist() == [18 + 6] * 4
+    assert not editor.label_df.duplicated(subset = ['time_point', 'label']).any()
+    assert 4 not in editor.lineage # removed everywhere
+
+def test_chain_into_existing_label_merges_rows():
+    _check([('convert', 5, 6), ('convert', 6, 3), ('swap', 3, 4, [3])])
+
+def test_new_label_gets_a_lineage_and_parents_are_set():
+    editor = _check([('convert', 5, 11), ('set_parent', 11, 3)])
+    assert editor.lineage.parent(11) == 3
+    assert 5 not in editor.lineage
+
+class _RecordingArray:
+    """Wraps an array and records the keys that are read and written"""
+
+    def __init__(self, data:np.ndarray):
+        self.data = data
+        self.shape = data.shape
+        self.reads, self.writes = [], []
+
+    def __getitem__(self, key):
+        self.reads.append(key)
+        return self.data[key]
+
+    def __setitem__(self, key, value):
+        self.writes.append(key)
+        self.data[key] = value
+
+def _inside(key, box) -> bool:
+    return all(k.start >= b.start and k.stop <= b.stop for k, b in zip(key[1:], box))
+
+def test_edits_are_restricted_to_bounding_boxes():
+    data = _RecordingArray(_stack())
+    index = LabelIndex(data.shape[0])
+    index.ensure_indexed(data.data, range(data.shape[0]))
+    editor = BatchLabelEditor(data, _table(data.data), LineageGraph({2: 0, 3: 0, 4: 0, 5: 0}), index)
+
+    edit = SparseEdit('test', [2, 3], range(4), rows_before = None)
+    regions = editor.apply([('swap', 2, 5, [2, 3])], edit)
+
+    union = (slice(0, 2), slice(0, 7), slice(0, 7)) # boxes of labels 2 and 5
+    assert regions == {2: union, 3: union}
+    assert all(key[0] in (2, 3) and _inside(key, union) for key in data.reads + data.writes)
+    assert len(data.writes) == 2
+
+    # Only the swapped voxels are recorded, as flat indices into the full time point.
+    flat, old, new = edit.voxels[2]
+    assert len(flat) == 18 + 4
+    np.testing.assert_array_equal(data.data[2].ravel()[flat], new)
+    np.testing.assert_array_equal(_stack()[2].ravel()[flat], old)
+    np.testing.assert_array_equal(data.data, _naive(_stack(), [('swap', 2, 5, [2, 3])]))
@@ -0,0 +1,89 @@
+import os
+
+import numpy                as np
+import pandas               as pd
+import pytest
+import tifffile
+
+from napari_manual_tracking.utilities._consistency import check_label_directory, find_cycles, repair_label_directory
+
+def _normalized(cycles):
+    """Rotate every cycle to start at its smallest label, and sort them"""
+
+    return sorted(tuple(c[c.index(min(c)):] + c[:c.index(min(c))]) for c in cycles)
+
+def test_find_cycles():
+    assert find_cycles([], []) == []
+    assert find_cycles([2, 3, 4], [0, 2, 3]) == [] # a single lineage
+    assert find_cycles([2, 3], [-1, 99]) == [] # untracked, and a parent that is not in the table
+    assert _normalized(find_cycles([5], [5])) == [(5,)]
+
+    labels = [10, 2, 3, 4, 5, 6, 7, 8]
+    parents = [2, 3, 4, 2, 4, 7, 6, 0] # 2 -> 3 -> 4 -> 2, 5 hangs below the cycle, 6 <-> 7
+    assert _normalized(find_cycles(labels, parents)) == [(2, 3, 4), (6, 7)]
+
+def test_find_cycles_long_chain():
+    n = 1000
+    labels = np.arange(2, n + 2)
+    parents = labels + 1 # a long chain, closed into one cycle at the end
+    parents[-1] = 2
+    cycles = find_cycles(labels, parents)
+    assert len(cycles) == 1
+    assert sorted(cycles[0]) == labels.tolist()
+
+    parents[-1] = 0
+    assert find_cycles(labels, parents) == []
+
+def _label_directory(directory) -> None:
+    """Two time points: label 2 divides into 3 and 4, label 5 only occurs in the images"""
+
+    frames = np.zeros((2, 1, 6, 6), dtype = np.uint16)
+    frames[0, 0, 0:2, 0:2] = 2
+    frames[1, 0, 0:2, 0:1] = 3
+    frames[1, 0, 0:2, 1:2] = 4
+    frames[1, 0, 4:6, 4:6] = 5
+    for t, frame in enumerate(frames):
+        tifffile.imwrite(os.path.join(directory, f'labels_TP{t:04d}.tif'), frame)
+
+    table = pd.DataFrame({
+        'time_point': [0, 1, 1, 1, 1],
+        'label': [2, 3, 4, 6, 7],
+        'area': [4, 2, 2, 1, 1],
+        'cell': ['Cell 00002', 'Cell 00003', 'Cell 00004', 'Cell 00006', 'Cell 00007'],
+        'parent': [0, 2, 2, 7, 6], # 6 and 7 have no voxels and form a cycle
+    })
+    table.to_csv(os.path.join(directory, 'LabelAnnotations.csv'), index = False)
+
+def test_check_and_repair(tmp_path):
+    _label_directory(tmp_path)
+    report = check_label_directory(str(tmp_path), max_workers = 2)
+    assert not report.is_consistent
+    assert report.missing_rows.values.tolist() == [[1, 5, 4]]
+    assert sorted(report.empty_rows['label'].tolist()) == [6, 7]
+    assert _normalized(report.cycles) == [(6, 7)]
+    assert '1 label(s) in the images are missing from the table: 5 (time point 1)' in report.summary()
+
+    repair_label_directory(str(tmp_path), report)
+    assert [f for f in os.listdir(tmp_path) if f.endswith('.tmp')] == []
+    repaired = pd.read_csv(tmp_path / 'LabelAnnotations.csv')
+    assert repaired.values.tolist() == [
+        [0, 2, 4, 'Cell 00002', 0],
+        [1, 3, 2, 'Cell 00003', 2],
+        [1, 4, 2, 'Cell 00004', 2],
+        [1, 5, 4, 'Cell 00005', -1],
+    ]
+    assert check_label_directory(str(tmp_path)).is_consistent
+
+def test_failed_repair_keeps_the_table(tmp_path, monkeypatch):
+    _label_directory(tmp_path)
+    original = (tmp_path / 'LabelAnnotations.csv').read_bytes()
+    report = check_label_directory(str(tmp_path))
+
+    def fail(*args, **kwargs):
+        raise OSError('disk full')
+
+    monkeypatch.setattr(pd.DataFrame, 'to_csv', fail)
+    with pytest.raises(OSError):
+        repair_label_directory(str(tmp_path), report)
+    assert (tmp_path / 'LabelAnnotations.csv').read_bytes() == original
+    assert sorted(os.listdir(tmp_path)) == ['LabelAnnotations.csv', 'labels_TP0000.tif', 'labels_TP0001.tif']
@@ -0,0 +1,150 @@
+import os
+import sys
+import time
+import threading
+import trackpy
+import tifffile
+
+import numpy                as np
+import pandas               as pd
+import pytest
+
+from napari_manual_tracking.utilities._detection import DetectionCache, detection_task, locate_frame, locate_frames, locate_region, preprocess_cache_available
+
+def _write_frames(directory, n_time_points:int = 4, noise:float = 0):
+    """Write one small 3D image per time point with a few bright blobs, shifted over time"""
+
+    rng = np.random.default_rng(0)
+    zz, yy, xx = np.mgrid[0:16, 0:32, 0:32]
+    files = []
+    for t in range(n_time_points):
+        image = rng.normal(10, noise, size = zz.shape)
+        for z, y, x in [(8, 8, 8), (8, 20, 12), (7, 12, 24)]:
+            image += 200 * np.exp(-((zz - z) ** 2 + (yy - y - t) ** 2 + (xx - x) ** 2) / 4)
+        files.append(f'image_TP{t:04d}.tif')
+        tifffile.imwrite(directory / files[-1], image.astype(np.uint16))
+    return files
+
+def test_locate_frames_in_threads(tmp_path):
+    files = _write_frames(tmp_path)
+    sequential = dict(locate_frames(str(tmp_path), files, (5, 5, 5), (6, 6, 6), max_workers = 1))
+    threaded = dict(locate_frames(str(tmp_path), files, (5, 5, 5), (6, 6, 6), max_workers = 3))
+    assert sorted(threaded) == [0, 1, 2, 3]
+    for t in range(len(files)):
+        assert len(threaded[t]) == 3
+        assert (threaded[t]['time_point'] == t).all()
+        assert threaded[t].equals(sequential[t])
+
+def test_detection_releases_the_gil(tmp_path):
+    """The thread pool in locate_frames only pays off if locate_frame spends most of its time outside the GIL"""
+
+    rng = np.random.default_rng(0)
+    zz, yy, xx = np.mgrid[0:32, 0:128, 0:128]
+    image = rng.normal(100, 5, size = zz.shape)
+    for z, y, x in rng.integers(4, 124, size = (30, 3)):
+        image += 500 * np.exp(-((zz - z % 28) ** 2 + (yy - y) ** 2 + (xx - x) ** 2) / 8)
+    tifffile.imwrite(tmp_path / 'frame.tif', image.astype(np.uint16))
+    locate_frame(str(tmp_path), 'frame.tif', 0, (7, 7, 7), (8, 8, 8)) # warm up trackpy
+
+    # A thread that wakes up every millisecond can only run while the GIL is released, as the switch interval keeps it from taking the GIL otherwise.
+    stop, gaps = threading.Event(), []
+    def tick():
+        last = time.perf_counter()
+        while not stop.is_set():
+            time.sleep(0.001)
+            now = time.perf_counter()
+            gaps.append(now - last)
+            last = now
+    switch_interval = sys.getswitchinterval()
+    sys.setswitchinterval(1)
+    ticker = threading.Thread(target = tick)
+    try:
+        ticker.start()
+        start = time.perf_counter()
+        locate_frame(str(tmp_path), 'frame.tif', 0, (7, 7, 7), (8, 8, 8))
+        total = time.perf_counter() - start
+    finally:
+        stop.set()
+        ticker.join()
+        sys.setswitchinterval(switch_interval)
+    held = sum(gap for gap in gaps if gap > 0.005)
+    assert held < 0.5 * total
+
+def test_cancel_stops_after_the_running_time_points(tmp_path):
+    files = _write_frames(tmp_path, n_time_points = 6)
+    cancel = threading.Event()
+    task = detection_task(str(tmp_path), files, (5, 5, 5), (6, 6, 6), max_workers = 2, cancel = cancel)
+    kind, images = next(task)
+    assert kind == 'images' and images.shape == (6, 16, 32, 32)
+
+    kind, (t, d) = next(task)
+    cancel.set()
+    frames = [t]
+    try:
+        while True:
+            frames.append(next(task)[1][0])
+    except StopIteration as stop:
+        assert stop.value is None # not all time points were done
+    assert len(frames) < len(files)
+
+@pytest.mark.skipif(not preprocess_cache_available(), reason = 'the separate steps of trackpy.locate can not be imported')
+def test_preprocess_cache_matches_trackpy_locate(tmp_path):
+    files = _write_frames(tmp_path, n_time_points = 1, noise = 3)
+    raw_image = tifffile.imread(tmp_path / files[0])
+    cache_dir = str(tmp_path / 'cache')
+
+    for separation in [(6, 6, 6), (4, 8, 8), (6, 6, 6)]: # filtered and cached, then loaded from the cache twice
+        expected = trackpy.locate(raw_image, diameter = (5, 7, 7), separation = separation)
+        d = locate_frame(str(tmp_path), files[0], 0, (5, 7, 7), separation, cache_dir = cache_dir)
+        assert len(d) > 3 # also some of the noise
+        pd.testing.assert_frame_equal(d.drop(columns = 'time_point'), expected)
+    assert len(os.listdir(cache_dir)) == 2 # one .npy and one .json file
+
+def test_detection_cache_hits_and_misses(tmp_path):
+    (tmp_path / 'images').mkdir()
+    files = _write_frames(tmp_path / 'images', n_time_points = 2)
+    path = str(tmp_path / 'images' / files[0])
+    cache = DetectionCache(str(tmp_path / 'cache'))
+    d = locate_frame(str(tmp_path / 'images'), files[0], 0, (5, 5, 5), (6, 6, 6)).drop(columns = 'time_point')
+
+    assert cache.load(path, (5, 5, 5), (6, 6, 6)) is None
+    cache.store(path, (5, 5, 5), (6, 6, 6), d)
+    pd.testing.assert_frame_equal(cache.load(path, (5, 5, 5), (6, 6, 6)), d)
+
+    assert cache.load(path, (5, 5, 5), (7, 6, 6)) is None # other separation
+    assert cache.load(path, (7, 5, 5), (6, 6, 6)) is None # other diameter
+
+    stat = os.stat(path)
+    os.utime(path, ns = (stat.st_atime_ns, stat.st_mtime_ns + 10**9)) # same content, newer modification time
+    assert cache.load(path, (5, 5, 5), (6, 6, 6)) is None
+
+    tifffile.imwrite(path, np.zeros((16, 32, 32), dtype = np.uint16)) # other content
+    assert cache.load(path, (5, 5, 5), (6, 6, 6)) is None
+
+def test_detection_cache_keeps_files_of_other_directories_apart(tmp_path):
+    for directory in ('a', 'b'):
+        (tmp_path / directory).mkdir()
+        _write_frames(tmp_path / directory, n_time_points = 1)
+    path_a, path_b = str(tmp_path / 'a' / 'image_TP0000.tif'), str(tmp_path / 'b' / 'image_TP0000.tif')
+    cache = DetectionCache(str(tmp_path / 'cache'))
+    d = pd.DataFrame({'z': [1.0], 'y': [2.0], 'x': [3.0]})
+
+    cache.store(path_a, (5, 5, 5), (6, 6, 6), d)
+    cache.store(path_b, (5, 5, 5), (6, 6, 6), d * 2) # does not replace the entry of path_a
+    pd.testing.assert_frame_equal(cache.load(path_a, (5, 5, 5), (6, 6, 6)), d)
+    pd.testing.assert_frame_equal(cache.load(path_b, (5, 5, 5), (6, 6, 6)), d * 2)
+
+    cache.clear()
+    assert cache.load(path_a, (5, 5, 5), (6, 6, 6)) is None and cache.load(path_b, (5, 5, 5), (6, 6, 6)) is None
+
+def test_locate_region_matches_the_full_frame(tmp_path):
+    files = _write_frames(tmp_path, n_time_points = 1)
+    full = trackpy.locate(tifffile.imread(tmp_path / files[0]), diameter = (5, 5, 5), separation = (6, 6, 6))
+    # The box cuts through the objects at (8, 8, 8) and (8, 20, 12), the one at (7, 12, 24) is outside.
+    box = (slice(0, 16), slice(6, 21), slice(0, 18))
+    inside = full[(full['y'] >= 5.5) & (full['y'] < 20.5) & (full['x'] < 17.5)]
+
+    d = locate_region(str(tmp_path), files[0], 3, (5, 5, 5), (6, 6, 6), box)
+    assert len(inside) == 2
+    assert (d['time_point'] == 3).all()
+    np.testing.assert_allclose(d.sort_values('y')[['z', 'y', 'x', 'mass']].to_numpy(), inside.sort_values('y')[['z', 'y', 'x', 'mass']].to_numpy(), rtol = 1e-3)
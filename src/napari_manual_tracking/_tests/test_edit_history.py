@@ -0,0 +1,97 @@
+import numpy                as np
+import pandas               as pd
+
+from napari_manual_tracking.utilities._edit_history import EditHistory, SparseEdit
+
+def _restore(data:np.ndarray, edit:SparseEdit, undo:bool) -> None:
+    """Write the old (undo) or new (redo) voxel values of an edit back, like the manual tracker does"""
+
+    for t, (flat_indices, old_values, new_values) in edit.voxels.items():
+        coords = np.unravel_index(flat_indices, data.shape[1:])
+        data[(t,) + coords] = old_values if undo else new_values
+
+def _paint(data:np.ndarray, t:int, box:tuple, value:int, description:str = 'paint') -> SparseEdit:
+    """Fill a box with a value and record the change"""
+
+    edit = SparseEdit(description, [value], [t], rows_before = pd.DataFrame({'label': [], 'time_point': []}))
+    old = data[t].copy()
+    data[(t,) + box] = value
+    flat = np.flatnonzero(old != data[t])
+    edit.add_voxels(t, flat, old.ravel()[flat], data[t].ravel()[flat])
+    return edit
+
+def test_sparse_edit_records_only_changed_voxels():
+    data = np.zeros((2, 3, 4, 4), dtype = np.uint16)
+    data[0, 0, 0, 0] = 5
+    edit = _paint(data, 0, (0, slice(0, 2), slice(0, 2)), 5)
+
+    flat, old, new = edit.voxels[0]
+    assert len(flat) == 3 # the voxel that already had value 5 is not recorded
+    assert flat.dtype == np.uint32
+    assert old.tolist() == [0, 0, 0]
+    assert new.tolist() == [5, 5, 5]
+    assert edit.labels.tolist() == [5]
+    assert not edit.is_empty
+
+def test_undo_redo_restores_voxels():
+    data = np.zeros((2, 3, 4, 4), dtype = np.uint16)
+    history = EditHistory()
+    history.push(_paint(data, 0, (0, slice(0, 2), slice(0, 2)), 3, 'first'))
+    after_first = data.copy()
+    history.push(_paint(data, 1, (slice(None), 1, slice(None)), 4, 'second'))
+    after_second = data.copy()
+
+    edit = history.undo()
+    assert edit.description == 'second'
+    _restore(data, edit, undo = True)
+    np.testing.assert_array_equal(data, after_first)
+
+    edit = history.undo()
+    assert edit.description == 'first'
+    _restore(data, edit, undo = True)
+    assert not data.any()
+    assert not history.can_undo()
+    assert history.undo() is None
+
+    edit = history.redo()
+    assert edit.description == 'first'
+    _restore(data, edit, undo = False)
+    np.testing.assert_array_equal(data, after_first)
+
+    edit = history.redo()
+    _restore(data, edit, undo = False)
+    np.testing.assert_array_equal(data, after_second)
+    assert not history.can_redo()
+
+def test_push_clears_redo_and_skips_empty_edits():
+    data = np.zeros((1, 2, 2, 2), dtype = np.uint8)
+    history = EditHistory()
+    history.push(_paint(data, 0, (0,), 1))
+    history.undo()
+    assert history.can_redo()
+
+    history.push(SparseEdit('nothing', [], [], rows_before = None))
+    assert history.can_redo() # empty edits are not added
+
+    history.push(_paint(data, 0, (1,), 2))
+    assert not history.can_redo()
+
+def test_oldest_edits_are_evicted_under_max_bytes():
+    data = np.zeros((1, 1, 10, 10), dtype = np.uint16)
+    edits = [_paint(data, 0, (0, i), i + 1, f'row {i}') for i in range(5)]
+    size = edits[0].nbytes
+    assert all(edit.nbytes == size for edit in edits)
+
+    history = EditHistory(max_bytes = 3 * size)
+    assert [history.push(edit) for edit in edits] == [0, 0, 0, 1, 1]
+    assert history.nbytes <= 3 * size
+    assert [history.undo().description for _ in range(3)] == ['row 4', 'row 3', 'row 2']
+    assert not history.can_undo()
+
+    # Lowering the limit drops the oldest edits that can still be undone.
+    history = EditHistory()
+    for edit in edits:
+        history.push(edit)
+    assert history.set_max_bytes(2 * size) == 3
+    assert [history.undo().description for _ in range(2)] == ['row 4', 'row 3']
+    assert not history.can_undo()
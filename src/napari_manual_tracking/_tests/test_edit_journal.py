@@ -0,0 +1,111 @@
+import os
+
+import numpy                as np
+
+from napari_manual_tracking.utilities._edit_journal import EditJournal, JournalRecord, append_before
+
+def _record(t:int, value:int, parents = None, removed = None) -> JournalRecord:
+    box = (slice(0, 2), slice(1, 3), slice(0, 4))
+    return JournalRecord([(t, box, np.full((2, 2, 4), value, dtype = np.uint16))], parents or {}, removed or [])
+
+def _values(journal:EditJournal):
+    """(time point, first voxel value, parents, removed labels) of every record, oldest first"""
+
+    return [(r.regions[0][0], int(r.regions[0][2].flat[0]), r.parents, r.removed_labels) for r in journal.records()]
+
+def test_record_round_trip():
+    record = JournalRecord([(3, (slice(1, 2), slice(0, 5)), np.arange(5, dtype = np.uint32).reshape(1, 5))], {7: 2, 8: 0}, [9])
+    decoded = JournalRecord.from_bytes(record.to_bytes())
+
+    t, box, data = decoded.regions[0]
+    assert t == 3
+    assert box == (slice(1, 2), slice(0, 5))
+    assert data.dtype == np.uint32
+    np.testing.assert_array_equal(data, record.regions[0][2])
+    assert decoded.parents == {7: 2, 8: 0}
+    assert decoded.removed_labels == [9]
+
+def test_append_rotate_commit(tmp_path):
+    journal = EditJournal(str(tmp_path / 'LabelAnnotations.journal'))
+    assert not journal.exists()
+
+    journal.append(_record(0, 1, parents = {2: 0}))
+    journal.append(_record(1, 2))
+    journal.rotate() # a save starts
+    assert not os.path.exists(journal.path)
+    journal.append(_record(2, 3, removed = [4])) # edited during the save
+    assert _values(journal) == [(0, 1, {2: 0}, []), (1, 2, {}, []), (2, 3, {}, [4])]
+
+    journal.commit_rotation() # the save succeeded
+    assert _values(journal) == [(2, 3, {}, [4])]
+
+    journal.clear()
+    assert not journal.exists()
+
+def test_abort_rotation_keeps_the_order(tmp_path):
+    journal = EditJournal(str(tmp_path / 'LabelAnnotations.journal'))
+    journal.append(_record(0, 1))
+    journal.rotate()
+    journal.append(_record(1, 2))
+    journal.abort_rotation() # the save failed
+    assert not os.path.exists(journal.saving_path)
+    assert [v[:2] for v in _values(journal)] == [(0, 1), (1, 2)]
+
+    # A second failed save keeps the oldest records in front as well.
+    journal.rotate()
+    journal.append(_record(2, 3))
+    journal.rotate()
+    journal.append(_record(3, 4))
+    journal.abort_rotation()
+    assert [v[:2] for v in _values(journal)] == [(0, 1), (1, 2), (2, 3), (3, 4)]
+
+def test_truncated_record_is_skipped_and_compacted(tmp_path):
+    journal = EditJournal(str(tmp_path / 'LabelAnnotations.journal'))
+    journal.append(_record(0, 1))
+    journal.append(_record(1, 2))
+
+    # Simulate a crash while the second record was being written.
+    size = os.path.getsize(journal.path)
+    with open(journal.path, 'r+b') as f:
+        f.truncate(size - 10)
+    assert [v[:2] for v in _values(journal)] == [(0, 1)]
+
+    # Records appended after the incomplete one would be hidden behind it, compacting drops it.
+    journal.compact()
+    journal.append(_record(2, 3))
+    assert [v[:2] for v in _values(journal)] == [(0, 1), (2, 3)]
+
+def test_truncated_header_is_ignored(tmp_path):
+    journal = EditJournal(str(tmp_path / 'LabelAnnotations.journal'))
+    journal.append(_record(0, 1))
+    with open(journal.path, 'ab') as f:
+        f.write(b'\x05\x00') # only part of the length of the next record
+    assert [v[:2] for v in _values(journal)] == [(0, 1)]
+
+def test_is_newer_than(tmp_path):
+    saved = tmp_path / 'labels_TP0000.tif'
+    saved.write_bytes(b'')
+    journal = EditJournal(str(tmp_path / 'LabelAnnotations.journal'))
+    assert not journal.is_newer_than([str(saved)])
+
+    journal.append(_record(0, 1))
+    os.utime(saved, ns = (0, 0))
+    assert journal.is_newer_than([str(saved)])
+
+def test_append_before_a_save_task(tmp_path):
+    journal = EditJournal(str(tmp_path / 'LabelAnnotations.journal'))
+
+    def task():
+        assert journal.exists() # the record is written before the task starts
+        yield 1, 1
+        return 'done'
+
+    results = []
+    generator = append_before(journal, _record(4, 8), task())
+    try:
+        while True:
+            results.append(next(generator))
+    except StopIteration as stop:
+        results.append(stop.value)
+    assert results == [(1, 1), 'done']
+    assert [v[:2] for v in _values(journal)] == [(4, 8)]
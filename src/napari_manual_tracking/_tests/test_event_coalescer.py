@@ -0,0 +1,41 @@
+from napari_manual_tracking.utilities._event_coalescer import EventCoalescer
+
+def _coalescer(interval_ms:int = 50):
+    batches = []
+    return EventCoalescer(lambda regions, labels: batches.append((regions, labels)), interval_ms), batches
+
+def test_updates_within_the_interval_are_one_batch(qtbot):
+    coalescer, batches = _coalescer()
+    coalescer.add(0, 2, (slice(0, 1), slice(2, 4), slice(2, 4)))
+    coalescer.add(0, 2, (slice(0, 1), slice(3, 6), slice(1, 3)))
+    coalescer.add(1, 3, (slice(1, 2), slice(0, 1), slice(0, 1)))
+    assert batches == [] and coalescer.pending
+
+    qtbot.waitUntil(lambda: len(batches) > 0, timeout = 1000)
+    qtbot.wait(100) # no second batch follows
+    assert batches == [({0: (slice(0, 1), slice(2, 6), slice(1, 4)), 1: (slice(1, 2), slice(0, 1), slice(0, 1))}, {2, 3})]
+    assert not coalescer.pending
+
+def test_full_frame_updates_absorb_boxes(qtbot):
+    coalescer, batches = _coalescer()
+    coalescer.add(0, 2, (slice(0, 1), slice(0, 1), slice(0, 1)))
+    coalescer.add(0, 4) # full frame
+    coalescer.add(0, 5, (slice(1, 2), slice(0, 1), slice(0, 1)))
+    coalescer.flush()
+    assert batches == [({0: None}, {2, 4, 5})]
+
+def test_clear_drops_pending_updates(qtbot):
+    coalescer, batches = _coalescer()
+    coalescer.add(0, 2, (slice(0, 1), slice(0, 1), slice(0, 1)))
+    coalescer.clear()
+    assert not coalescer.pending
+    qtbot.wait(150)
+    assert batches == []
+    coalescer.flush()
+    assert batches == []
+
+def test_zero_interval_is_immediate(qtbot):
+    coalescer, batches = _coalescer(0)
+    coalescer.add(0, 2)
+    coalescer.add(1, 3)
+    assert batches == [({0: None}, {2}), ({1: None}, {3})]
@@ -0,0 +1,53 @@
+import tifffile
+
+import numpy                as np
+import pytest
+
+from napari_manual_tracking.utilities._label_dtype import compact_labels, memory_report, promote_label_dtype, promoted_label_dtype, smallest_label_dtype
+from napari_manual_tracking.utilities._lazy_stack import LazyTiffStack
+from napari_manual_tracking.utilities._parallel_read import read_tiff_stack
+
+def test_smallest_label_dtype():
+    assert smallest_label_dtype(0) == np.uint8
+    assert smallest_label_dtype(256) == np.uint16
+    assert smallest_label_dtype(10, minimum = np.uint16) == np.uint16
+    assert smallest_label_dtype(2 ** 40) == np.uint64
+    with pytest.raises(OverflowError):
+        smallest_label_dtype(2 ** 64)
+
+def test_promoted_label_dtype():
+    assert promoted_label_dtype(np.uint16, 100) == np.uint16
+    assert promoted_label_dtype(np.uint16, 70000) == np.uint32
+    assert promoted_label_dtype(np.int32, 2 ** 31) == np.uint32
+
+def test_promote_label_dtype():
+    assert promote_label_dtype(np.int16) == np.int16
+    assert promote_label_dtype(np.uint8, np.uint16) == np.uint16
+    assert promote_label_dtype(np.uint64, np.int64) == np.uint64 # np.result_type gives float64
+    assert promote_label_dtype(np.int32, np.uint8) == np.uint32
+    assert promote_label_dtype(np.uint16, np.float32) == np.float32
+
+def test_memory_report():
+    assert memory_report((1024,), np.uint16, np.uint8) == 'labels stored as uint8 instead of uint16: 1.0 KB instead of 2.0 KB, saving 1.0 KB'
+    assert memory_report((1024,), np.uint8, np.uint32).startswith('labels promoted from uint8 to uint32')
+    assert memory_report((1024,), None, np.uint32) == 'labels stored as uint32 (4.0 KB)'
+
+def test_compact_labels():
+    labels = np.array([0, 3, 300], dtype = np.int64)
+    assert compact_labels(labels).dtype == np.uint16
+    with pytest.raises(ValueError):
+        compact_labels(np.array([-1, 2]))
+
+def test_mixed_uint64_int64_files(tmp_path):
+    tifffile.imwrite(tmp_path / 'labels_TP0000.tif', np.full((2, 2, 2), 2 ** 40, dtype = np.uint64))
+    tifffile.imwrite(tmp_path / 'labels_TP0001.tif', np.full((2, 2, 2), 5, dtype = np.int64))
+    files = ['labels_TP0000.tif', 'labels_TP0001.tif']
+
+    stack = LazyTiffStack(str(tmp_path), files)
+    assert stack.dtype == np.uint64
+    assert stack[0, 0, 0, 0] == 2 ** 40
+    assert stack[1, 0, 0, 0] == 5
+
+    data = read_tiff_stack(str(tmp_path), files, max_workers = 2)
+    assert data.dtype == np.uint64
+    assert data[:, 0, 0, 0].tolist() == [2 ** 40, 5]
@@ -0,0 +1,104 @@
+import numpy                as np
+
+from napari.layers          import Labels
+
+from napari_manual_tracking.utilities._label_index import LabelIndex, paint_regions, union_boxes
+
+def _paint_events(layer:Labels) -> list:
+    items = []
+    layer.events.paint.connect(lambda event: items.append(event.value))
+    return items
+
+def test_paint_regions_of_a_labels_layer():
+    data = np.zeros((3, 2, 20, 20), dtype = np.uint16)
+    data[1, 1, 0:3, 0:3] = 7
+    layer = Labels(data)
+    items = _paint_events(layer)
+
+    layer.brush_size = 3
+    layer.paint((1, 1, 5, 5), 4)
+    layer.fill((1, 1, 1, 1), 9)
+    assert paint_regions(items[0]) == {1: ((slice(1, 2), slice(4, 7), slice(4, 7)), {4})}
+    assert paint_regions(items[0] + items[1]) == {1: ((slice(1, 2), slice(0, 7), slice(0, 7)), {4, 9})}
+
+    layer.data_setitem((np.array([0, 2, 2]), np.array([1, 1, 0]), np.array([3, 4, 12]), np.array([5, 6, 2])), 8)
+    assert paint_regions(items[-1]) == {
+        0: ((slice(1, 2), slice(3, 4), slice(5, 6)), {8}),
+        2: ((slice(0, 2), slice(4, 13), slice(2, 7)), {8}),
+    }
+
+def _frames() -> np.ndarray:
+    data = np.zeros((2, 2, 10, 10), dtype = np.uint16)
+    data[0, :, 0:3, 0:3] = 2
+    data[0, 1, 6:9, 5:10] = 3
+    data[1, 0, 4:6, 4:6] = 3
+    return data
+
+def test_index_frame():
+    data = _frames()
+    index = LabelIndex(2)
+    assert not index.is_indexed(0)
+    index.index_frame(0, data[0])
+    assert index.is_indexed(0) and not index.is_indexed(1)
+    assert index.boxes(2) == {0: (slice(0, 2), slice(0, 3), slice(0, 3))}
+    assert index.boxes(3) == {0: (slice(1, 2), slice(6, 9), slice(5, 10))}
+
+    index.ensure_indexed(data, [0, 1])
+    assert index.boxes(3, [1]) == {1: (slice(0, 1), slice(4, 6), slice(4, 6))}
+
+    # Indexing a time point again replaces its boxes.
+    data[0, :, 0:3, 0:3] = 0
+    index.index_frame(0, data[0])
+    assert index.boxes(2) == {}
+    assert 3 in index.labels_in_region(0, (slice(0, 2), slice(0, 10), slice(0, 10)))
+
+def test_add_region_grows_boxes_and_never_shrinks_them():
+    data = _frames()
+    index = LabelIndex(2)
+    index.add_region(0, [2], (slice(0, 1), slice(0, 1), slice(0, 1)))
+    assert index.boxes(2) == {} # not indexed yet, the time point is scanned when it is needed
+
+    index.ensure_indexed(data, [0, 1])
+    painted = (slice(0, 1), slice(2, 5), slice(2, 5))
+    data[(0,) + painted] = 2 # label 2 grows
+    index.add_region(0, [2, 0], painted)
+    assert index.boxes(2) == {0: (slice(0, 2), slice(0, 5), slice(0, 5))}
+    assert index.boxes(0) == {} # background is not indexed
+
+    # Painting over a label leaves its box conservative: larger than the label, never smaller.
+    data[0, 1, 6:9, 5:10] = 4
+    index.add_region(0, [4], (slice(1, 2), slice(6, 9), slice(5, 10)))
+    assert index.boxes(3, [0]) == {0: (slice(1, 2), slice(6, 9), slice(5, 10))}
+    assert set(index.labels_in_region(0, (slice(1, 2), slice(7, 8), slice(7, 8)))) == {3, 4}
+
+    # Scanning the time point again shrinks the boxes to the labels.
+    index.index_frame(0, data[0])
+    assert index.boxes(3, [0]) == {}
+    assert index.boxes(2, [0]) == {0: (slice(0, 2), slice(0, 5), slice(0, 5))}
+
+def test_apply_mapping():
+    data = _frames()
+    index = LabelIndex(2)
+    index.ensure_indexed(data, [0, 1])
+    box_2, box_3 = index.boxes(2)[0], index.boxes(3)[0]
+
+    index.apply_mapping({2: 3, 3: 2}, [0]) # swap at time point 0 only
+    assert index.boxes(2) == {0: box_3}
+    assert index.boxes(3) == {0: box_2, 1: (slice(0, 1), slice(4, 6), slice(4, 6))}
+
+    index.apply_mapping({3: 2}, [0]) # merge into an existing label
+    assert index.boxes(2) == {0: union_boxes(box_2, box_3)}
+
+    index.apply_mapping({3: 0}, [1]) # delete
+    assert index.boxes(3) == {}
+    assert index.labels_in_region(1, (slice(0, 2), slice(0, 10), slice(0, 10))) == {}
+
+def test_labels_in_region():
+    data = _frames()
+    index = LabelIndex(2)
+    index.ensure_indexed(data, [0])
+    assert index.labels_in_region(0, (slice(0, 2), slice(2, 3), slice(2, 3))) == {2: (slice(0, 2), slice(0, 3), slice(0, 3))}
+    assert index.labels_in_region(0, (slice(0, 1), slice(6, 9), slice(5, 10))) == {} # label 3 is only in z plane 1
+    assert index.labels_in_region(0, (slice(0, 2), slice(3, 6), slice(3, 5))) == {} # boxes that only touch do not intersect
+    assert set(index.labels_in_region(0, (slice(0, 2), slice(0, 10), slice(0, 10)))) == {2, 3}
+    assert index.labels_in_region(1, (slice(0, 2), slice(0, 10), slice(0, 10))) == {} # not indexed
@@ -0,0 +1,33 @@
+import tifffile
+
+import numpy                as np
+
+from napari_manual_tracking.utilities._label_stats import label_area_table, label_areas
+
+def test_label_areas():
+    image = np.array([[0, 2, 2], [5, 5, 5]], dtype = np.uint16)
+    labels, areas = label_areas(image)
+    assert labels.tolist() == [2, 5]
+    assert areas.tolist() == [2, 3]
+
+    # Labels far larger than the image are counted without a huge count array.
+    labels, areas = label_areas(np.array([0, 10 ** 9, 10 ** 9], dtype = np.uint32))
+    assert labels.tolist() == [10 ** 9]
+    assert areas.tolist() == [2]
+
+def test_label_area_table_in_threads(tmp_path):
+    files = []
+    for t in range(6):
+        frame = np.zeros((2, 4, 4), dtype = np.uint16)
+        frame[0, :t + 1] = 3
+        frame[1, 0, 0] = t + 10
+        files.append(f'labels_TP{t:04d}.tif')
+        tifffile.imwrite(tmp_path / files[-1], frame)
+
+    sequential = label_area_table(str(tmp_path), files, max_workers = 1)
+    threaded = label_area_table(str(tmp_path), files, max_workers = 4)
+    assert sequential.equals(threaded)
+    assert threaded['time_point'].tolist() == [0, 0, 1, 1, 2, 2, 3, 3, 4, 4, 5, 5]
+    assert threaded.loc[threaded['label'] == 3, 'area'].tolist() == [4, 8, 12, 16, 16, 16]
+    assert threaded['cell'].iloc[1] == 'Cell 00010'
+    assert (threaded['parent'] == -1).all()
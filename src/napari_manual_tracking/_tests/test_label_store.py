@@ -0,0 +1,93 @@
+import os
+
+import numpy                as np
+import pandas               as pd
+import pytest
+
+zarr = pytest.importorskip('zarr')
+
+from napari_manual_tracking.utilities import _label_store # noqa: E402
+from napari_manual_tracking.utilities._label_store import create_zarr_labels, open_zarr_labels, recover_zarr_labels, write_zarr_snapshot, zarr_store_path # noqa: E402
+from napari_manual_tracking.utilities._lazy_stack import LazyZarrStack # noqa: E402
+
+SHAPE = (3, 2, 300, 20) # two chunks along y
+
+def _store(directory) -> np.ndarray:
+    store = create_zarr_labels(str(directory), SHAPE, np.uint8)
+    data = np.zeros(SHAPE, dtype = np.uint8)
+    data[:, :, 10:20, 5:10] = 2
+    store[:] = data
+    return data
+
+def _table(value:int) -> pd.DataFrame:
+    return pd.DataFrame({'time_point': [0], 'label': [value], 'area': [1], 'cell': ['Cell 00001'], 'parent': [0]})
+
+def _run(task):
+    """Exhaust a save generator, returning its return value"""
+
+    try:
+        while True:
+            next(task)
+    except StopIteration as stop:
+        return stop.value
+
+def test_snapshot_rewrites_changed_time_points(tmp_path):
+    data = _store(tmp_path)
+    data[1, 0, 280, 0] = 7
+    assert _run(write_zarr_snapshot(str(tmp_path), {1: data[1]}, _table(7))) is None
+
+    np.testing.assert_array_equal(open_zarr_labels(str(tmp_path))[:], data)
+    assert pd.read_csv(tmp_path / 'LabelAnnotations.csv')['label'].tolist() == [7]
+    assert not os.path.exists(zarr_store_path(str(tmp_path)) + '.saving')
+
+def test_interrupted_snapshot_leaves_the_store_unchanged(tmp_path):
+    data = _store(tmp_path)
+    edited = data.copy()
+    edited[0, 0, 280, 0] = 9
+    edited[2, 0, 10, 5] = 9
+
+    task = write_zarr_snapshot(str(tmp_path), {0: edited[0], 2: edited[2]}, _table(9))
+    next(task) # stop after the first time point was staged
+    task.close()
+
+    np.testing.assert_array_equal(open_zarr_labels(str(tmp_path))[:], data)
+    assert not recover_zarr_labels(str(tmp_path)) # the incomplete staging store is discarded
+    assert not os.path.exists(zarr_store_path(str(tmp_path)) + '.saving')
+    np.testing.assert_array_equal(open_zarr_labels(str(tmp_path))[:], data)
+
+def test_interrupted_commit_is_completed(tmp_path, monkeypatch):
+    data = _store(tmp_path)
+    data[0, 1, 200:210, 0] = 5
+    monkeypatch.setattr(_label_store, 'commit_zarr_snapshot', lambda directory: False) # crash right after the manifest was written
+    _run(write_zarr_snapshot(str(tmp_path), {0: data[0]}, _table(5)))
+    monkeypatch.undo()
+    assert open_zarr_labels(str(tmp_path))[0, 1, 205, 0] == 0
+    assert not os.path.exists(tmp_path / 'LabelAnnotations.csv')
+
+    assert recover_zarr_labels(str(tmp_path))
+    np.testing.assert_array_equal(open_zarr_labels(str(tmp_path))[:], data)
+    assert pd.read_csv(tmp_path / 'LabelAnnotations.csv')['label'].tolist() == [5]
+
+def test_snapshot_promotes_the_store(tmp_path):
+    data = _store(tmp_path)
+    stack = LazyZarrStack(open_zarr_labels(str(tmp_path)))
+    stack.promote(np.uint16)
+    stack[1, 0, 0, 0] = 1000
+
+    store = _run(write_zarr_snapshot(str(tmp_path), {1: stack.get_frame(1)}, dtype = np.uint16, stack = stack))
+    assert store.dtype == np.uint16
+    assert stack.store.dtype == np.uint16
+    data = data.astype(np.uint16)
+    data[1, 0, 0, 0] = 1000
+    np.testing.assert_array_equal(open_zarr_labels(str(tmp_path))[:], data)
+    assert not os.path.exists(zarr_store_path(str(tmp_path)) + '.promote')
+    assert not os.path.exists(zarr_store_path(str(tmp_path)) + '.old')
+
+def test_interrupted_promotion_is_undone(tmp_path):
+    data = _store(tmp_path)
+    path = zarr_store_path(str(tmp_path))
+    os.replace(path, path + '.old') # crash after moving the old store aside, before the copy was in place
+
+    assert recover_zarr_labels(str(tmp_path))
+    np.testing.assert_array_equal(open_zarr_labels(str(tmp_path))[:], data)
+    assert not os.path.exists(path + '.old')
@@ -0,0 +1,132 @@
+import tifffile
+
+import numpy                as np
+
+from napari_manual_tracking.utilities._lazy_stack import LazyTiffStack
+
+def _write_stack(directory, n_time_points:int = 5, shape = (2, 4, 4), dtype = np.uint16):
+    """Write one small tif per time point, filled with its time point + 1"""
+
+    files = []
+    for t in range(n_time_points):
+        name = f'labels_TP{t:04d}.tif'
+        tifffile.imwrite(directory / name, np.full(shape, t + 1, dtype = dtype))
+        files.append(name)
+    return files
+
+def test_shape_and_reading(tmp_path):
+    files = _write_stack(tmp_path)
+    stack = LazyTiffStack(str(tmp_path), files, cache_size = 2)
+
+    assert stack.shape == (5, 2, 4, 4)
+    assert stack.dtype == np.uint16
+    assert len(stack._cache) == 0 # nothing is read before it is accessed
+    assert np.all(stack[3] == 4)
+    assert stack[1:3, 0, 0, 0].tolist() == [2, 3]
+    np.testing.assert_array_equal(np.asarray(stack)[:, 0, 0, 0], [1, 2, 3, 4, 5])
+
+def test_lru_eviction(tmp_path):
+    files = _write_stack(tmp_path)
+    stack = LazyTiffStack(str(tmp_path), files, cache_size = 2)
+
+    stack.get_frame(0)
+    stack.get_frame(1)
+    stack.get_frame(0) # 0 is now the most recently used
+    stack.get_frame(2)
+    assert list(stack._cache.keys()) == [0, 2]
+
+def test_edited_frames_are_pinned(tmp_path):
+    files = _write_stack(tmp_path)
+    stack = LazyTiffStack(str(tmp_path), files, cache_size = 1)
+
+    stack[1, 0, 0, 0] = 42
+    for t in (0, 2, 3, 4):
+        stack.get_frame(t) # would evict time point 1 if it were not pinned
+    assert stack.edited_frames == [1]
+    assert stack[1, 0, 0, 0] == 42
+    assert 1 not in stack._cache
+
+    # The file on disk is unchanged until the frame is saved.
+    assert tifffile.imread(tmp_path / files[1])[0, 0, 0] == 2
+
+def test_fancy_index_assignment(tmp_path):
+    files = _write_stack(tmp_path)
+    stack = LazyTiffStack(str(tmp_path), files)
+
+    stack[np.array([0, 2]), np.array([1, 1]), np.array([2, 3]), np.array([0, 1])] = 9
+    assert stack.edited_frames == [0, 2]
+    assert stack[0, 1, 2, 0] == 9
+    assert stack[2, 1, 3, 1] == 9
+    assert stack[2, 1, 2, 0] == 3
+
+def test_mark_saved(tmp_path):
+    files = _write_stack(tmp_path)
+    stack = LazyTiffStack(str(tmp_path), files, cache_size = 1)
+
+    stack[0, 0, 0, 0] = 7
+    stack[1, 0, 0, 0] = 8
+    stack.mark_saved([0])
+    assert stack.edited_frames == [1]
+    assert list(stack._cache.keys()) == [0] # released frames go back to the cache
+
+    stack.mark_saved()
+    assert stack.edited_frames == []
+    assert len(stack._cache) == 1 # and are evicted again like any other frame
+
+def test_promote(tmp_path):
+    files = _write_stack(tmp_path, dtype = np.uint8)
+    stack = LazyTiffStack(str(tmp_path), files)
+
+    stack.get_frame(0)
+    stack[1, 0, 0, 0] = 200
+    stack.promote(np.uint16)
+    assert stack.dtype == np.uint16
+    assert stack.nbytes == 5 * 2 * 4 * 4 * 2
+    for t in (0, 1, 2): # cached, edited and not yet read
+        assert stack.get_frame(t).dtype == np.uint16
+
+    stack[1, 0, 0, 0] = 1000
+    assert stack[1, 0, 0, 0] == 1000
+
+def test_mixed_file_dtypes(tmp_path):
+    files = _write_stack(tmp_path, n_time_points = 2, dtype = np.uint8)
+    tifffile.imwrite(tmp_path / files[1], np.full((2, 4, 4), 300, dtype = np.uint16))
+    stack = LazyTiffStack(str(tmp_path), files)
+
+    assert stack.dtype == np.uint16
+    assert stack.get_frame(0).dtype == np.uint16
+    assert stack[1, 0, 0, 0] == 300
+
+def test_time_window(tmp_path):
+    files = _write_stack(tmp_path, n_time_points = 8)
+    stack = LazyTiffStack(str(tmp_path), files, cache_size = 1)
+
+    stack[0, 0, 0, 0] = 9
+    assert stack.set_window(4, 1, direction = 1) == [0] # edited, outside the window
+    stack.wait_for_prefetch()
+    assert sorted(stack._cache.keys()) == [3, 4, 5] # read in the background, more than cache_size
+    assert stack[0, 0, 0, 0] == 9 # kept until saved
+
+    stack.set_window(5, 1, direction = 1)
+    stack.wait_for_prefetch()
+    assert sorted(stack._cache.keys()) == [4, 5, 6]
+
+    stack.mark_saved([0])
+    assert 0 not in stack._cache # saved frames outside the window are released
+
+    stack.clear_window()
+    assert stack._window is None
+    assert len(stack._cache) == 1 # back to the least recently used frames
+
+def test_slice_assignment_with_dropped_dimensions(tmp_path):
+    files = _write_stack(tmp_path)
+    stack = LazyTiffStack(str(tmp_path), files)
+
+    value = np.arange(3 * 4 * 4, dtype = np.uint16).reshape(3, 4, 4)
+    stack[0:3, 1] = value # the integer z index drops a dimension
+    np.testing.assert_array_equal(stack[0:3, 1], value)
+    assert np.all(stack[0:3, 0] == np.array([1, 2, 3])[:, None, None])
+
+    stack[1:4, 0, 2] = np.array([7, 8, 9, 10], dtype = np.uint16) # broadcast over the time points
+    assert stack[1:4, 0, 2].tolist() == [[7, 8, 9, 10]] * 3
+    assert stack.edited_frames == [0, 1, 2, 3]
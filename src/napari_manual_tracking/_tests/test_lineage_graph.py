@@ -0,0 +1,87 @@
+import numpy                as np
+import pandas               as pd
+
+from typing                 import List
+
+from napari_manual_tracking.utilities._lineage_graph import LineageGraph
+
+def _dataframe_plot_order(parent_labels:pd.DataFrame, starting_points:List[int]) -> List[int]:
+    """The y-axis order as the plot widget determined it from the parent table, before the lineage graph"""
+
+    y_axis_order = list(starting_points)
+    while len(starting_points) > 0:
+        children_list = []
+        for label in starting_points:
+            children = list(parent_labels.loc[parent_labels['parent'] == label, 'label'])
+            for i, c in enumerate(children):
+                children_list.append(c)
+                y_axis_order.insert(y_axis_order.index(label) + i, c)
+        starting_points = children_list
+    return y_axis_order
+
+def test_changed_since():
+    graph = LineageGraph({2: 0, 3: 2})
+    version = graph.version
+    assert graph.changed_since(version) == set()
+
+    graph.set_parent(4, 2)
+    graph.set_parent(3, 0)
+    graph.set_parent(3, 0) # unchanged, not logged
+    graph.remove(2)
+    assert graph.changed_since(version) == {2, 3, 4}
+    assert graph.changed_since(graph.version - 1) == {2}
+    assert graph.changed_since(graph.version + 1) is None # a version from the future, e.g. of another graph
+
+def test_changed_since_after_log_trimming():
+    graph = LineageGraph({2: 0})
+    start = graph.version
+    for i in range(3000):
+        graph.set_parent(3, i % 2) # alternate between 0 and 1
+    assert graph.changed_since(start) is None # too far behind, rebuild from scratch
+    recent = graph.version - 10
+    assert graph.changed_since(recent) == {3}
+    graph.set_parent(5, 2)
+    assert graph.changed_since(recent) == {3, 5}
+
+def test_recording():
+    graph = LineageGraph({2: 0, 3: 2, 4: 2})
+    assert graph.stop_recording() == {} # not recording
+
+    graph.start_recording()
+    graph.set_parent(3, 0)
+    graph.set_parent(3, 4)
+    graph.set_parent(4, 0)
+    graph.set_parent(4, 2) # changed back
+    graph.set_parent(5, 3)
+    graph.remove(2)
+    assert graph.stop_recording() == {3: (2, 4), 5: (None, 3), 2: (0, None)}
+
+    graph.set_parent(6, 0) # after stop_recording
+    graph.start_recording()
+    assert graph.stop_recording() == {}
+
+def test_root_and_ancestors_on_a_cycle():
+    graph = LineageGraph({2: 3, 3: 4, 4: 2, 5: 4})
+    assert graph.root(5) in (2, 3, 4) # terminates
+    assert graph.ancestors(5) == [4, 2, 3]
+    assert graph.ancestors(2) == [3, 4]
+    assert graph.root(6) == 6 # unknown label
+
+    graph = LineageGraph({2: 0, 3: 2, 4: 3, 7: -1})
+    assert graph.root(4) == 2
+    assert graph.ancestors(4) == [3, 2]
+    assert graph.root(7) == 7
+    assert graph.lineage(7) == []
+
+def test_plot_order_matches_the_dataframe_implementation():
+    rng = np.random.default_rng(1)
+    parents = {}
+    for label in range(2, 200):
+        parents[label] = 0 if label < 6 or rng.random() < 0.05 else int(rng.choice(list(parents)))
+    graph = LineageGraph(parents)
+    table = graph.to_dataframe()
+
+    roots = [label for label, parent in parents.items() if parent == 0]
+    assert graph.plot_order(roots) == _dataframe_plot_order(table, roots)
+    for label in (7, 50, 150):
+        assert graph.lineage(label) == _dataframe_plot_order(table, [graph.root(label)])
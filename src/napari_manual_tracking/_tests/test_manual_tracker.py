@@ -0,0 +1,91 @@
+import types
+import tifffile
+
+import numpy                as np
+
+from napari.components      import ViewerModel
+
+from napari_manual_tracking import _manual_tracker
+from napari_manual_tracking._manual_tracker import ManualDivisionTracker
+
+def _start_tracker(qtbot, directory) -> ManualDivisionTracker:
+    """Start tracking 3 time points of 2 x 20 x 20 voxels, with label 2 in one corner and label 3 in another"""
+
+    raw, labels = directory / 'raw', directory / 'labels'
+    raw.mkdir()
+    labels.mkdir()
+    for t in range(3):
+        tifffile.imwrite(raw / f'raw_TP{t:04d}.tif', np.zeros((2, 20, 20), dtype = np.uint16))
+        frame = np.zeros((2, 20, 20), dtype = np.uint16)
+        frame[:, 0:4, 0:4] = 2
+        frame[:, 14:20, 14:20] = 3
+        tifffile.imwrite(labels / f'labels_TP{t:04d}.tif', frame)
+
+    viewer = ViewerModel()
+    object.__setattr__(viewer, 'window', types.SimpleNamespace(add_dock_widget = lambda *args, **kwargs: None)) # no Qt window, only the layers
+    tracker = ManualDivisionTracker(viewer)
+    qtbot.addWidget(tracker)
+    tracker.raw_data1_dir, tracker.label_dir = str(raw), str(labels)
+    tracker._on_start()
+    assert tracker.running
+    return tracker
+
+def test_painting_recounts_only_the_painted_box(qtbot, tmp_path, monkeypatch):
+    tracker = _start_tracker(qtbot, tmp_path)
+    tracker.label_index.ensure_indexed(tracker.labels.data, [1])
+    counted_boxes = []
+
+    def full_frame_count(frame):
+        raise AssertionError('the full time point was counted again')
+
+    def count_in_boxes(frame, boxes):
+        counted_boxes.append(dict(boxes))
+        return label_areas_in_boxes(frame, boxes)
+
+    label_areas_in_boxes = _manual_tracker.label_areas_in_boxes
+    monkeypatch.setattr(_manual_tracker, 'label_areas', full_frame_count)
+    monkeypatch.setattr(_manual_tracker, 'label_areas_in_boxes', count_in_boxes)
+
+    tracker.labels.brush_size = 3
+    tracker.labels.paint((1, 0, 4, 4), 5) # a new label that partly paints over label 2
+    tracker.update_coalescer.flush()
+
+    box = (slice(0, 1), slice(3, 6), slice(3, 6))
+    assert counted_boxes == [{2: (slice(0, 2), slice(0, 4), slice(0, 4)), 5: box}] # not label 3
+    assert tracker.label_index._indexed[1] # grown, not scanned again
+    assert tracker.label_index.boxes(5) == {1: box}
+    assert tracker.dirty_frames == {1}
+
+    rows = tracker.label_df[tracker.label_df['time_point'] == 1].set_index('label')['area']
+    assert rows.to_dict() == {2: 31, 3: 72, 5: 9}
+    assert 5 in tracker.lineage
+
+def test_autosave_journal_holds_only_the_stroke(qtbot, tmp_path):
+    tracker = _start_tracker(qtbot, tmp_path)
+    assert not tracker.journal.exists()
+
+    tracker.labels.brush_size = 3
+    tracker.labels.paint((2, 1, 10, 10), 6)
+    tracker._autosave()
+    qtbot.waitUntil(lambda: tracker.journal_worker is None)
+
+    records = list(tracker.journal.records())
+    assert len(records) == 1
+    assert [(t, box) for t, box, _ in records[0].regions] == [(2, (slice(1, 2), slice(9, 12), slice(9, 12)))]
+    assert np.all(records[0].regions[0][2] == 6)
+    assert records[0].parents == {6: 0} # the new label starts a lineage
+
+def test_painting_over_a_label_before_indexing(qtbot, tmp_path):
+    tracker = _start_tracker(qtbot, tmp_path)
+    assert not tracker.label_index.is_indexed(0)
+
+    tracker.labels.n_edit_dimensions = 3
+    tracker.labels.fill((0, 0, 1, 1), 3) # label 2 disappears from time point 0
+    tracker.update_coalescer.flush()
+    rows = tracker.label_df[tracker.label_df['time_point'] == 0]
+    assert rows['label'].tolist() == [3]
+    assert tracker.label_index.is_indexed(0) # strokes from now on are counted in their box
+
+    tracker.labels.fill((0, 1, 15, 15), 0)
+    tracker.update_coalescer.flush()
+    assert tracker.label_df.loc[tracker.label_df['time_point'] == 0, 'area'].tolist() == [32] # only the former label 2
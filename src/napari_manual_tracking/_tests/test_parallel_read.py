@@ -0,0 +1,56 @@
+import time
+import tifffile
+
+import numpy                as np
+import pytest
+
+from napari_manual_tracking.utilities import _parallel_read
+from napari_manual_tracking.utilities._parallel_read import read_tiff_stack
+
+def _write_frames(directory, dtypes, shape = (2, 3, 4)):
+    """Write one tif per time point, filled with its time point + 1"""
+
+    files = []
+    for t, dtype in enumerate(dtypes):
+        name = f't{t}.tif'
+        tifffile.imwrite(directory / name, np.full(shape, t + 1, dtype = dtype))
+        files.append(name)
+    return files
+
+def test_frames_are_decoded_into_the_result(tmp_path, monkeypatch):
+    files = _write_frames(tmp_path, [np.uint16] * 3)
+    targets = []
+    imread = tifffile.imread
+    monkeypatch.setattr(_parallel_read.tifffile, 'imread', lambda path, **kwargs: targets.append(kwargs.get('out')) or imread(path, **kwargs))
+
+    stack = read_tiff_stack(str(tmp_path), files, max_workers = 1)
+    assert stack.shape == (3, 2, 3, 4) and stack.dtype == np.uint16
+    assert len(targets) == 3
+    assert all(out is not None and np.shares_memory(out, stack[t]) for t, out in enumerate(targets)) # no intermediate frames
+
+def test_frame_order_with_several_workers(tmp_path, monkeypatch):
+    files = _write_frames(tmp_path, [np.uint8] * 6)
+    imread = tifffile.imread
+
+    def slow_early_frames(path, **kwargs):
+        time.sleep(0.05 if path.endswith(('t0.tif', 't1.tif')) else 0) # the later frames finish first
+        return imread(path, **kwargs)
+    monkeypatch.setattr(_parallel_read.tifffile, 'imread', slow_early_frames)
+
+    stack = read_tiff_stack(str(tmp_path), files, max_workers = 3)
+    assert stack[:, 0, 0, 0].tolist() == [1, 2, 3, 4, 5, 6]
+    np.testing.assert_array_equal(stack, read_tiff_stack(str(tmp_path), files, max_workers = 1))
+
+def test_mixed_dtypes_are_promoted(tmp_path):
+    files = _write_frames(tmp_path, [np.uint8, np.uint16, np.uint8])
+    stack = read_tiff_stack(str(tmp_path), files, max_workers = 2)
+    assert stack.dtype == np.uint16
+    assert stack[:, 1, 2, 3].tolist() == [1, 2, 3]
+
+def test_mismatched_shapes_and_missing_files(tmp_path):
+    files = _write_frames(tmp_path, [np.uint8] * 2)
+    tifffile.imwrite(tmp_path / 't2.tif', np.zeros((2, 3, 5), dtype = np.uint8))
+    with pytest.raises(ValueError):
+        read_tiff_stack(str(tmp_path), files + ['t2.tif'])
+    with pytest.raises(FileNotFoundError):
+        read_tiff_stack(str(tmp_path), files + ['t3.tif'])
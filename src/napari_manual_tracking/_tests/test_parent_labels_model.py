@@ -0,0 +1,48 @@
+from napari_manual_tracking._manual_tracker import ParentLabelsModel
+from napari_manual_tracking.utilities._lineage_graph import LineageGraph
+
+def _rows(model:ParentLabelsModel):
+    return list(zip(model.labels.tolist(), model.parents.tolist()))
+
+def _synced_model(lineage:LineageGraph):
+    model = ParentLabelsModel()
+    model.update_from_lineage(lineage)
+    changed_rows = []
+    model.dataChanged.connect(lambda first, last, roles = None: changed_rows.append((first.row(), last.row())))
+    model.modelReset.connect(lambda: changed_rows.append('reset'))
+    return model, changed_rows
+
+def test_model_follows_lineage_row_by_row():
+    lineage = LineageGraph(dict.fromkeys(range(2, 20), 0))
+    model, changed_rows = _synced_model(lineage)
+    assert _rows(model)[:2] == [(2, 0), (3, 0)]
+
+    lineage.set_parent(5, 3)
+    lineage.set_parent(7, 3)
+    model.update_from_lineage(lineage)
+    assert changed_rows == [(3, 3), (5, 5)] # only the rows of labels 5 and 7
+    assert model.parents[3] == 3
+
+    lineage.remove(4)
+    lineage.set_parent(25, 2)
+    model.update_from_lineage(lineage)
+    assert _rows(model) == list(zip(lineage.to_dataframe()['label'], lineage.to_dataframe()['parent']))
+    assert 'reset' not in changed_rows
+
+def test_model_does_not_modify_the_lineage_table():
+    lineage = LineageGraph({2: 0, 3: 2})
+    model, _ = _synced_model(lineage)
+    edited = []
+    model.parent_changed.connect(lambda label, parent: edited.append((label, parent)))
+    model.editable = True
+
+    assert model.setData(model.index(1, 1), '7')
+    assert edited == [(3, 7)]
+    assert lineage.to_dataframe()['parent'].tolist() == [0, 2] # the cached table of the lineage is untouched
+    assert lineage.parent(3) == 2
+
+def test_model_rebuilds_for_a_new_lineage():
+    model, changed_rows = _synced_model(LineageGraph({2: 0}))
+    model.update_from_lineage(LineageGraph({3: 0, 4: 3}))
+    assert changed_rows == ['reset']
+    assert _rows(model) == [(3, 0), (4, 3)]
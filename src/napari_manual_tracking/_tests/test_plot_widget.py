@@ -0,0 +1,39 @@
+import napari
+
+import numpy                as np
+import pandas               as pd
+
+from napari_manual_tracking.utilities._lineage_graph    import LineageGraph
+from napari_manual_tracking.utilities._plot_widget      import PlotWidget
+
+def _plot_widget(qtbot):
+    labels = napari.layers.Labels(np.zeros((2, 1, 4, 4), dtype = np.uint16))
+    props = pd.DataFrame({'time_point': [0, 0, 1, 1], 'label': [1, 2, 3, 4], 'area': [4, 4, 2, 2], 'cell': ['Cell 00001', 'Cell 00002', 'Cell 00003', 'Cell 00004']})
+    lineage = LineageGraph({1: 0, 2: -1, 3: 1, 4: 1})
+    widget = PlotWidget(props.assign(parent = props['label'].map(lineage.parents)), labels, lineage)
+    qtbot.addWidget(widget)
+    redraws = []
+    widget._update_plot = lambda: (redraws.append(lineage.version), PlotWidget._update_plot(widget))
+    return widget, lineage, props, redraws
+
+def test_redraws_only_when_the_data_or_the_lineage_changed(qtbot):
+    widget, lineage, props, redraws = _plot_widget(qtbot)
+    widget.update_data(widget.props.copy()) # the first update draws the plot
+    widget.update_data(widget.props.copy())
+    assert len(redraws) == 1
+
+    lineage.set_parent(2, 1)
+    widget.update_data(widget.props.copy())
+    assert redraws[-1] == lineage.version
+
+    widget.update_data(widget.props.assign(area = [5, 4, 2, 2]))
+    assert len(redraws) == 3
+
+def test_tree_order_follows_the_lineage_version(qtbot):
+    widget, lineage, props, redraws = _plot_widget(qtbot)
+    assert widget._tree_order('tracked') == [3, 1, 4]
+    assert widget._tree_order('tracked') is widget._tree_order('tracked') # cached
+
+    lineage.set_parent(2, 0)
+    assert widget._tree_order('tracked') == [3, 1, 4, 2]
+    assert widget._tree_order('lineage', 4) == [3, 1, 4]
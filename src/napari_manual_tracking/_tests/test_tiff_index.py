@@ -0,0 +1,58 @@
+import os
+import tifffile
+
+import numpy                as np
+
+from napari_manual_tracking.utilities import _tiff_index
+from napari_manual_tracking.utilities._tiff_index import index_tiff_directory, list_tiff_files, natural_sort_key
+
+def _count_header_reads(monkeypatch) -> list:
+    reads = []
+    read_tiff_info = _tiff_index.read_tiff_info
+    monkeypatch.setattr(_tiff_index, 'read_tiff_info', lambda path: reads.append(os.path.basename(path)) or read_tiff_info(path))
+    return reads
+
+def test_natural_sort_key():
+    assert sorted(['t10.tif', 't2.tif', 'T1.tif'], key = natural_sort_key) == ['T1.tif', 't2.tif', 't10.tif']
+
+def test_files_in_natural_order(tmp_path):
+    for t in (10, 2, 1):
+        tifffile.imwrite(tmp_path / f't{t}.tif', np.zeros((2, 3), dtype = np.uint8))
+    (tmp_path / 'notes.txt').write_text('not a tif')
+    assert list_tiff_files(str(tmp_path)) == ['t1.tif', 't2.tif', 't10.tif']
+
+def test_headers_are_cached_until_a_file_changes(tmp_path, monkeypatch):
+    for t in range(3):
+        tifffile.imwrite(tmp_path / f't{t}.tif', np.zeros((2, 3), dtype = np.uint8))
+    reads = _count_header_reads(monkeypatch)
+
+    index = index_tiff_directory(str(tmp_path))
+    assert sorted(reads) == ['t0.tif', 't1.tif', 't2.tif']
+    assert index.frame_shape == (2, 3)
+
+    reads.clear()
+    index_tiff_directory(str(tmp_path))
+    assert reads == [] # size and modification time are unchanged
+
+    tifffile.imwrite(tmp_path / 't1.tif', np.zeros((4, 3), dtype = np.uint16))
+    index = index_tiff_directory(str(tmp_path))
+    assert reads == ['t1.tif']
+    assert index.entries[1].shape == (4, 3) and index.entries[1].dtype == np.uint16
+
+    reads.clear()
+    stat = os.stat(tmp_path / 't2.tif')
+    os.utime(tmp_path / 't2.tif', ns = (stat.st_atime_ns, stat.st_mtime_ns + 10**9)) # same size, newer modification time
+    index_tiff_directory(str(tmp_path))
+    assert reads == ['t2.tif']
+
+def test_validate(tmp_path):
+    tifffile.imwrite(tmp_path / 't1.tif', np.zeros((2, 3), dtype = np.uint8))
+    tifffile.imwrite(tmp_path / 't2.tif', np.zeros((2, 4), dtype = np.float32))
+    index = index_tiff_directory(str(tmp_path))
+
+    assert index.validate() == ['t2.tif has shape (2, 4), expected (2, 3)']
+    assert len(index.validate(frame_shape = (2, 4), n_frames = 3, integer = True)) == 3
+    assert index_tiff_directory(str(tmp_path / '..' / tmp_path.name)).validate(frame_shape = (2, 3)) == index.validate()
+
+def test_validate_empty_directory(tmp_path):
+    assert index_tiff_directory(str(tmp_path)).validate() == ['No tif files were found in ' + str(tmp_path)]
@@ -1,19 +1,28 @@
 
 import os
-import trackpy
 import napari
+import threading
 
 import pandas   as pd
 import numpy    as np
 
 from typing                 import List, Tuple
-from tifffile               import imwrite
-from skimage.io             import imread
 
 from superqt                import QLabeledRangeSlider, QLabeledDoubleRangeSlider
-from qtpy.QtWidgets         import QTabWidget, QMessageBox, QDoubleSpinBox, QComboBox, QGroupBox, QLabel, QHBoxLayout, QVBoxLayout, QPushButton, QWidget, QFileDialog, QLineEdit, QSpinBox
+from qtpy.QtWidgets         import QTabWidget, QMessageBox, QCheckBox, QDoubleSpinBox, QComboBox, QGroupBox, QLabel, QHBoxLayout, QVBoxLayout, QPushButton, QWidget, QFileDialog, QLineEdit, QSpinBox, QProgressBar
 from qtpy                   import QtCore
 from napari.qt              import QtToolTipLabel
+from napari.qt.threading    import create_worker
+from napari.utils.notifications import show_info
+
+from .utilities._label_store import LABEL_FORMATS, zarr_available, save_label_stack
+from .utilities._label_dtype import smallest_label_dtype, memory_report
+from .utilities._tiff_index  import index_tiff_directory
+from .utilities._detection   import DetectionCache, PreprocessCache, detection_task, locate_region, preprocess_cache_available
+from .utilities._lazy_stack  import LazyTiffStack
+
+PREPROCESS_CACHE_NAME = '.trackpy_preprocessed'
+DETECTION_CACHE_NAME = '.trackpy_detections'
 
 class CustomRangeSliderWidget(QWidget):
     """implements superqt RangeSlider widget to select a range of values based on a table"""
@@ -64,6 +73,16 @@ class TrackpyDetector(QWidget):
         self.intensity_layer = None
         self.points = None
         self.sliders_widget = None
+        self.detection_worker = None
+        self.detection_cancel = None # set to stop the running detection
+        self.detected_frames = {} # time point -> detections of the running detection
+        self.pending_points = [] # detections of the time points that are not in the points layer yet
+        self.points_timer = QtCore.QTimer(self)
+        self.points_timer.setSingleShot(True)
+        self.points_timer.setInterval(500)
+        self.points_timer.timeout.connect(self._add_pending_points)
+        self.preview_points = None
+        self.roi_layer = None
 
         # Add input and output directory. 
         settings_layout = QVBoxLayout()
@@ -87,8 +106,15 @@ class TrackpyDetector(QWidget):
         output_layout.addWidget(self.outputdirbtn)
         output_layout.addWidget(self.output_path)
 
+        output_format_layout = QHBoxLayout()
+        self.output_format_combo = QComboBox()
+        self.output_format_combo.addItems(LABEL_FORMATS if zarr_available() else LABEL_FORMATS[:1])
+        output_format_layout.addWidget(QLabel('Output format'))
+        output_format_layout.addWidget(self.output_format_combo)
+
         databox_layout.addLayout(input_layout)
         databox_layout.addLayout(output_layout)
+        databox_layout.addLayout(output_format_layout)
         
         settings_layout.addWidget(databox)
         databox.setLayout(databox_layout)
@@ -120,7 +146,34 @@ class TrackpyDetector(QWidget):
         self.separation_spinbox_z.setMaximum(500)      
         self.separation_spinbox_z.setValue(10)
 
-        self.detect_trackpy_btn = QPushButton('Detect objects')
+        self.workers_spinbox = QSpinBox()
+        self.workers_spinbox.setMinimum(1)
+        self.workers_spinbox.setMaximum(max(os.cpu_count() or 1, 1))
+        self.workers_spinbox.setValue(max(os.cpu_count() or 1, 1))
+        self.workers_spinbox.setToolTip('Number of time points that are detected at the same time, each in its own thread')
+
+        self.preprocess_cache_checkbox = QCheckBox('Cache filtered images in the output directory')
+        self.preprocess_cache_checkbox.setToolTip('Keep the bandpass filtered images, so that a new detection with only a different separation skips the filtering')
+        self.preprocess_cache_checkbox.setEnabled(preprocess_cache_available())
+
+        self.detection_cache_checkbox = QCheckBox('Reuse detections of earlier runs')
+        self.detection_cache_checkbox.setToolTip('Keep the detections of every time point in the output directory, so that a new detection with the same settings loads them instead of detecting again')
+        self.detection_cache_checkbox.setChecked(True)
+        self.clear_cache_btn = QPushButton('Clear cache')
+        self.clear_cache_btn.setToolTip('Remove the cached filtered images and detections from the output directory')
+        self.clear_cache_btn.clicked.connect(self._clear_cache)
+
+        preview_layout = QHBoxLayout()
+        self.roi_btn = QPushButton('Draw region')
+        self.roi_btn.setToolTip('Draw a rectangle to limit the preview to a region')
+        self.roi_btn.clicked.connect(self._add_roi_layer)
+        self.preview_btn = QPushButton('Preview current time point')
+        self.preview_btn.setToolTip('Detect the objects only in the current time point, or only inside the drawn region, to try out the settings')
+        self.preview_btn.clicked.connect(self._preview)
+        preview_layout.addWidget(self.roi_btn)
+        preview_layout.addWidget(self.preview_btn)
+
+        self.detect_trackpy_btn = QPushButton('Apply to all time points')
         self.detect_trackpy_btn.clicked.connect(self._run)
         self.detect_trackpy_btn.setEnabled(False)
         
@@ -137,7 +190,24 @@ class TrackpyDetector(QWidget):
         trackpy_settings_layout.addWidget(self.separation_spinbox_y)
         trackpy_settings_layout.addWidget(QLabel('Separation z'))
         trackpy_settings_layout.addWidget(self.separation_spinbox_z)
-        trackpy_settings_layout.addWidget(self.detect_trackpy_btn)
+        trackpy_settings_layout.addWidget(QLabel('Worker threads'))
+        trackpy_settings_layout.addWidget(self.workers_spinbox)
+        trackpy_settings_layout.addWidget(self.preprocess_cache_checkbox)
+        cache_layout = QHBoxLayout()
+        cache_layout.addWidget(self.detection_cache_checkbox)
+        cache_layout.addWidget(self.clear_cache_btn)
+        trackpy_settings_layout.addLayout(cache_layout)
+        trackpy_settings_layout.addLayout(preview_layout)
+        detect_layout = QHBoxLayout()
+        self.cancel_detection_btn = QPushButton('Cancel')
+        self.cancel_detection_btn.clicked.connect(self._cancel_detection)
+        self.cancel_detection_btn.setEnabled(False)
+        detect_layout.addWidget(self.detect_trackpy_btn)
+        detect_layout.addWidget(self.cancel_detection_btn)
+        trackpy_settings_layout.addLayout(detect_layout)
+        self.detection_progress = QProgressBar()
+        self.detection_progress.setVisible(False)
+        trackpy_settings_layout.addWidget(self.detection_progress)
 
         trackpy_settings.setLayout(trackpy_settings_layout)
         settings_layout.addWidget(trackpy_settings)
@@ -190,7 +260,10 @@ class TrackpyDetector(QWidget):
     def create_label_image(self, df:pd.DataFrame, output_shape:Tuple[int]) -> np.ndarray:
         """Create a label image of given shape based on the point detections in the given dataframe df"""
 
-        label_image = np.zeros(output_shape, dtype=np.uint16)
+        # Use the smallest dtype that holds the largest label, trackpy ids + 2 can exceed the uint16 range.
+        dtype = smallest_label_dtype(df['label'].max() if len(df) > 0 else 0)
+        show_info(memory_report(output_shape, None, dtype))
+        label_image = np.zeros(output_shape, dtype=dtype)
 
         for _, row in df.iterrows():
             time_point = int(row['time_point'])
@@ -202,27 +275,123 @@ class TrackpyDetector(QWidget):
 
         return label_image
     
-    def _detect_trackpy(self, files: List[str]) -> Tuple[napari.layers.Image, pd.DataFrame]:
-        """Load the image data, and run trackpy.locate to detect objects"""
-
-        dfs = []
-        imgs = []
-        for i, f in enumerate(files):
-            img = imread(os.path.join(self.inputdir, f))
-            diameter = (self.diameter_spinbox_z.value(), self.diameter_spinbox_y.value(), self.diameter_spinbox_x.value())
-            separation = (self.separation_spinbox_z.value(), self.separation_spinbox_y.value(), self.separation_spinbox_x.value())
-
-            d = trackpy.locate(img, diameter=diameter, separation=separation)
-            d['time_point'] = i            
-            dfs.append(d)
-            imgs.append(img)
-        
-        object_df = pd.concat(dfs)
+    def _detect_trackpy(self, files: List[str]) -> None:
+        """Load the image data and run trackpy.locate to detect objects in a background worker. The points layer is updated whenever a time point is done."""
+
+        diameter = (self.diameter_spinbox_z.value(), self.diameter_spinbox_y.value(), self.diameter_spinbox_x.value())
+        separation = (self.separation_spinbox_z.value(), self.separation_spinbox_y.value(), self.separation_spinbox_x.value())
+
+        self.detected_frames = {}
+        self.pending_points = []
+        self.detection_cancel = threading.Event()
+        self.detection_progress.setMaximum(len(files))
+        self.detection_progress.setValue(0)
+        self.detection_progress.setFormat('Reading images')
+        self.detection_progress.setVisible(True)
+        self.detect_trackpy_btn.setEnabled(False)
+        self.cancel_detection_btn.setEnabled(True)
+
+        # Run trackpy.locate on the time points in parallel worker threads, the results are combined in time order.
+        cache_dir = os.path.join(self.outputdir, PREPROCESS_CACHE_NAME) if self.preprocess_cache_checkbox.isChecked() else None
+        results_dir = os.path.join(self.outputdir, DETECTION_CACHE_NAME) if self.detection_cache_checkbox.isChecked() else None
+        self.detection_worker = create_worker(detection_task, self.inputdir, files, diameter, separation, max_workers = self.workers_spinbox.value(), cache_dir = cache_dir, results_dir = results_dir, cancel = self.detection_cancel)
+        self.detection_worker.yielded.connect(self._on_detection_yielded)
+        self.detection_worker.returned.connect(self._on_detection_finished)
+        self.detection_worker.errored.connect(self._on_detection_failed)
+        self.detection_worker.start()
+
+    def _on_detection_yielded(self, item:Tuple[str, object]) -> None:
+        """Show the intensity images once they are read, and collect the detections of each time point that is done for the points layer"""
+
+        kind, value = item
+        if kind == 'images':
+            self.intensity_layer = self.viewer.add_image(value, name=os.path.basename(self.inputdir))
+            self.detection_progress.setFormat('Detected %v / %m time points')
+            return
+
+        t, d = value
+        self.detected_frames[t] = d
+        self.detection_progress.setValue(len(self.detected_frames))
+        self.pending_points.append(d)
+        if not self.points_timer.isActive():
+            self.points_timer.start() # update the points layer at most twice a second
+
+    def _add_pending_points(self) -> None:
+        """Append the coordinates of the time points that were detected since the last update to the points layer"""
+
+        self.points_timer.stop()
+        if len(self.pending_points) == 0:
+            return
+        object_df = pd.concat(self.pending_points)
+        self.pending_points = []
+        if self.points is None or self.points not in self.viewer.layers:
+            self.points = self._create_point_layer(object_df)
+        else:
+            self.points.data = np.concatenate([self.points.data, object_df[['time_point', 'z', 'y', 'x']].to_numpy().reshape(-1, 4)])
+
+    def _on_detection_finished(self, object_df:pd.DataFrame) -> None:
+        """Label the detected objects and add the widget for filtering them"""
+
+        if object_df is None:
+            self._on_detection_aborted() # canceled before all time points were done
+            return
+        self._reset_detection_controls()
         object_df['label'] = object_df.index + 2 # We need labels with a value >1 (0 is reserved for background and 1 will be reserved for non-tracked objects in later steps)
         self.filtered_df = object_df.copy()
+        if self.points is None or self.points not in self.viewer.layers:
+            self.points = self._create_point_layer(object_df) # no time point yielded any detections yet
+        else:
+            self.points.data = object_df[['time_point', 'z', 'y', 'x']].to_numpy().reshape(-1, 4)
+        self._add_sliders_widget(object_df) # Add new widget for filtering the objects. 
 
-        intensity_layer = self.viewer.add_image(np.stack(imgs, axis=0), name=os.path.basename(self.inputdir))
-        return intensity_layer, object_df
+    def _clear_cache(self) -> None:
+        """Remove the cached filtered images and detections from the output directory"""
+
+        if self.detection_worker is not None:
+            show_info('The cache cannot be cleared while a detection is running')
+            return
+        self.outputdir = str(self.output_path.text())
+        if len(self.outputdir) == 0 or not os.path.exists(self.outputdir):
+            return
+        PreprocessCache(os.path.join(self.outputdir, PREPROCESS_CACHE_NAME)).clear()
+        DetectionCache(os.path.join(self.outputdir, DETECTION_CACHE_NAME)).clear()
+        show_info('Cleared the detection cache in ' + self.outputdir)
+
+    def _cancel_detection(self) -> None:
+        """Stop the running detection after the time points that are being processed"""
+
+        if self.detection_worker is not None:
+            self.cancel_detection_btn.setEnabled(False)
+            self.detection_progress.setFormat('Canceling...')
+            self.detection_cancel.set() # the worker returns once the time points that are being processed are done
+
+    def _on_detection_aborted(self) -> None:
+        """Keep the detections of the finished time points as a preview, so that the parameters can be adjusted"""
+
+        self._add_pending_points()
+        self._reset_detection_controls()
+        show_info(f'Detection canceled after {len(self.detected_frames)} of {self.detection_progress.maximum()} time points')
+
+    def _on_detection_failed(self, error:Exception) -> None:
+        self._reset_detection_controls()
+        self._show_detection_error(error)
+
+    def _show_detection_error(self, error:Exception) -> None:
+        msg = QMessageBox()
+        msg.setWindowTitle('Detection failed')
+        msg.setText(f'Trackpy could not detect the objects. This is the error: {error}')
+        msg.setIcon(QMessageBox.Warning)
+        msg.setStandardButtons(QMessageBox.Ok)
+        msg.exec_()
+
+    def _reset_detection_controls(self) -> None:
+        self.detection_worker = None
+        self.detection_cancel = None
+        self.points_timer.stop()
+        self.pending_points = []
+        self.detection_progress.setVisible(False)
+        self.detect_trackpy_btn.setEnabled(True)
+        self.cancel_detection_btn.setEnabled(False)
 
     def _create_point_layer(self, df:pd.DataFrame) -> napari.layers.Points:
         """Create a point layer from pandas dataframe"""
@@ -269,7 +438,10 @@ class TrackpyDetector(QWidget):
     def _create_label_image(self, df: pd.DataFrame, output_shape:Tuple[int, int, int]) -> np.ndarray:
         """Create a label image based on a given shape and a dataframe listing the objects"""
 
-        label_image = np.zeros(output_shape, dtype=np.uint16)
+        # Use the smallest dtype that holds the largest label, trackpy ids + 2 can exceed the uint16 range.
+        dtype = smallest_label_dtype(df['label'].max() if len(df) > 0 else 0)
+        show_info(memory_report(output_shape, None, dtype))
+        label_image = np.zeros(output_shape, dtype=dtype)
 
         for _, row in df.iterrows():
             time_point = int(row['time_point'])
@@ -287,9 +459,7 @@ class TrackpyDetector(QWidget):
         self.filtered_df.to_csv(os.path.join(self.outputdir, 'DetectedObjects.csv'), index = False)
 
         label_image = self._create_label_image(self.filtered_df, self.intensity_layer.data.shape)
-        for i in range(label_image.shape[0]):
-            l = label_image[i]
-            imwrite(os.path.join(self.outputdir, (os.path.basename(self.outputdir) + "_labels_TP" + str(i).zfill(4) + '.tif')), np.array(l, dtype = 'uint16'))
+        save_label_stack(self.outputdir, label_image, self.output_format_combo.currentText(), os.path.basename(self.outputdir) + "_labels")
 
     def _add_sliders_widget(self, df:pd.DataFrame) -> None:
         """Add a new tab with slider widgets for the properties 'mass', 'signal', and 'size' to filter the detected objects"""
@@ -336,11 +506,12 @@ class TrackpyDetector(QWidget):
         self.tab_widget.addTab(self.sliders_widget, 'Selection Criteria')
         self.tab_widget.setCurrentIndex(1)
 
-    def _run(self) -> None:
-        """Run trackpy to link the data in the table"""
+    def _input_files(self) -> List[str]:
+        """Return the tif files of the input directory, or None (after informing the user) if there are none or they do not match"""
 
-        # Load all the data
-        files = sorted([f for f in os.listdir(self.inputdir) if '.tif' in f])
+        tiffs = index_tiff_directory(self.inputdir)
+        files = tiffs.files
+        problems = tiffs.validate()
         if not len(files) > 0:
             msg = QMessageBox()
             msg.setWindowTitle('No tif files to track')
@@ -348,11 +519,80 @@ class TrackpyDetector(QWidget):
             msg.setIcon(QMessageBox.Information)
             msg.setStandardButtons(QMessageBox.Ok)
             msg.exec_()
+        elif len(problems) > 0:
+            msg = QMessageBox()
+            msg.setWindowTitle("Inconsistent tif files")
+            msg.setText("The tif files do not all have the same shape:\n" + "\n".join(problems[:10]) + ("\n..." if len(problems) > 10 else ""))
+            msg.setIcon(QMessageBox.Warning)
+            msg.setStandardButtons(QMessageBox.Ok)
+            msg.exec_()
+        else:
+            return files
+        return None
+
+    def _run(self) -> None:
+        """Run trackpy to detect the objects in all time points"""
+
+        files = self._input_files()
+        if files is None or self.detection_worker is not None:
+            return # nothing to detect, or a detection is still running
+        for layer in (self.intensity_layer, self.points, self.preview_points):
+            if layer is not None and layer in self.viewer.layers:
+                self.viewer.layers.remove(layer)
+        self.points = None
+        self.preview_points = None
+        self._detect_trackpy(files) # Run trackpy to detect objects in the background, the points layer fills in as time points are done
+
+    def _add_roi_layer(self) -> None:
+        """Add a shapes layer to draw the region that the preview is limited to"""
+
+        self.viewer.dims.ndisplay = 2 # shapes can only be drawn in 2D
+        if self.roi_layer is None or self.roi_layer not in self.viewer.layers:
+            self.roi_layer = self.viewer.add_shapes(name = 'Detection region', ndim = 4, edge_color = 'yellow', face_color = 'transparent')
+        self.viewer.layers.selection.active = self.roi_layer
+        self.roi_layer.mode = 'add_rectangle'
+
+    def _roi_box(self, frame_shape:Tuple[int, int, int]) -> Tuple[slice, slice, slice]:
+        """Return the (z, y, x) bounding box of the last drawn region, or None if there is none. A region drawn in a single plane covers all z planes."""
+
+        if self.roi_layer is None or self.roi_layer not in self.viewer.layers or len(self.roi_layer.data) == 0:
+            return None
+        vertices = np.asarray(self.roi_layer.data[-1])[:, -3:]
+        box = []
+        for lo, hi, n in zip(vertices.min(axis = 0), vertices.max(axis = 0), frame_shape):
+            start, stop = max(int(np.floor(lo)), 0), min(int(np.ceil(hi)) + 1, n)
+            box.append(slice(start, stop) if stop - start > 1 else slice(0, n))
+        return tuple(box)
+
+    def _preview(self) -> None:
+        """Detect the objects in the current time point only (inside the drawn region, if any), and show them straight away"""
+
+        if not os.path.exists(self.inputdir):
+            return
+        files = self._input_files()
+        if files is None:
+            return
+        if self.intensity_layer is None or self.intensity_layer not in self.viewer.layers:
+            # Only the time points that are looked at are read.
+            self.intensity_layer = self.viewer.add_image(LazyTiffStack(self.inputdir, files), name=os.path.basename(self.inputdir))
+
+        t = min(int(self.viewer.dims.current_step[0]), len(files) - 1)
+        diameter = (self.diameter_spinbox_z.value(), self.diameter_spinbox_y.value(), self.diameter_spinbox_x.value())
+        separation = (self.separation_spinbox_z.value(), self.separation_spinbox_y.value(), self.separation_spinbox_x.value())
+        box = self._roi_box(index_tiff_directory(self.inputdir).frame_shape)
+
+        self.preview_btn.setEnabled(False)
+        worker = create_worker(locate_region, self.inputdir, files[t], t, diameter, separation, box)
+        worker.returned.connect(self._show_preview)
+        worker.errored.connect(self._show_detection_error)
+        worker.finished.connect(lambda: self.preview_btn.setEnabled(True))
+        worker.start()
+
+    def _show_preview(self, df:pd.DataFrame) -> None:
+        """Show the detections of the preview in their own points layer"""
+
+        coordinates = df[['time_point', 'z', 'y', 'x']].to_numpy().reshape(-1, 4)
+        if self.preview_points is None or self.preview_points not in self.viewer.layers:
+            self.preview_points = self.viewer.add_points(coordinates, name="Detection preview", face_color="cyan", opacity=0.5)
         else:
-            if self.intensity_layer is not None and self.intensity_layer in self.viewer.layers:
-                self.viewer.layers.remove(self.intensity_layer)
-            self.intensity_layer, object_df = self._detect_trackpy(files) # Run trackpy to detect objects
-            if self.points is not None:
-                self.viewer.layers.remove(self.points)
-            self.points = self._create_point_layer(object_df) # Create a points layer to show detected objects
-            self._add_sliders_widget(object_df) # Add new widget for filtering the objects. 
\ No newline at end of file
+            self.preview_points.data = coordinates
\ No newline at end of file
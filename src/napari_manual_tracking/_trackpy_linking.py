@@ -1,19 +1,22 @@
 
 import os
 import trackpy
-import tifffile
 import napari
 from napari.utils import Colormap
+from napari.utils.notifications import show_info
 
 import pandas   as pd
 import numpy    as np
 
 from typing                import List, Tuple
 from skimage               import measure
-from skimage.io            import imread
 
 from qtpy.QtWidgets        import QMessageBox, QDoubleSpinBox, QComboBox, QGroupBox, QLabel, QHBoxLayout, QVBoxLayout, QPushButton, QWidget, QFileDialog, QLineEdit, QSpinBox
 
+from .utilities._label_store import LABEL_FORMATS, zarr_available, has_zarr_labels, read_label_stack, save_label_stack
+from .utilities._label_dtype import smallest_label_dtype, memory_report
+from .utilities._tiff_index  import index_tiff_directory
+
 class TrackpyLinker(QWidget):
     """Widget for running linking with trackpy on a directory containing label images.
     
@@ -51,8 +54,15 @@ class TrackpyLinker(QWidget):
         output_layout.addWidget(self.outputdirbtn)
         output_layout.addWidget(self.output_path)
 
+        output_format_layout = QHBoxLayout()
+        self.output_format_combo = QComboBox()
+        self.output_format_combo.addItems(LABEL_FORMATS if zarr_available() else LABEL_FORMATS[:1])
+        output_format_layout.addWidget(QLabel('Output format'))
+        output_format_layout.addWidget(self.output_format_combo)
+
         databox_layout.addLayout(input_layout)
         databox_layout.addLayout(output_layout)
+        databox_layout.addLayout(output_format_layout)
         
         settings_layout.addWidget(databox)
         databox.setLayout(databox_layout)
@@ -144,17 +154,15 @@ class TrackpyLinker(QWidget):
                 self.link_trackpy_btn.setEnabled(True)
     
     def _measure_properties(self, files:List[str]) -> Tuple[napari.layers.Labels, pd.DataFrame]:
-        """Open each file and measure properties, concatenate results and return as labels layer and pandas dataframe."""
+        """Open each file (or time point of the zarr store) and measure properties, concatenate results and return as labels layer and pandas dataframe."""
            
+        stack = read_label_stack(self.inputdir, files)
         dfs = []
-        stack = []
-        for i, f in enumerate(files): 
-            labels = imread(os.path.join(self.inputdir, f))
+        for i, labels in enumerate(stack): 
             props = measure.regionprops_table(labels, properties = ['label', 'centroid'])
             df = pd.DataFrame(props)
             df['frame'] = i
             dfs.append(df)
-            stack.append(labels)
         
         locations = pd.concat(dfs, ignore_index = True)
         locations = locations.rename(columns={"centroid-0": "z", "centroid-1": "y", "centroid-2": "x"})
@@ -162,7 +170,7 @@ class TrackpyLinker(QWidget):
         if self.untracked_labels is not None and self.untracked_labels in self.viewer.layers:
             self.viewer.layers.remove(self.untracked_labels)
 
-        return self.viewer.add_labels(np.stack(stack, axis = 0), name = "Untracked labels"), locations
+        return self.viewer.add_labels(stack, name = "Untracked labels"), locations
 
     def _link_trackpy(self, locations:pd.DataFrame) -> pd.DataFrame:
         """Perform linking with trackpy of the label coordinates in the table"""
@@ -190,7 +198,11 @@ class TrackpyLinker(QWidget):
     def _compute_tracked_labels(self, untracked_labels:np.ndarray, links:pd.DataFrame) -> napari.layers.Labels:
         """Relabel the label image based on the links dataframe to give the same object the same label"""
         
-        tracked_labels = np.copy(untracked_labels)
+        # The particle ids can exceed the range of the input dtype, so pick the smallest dtype that holds both.
+        max_label = max(int(untracked_labels.max()) if untracked_labels.size > 0 else 0, int(links['particle'].max()) if len(links) > 0 else 0)
+        dtype = smallest_label_dtype(max_label)
+        show_info(memory_report(untracked_labels.shape, untracked_labels.dtype, dtype))
+        tracked_labels = untracked_labels.astype(dtype)
         for _, row in links.iterrows():
             frame = int(row['frame'])
             label = row['label']
@@ -228,9 +240,7 @@ class TrackpyLinker(QWidget):
 
             # Save the new segmentation data to the output directory. 
             filename = os.path.basename(self.inputdir)
-            for i in range(tracked_labels.data.shape[0]):
-                stack = tracked_labels.data[i]
-                tifffile.imwrite(os.path.join(self.outputdir, (filename + "_TP" + str(i).zfill(4) + '.tif')), np.array(stack, dtype = 'uint16'))
+            save_label_stack(self.outputdir, tracked_labels.data, self.output_format_combo.currentText(), filename)
 
             # Save the links dataframe to the output directory
             links = links[['frame', 'particle']] # Only keep frame and particle columns, since label properties may be updated in the ManualDivisionTracker widget.
@@ -242,14 +252,23 @@ class TrackpyLinker(QWidget):
         """Run trackpy to link the data in the table"""
 
         # Load all the data
-        files = sorted([f for f in os.listdir(self.inputdir) if '.tif' in f])
-        if not len(files) > 0:
+        tiffs = index_tiff_directory(self.inputdir)
+        files = tiffs.files
+        problems = tiffs.validate(integer = True) if len(files) > 0 and not has_zarr_labels(self.inputdir) else []
+        if not len(files) > 0 and not has_zarr_labels(self.inputdir):
             msg = QMessageBox()
             msg.setWindowTitle("No tif files to track")
-            msg.setText("No tif files were found in this directory. Please add label files as 3D tif images, 1 per time point.")
+            msg.setText("No tif files were found in this directory. Please add label files as 3D tif images, 1 per time point, or as a labels.zarr store.")
             msg.setIcon(QMessageBox.Information)
             msg.setStandardButtons(QMessageBox.Ok)
             msg.exec_()
+        elif len(problems) > 0:
+            msg = QMessageBox()
+            msg.setWindowTitle("Inconsistent tif files")
+            msg.setText("The tif files do not all have the same shape:\n" + "\n".join(problems[:10]) + ("\n..." if len(problems) > 10 else ""))
+            msg.setIcon(QMessageBox.Warning)
+            msg.setStandardButtons(QMessageBox.Ok)
+            msg.exec_()
         else:
             # measure label locations with skimage.measure.regionprops
             self.untracked_labels, locations = self._measure_properties(files)
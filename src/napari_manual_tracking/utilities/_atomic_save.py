@@ -0,0 +1,54 @@
+import os
+import tempfile
+import contextlib
+import tifffile
+
+import numpy                as np
+import pandas               as pd
+
+from typing                 import Dict, Generator, Tuple
+
+def _temporary_path(path:str) -> str:
+    """Create an empty temporary file in the same directory as path, so that it can later be renamed onto path"""
+
+    fd, tmp_path = tempfile.mkstemp(prefix = '.' + os.path.basename(path) + '.', suffix = '.tmp', dir = os.path.dirname(path))
+    os.close(fd)
+    return tmp_path
+
+def _remove_quietly(path:str) -> None:
+    """Remove a (temporary) file if it exists"""
+
+    with contextlib.suppress(OSError):
+        os.remove(path)
+
+def write_snapshot(directory:str, frames:Dict[str, np.ndarray], annotations:pd.DataFrame = None, csv_name:str = 'LabelAnnotations.csv') -> Generator[Tuple[int, int], None, None]:
+    """Write a snapshot of label images (file name -> data) and the annotation table to a directory, yielding (written, total) progress.
+
+    All data is first written to temporary files. Only when every file has been written successfully, the temporary files are renamed onto the original files. Each file is replaced atomically, so a file on disk is always either completely old or completely new, and an error while writing leaves all files unchanged. A crash during the final renames can still leave some time points old and others new.
+    """
+
+    n_total = len(frames) + (annotations is not None)
+    written = []
+    try:
+        for i, (filename, data) in enumerate(frames.items()):
+            path = os.path.join(directory, filename)
+            tmp_path = _temporary_path(path)
+            written.append((tmp_path, path))
+            tifffile.imwrite(tmp_path, data, bigtiff = True)
+            yield i + 1, n_total
+
+        if annotations is not None:
+            path = os.path.join(directory, csv_name)
+            tmp_path = _temporary_path(path)
+            written.append((tmp_path, path))
+            annotations.to_csv(tmp_path, index = False)
+            yield n_total, n_total
+
+    except BaseException:
+        for tmp_path, _ in written:
+            _remove_quietly(tmp_path)
+        raise
+
+    # Everything was written, now move the new files into place.
+    for tmp_path, path in written:
+        os.replace(tmp_path, path)
@@ -0,0 +1,173 @@
+import numpy                as np
+import pandas               as pd
+
+from typing                 import Dict, Iterable, List, Set, Tuple
+
+from ._label_index          import LabelIndex, union_boxes
+from ._lineage_graph        import LineageGraph
+from ._edit_history         import SparseEdit
+
+Box = Tuple[slice, ...]
+
+OPERATIONS = ('convert', 'swap', 'set_parent', 'delete')
+
+def _parse_operation(operation:tuple, n_time_points:int) -> Tuple[str, int, int, List[int]]:
+    """Normalize an operation tuple to (kind, label, other label or parent, time points)"""
+
+    kind = operation[0]
+    if kind not in OPERATIONS:
+        raise ValueError(f'Unknown operation {kind!r}, expected one of {OPERATIONS}')
+    if kind == 'delete':
+        label, other, time_points = operation[1], 0, (operation[2] if len(operation) > 2 else None)
+    elif kind == 'set_parent':
+        label, other, time_points = operation[1], operation[2], []
+    else:
+        label, other, time_points = operation[1], operation[2], (operation[3] if len(operation) > 3 else None)
+    if time_points is None:
+        time_points = range(n_time_points)
+    return kind, int(label), int(other), sorted({int(t) for t in time_points})
+
+def affected_labels(operations:List[tuple], n_time_points:int) -> Tuple[Set[int], Set[int]]:
+    """Return the labels and time points that a list of operations may change"""
+
+    labels, time_points = set(), set()
+    for operation in operations:
+        kind, label, other, tps = _parse_operation(operation, n_time_points)
+        labels.add(label)
+        if kind != 'set_parent':
+            labels.add(other)
+            time_points.update(tps)
+    labels.discard(0)
+    return labels, time_points
+
+class BatchLabelEditor:
+    """Applies a list of label corrections to a 4D (t, z, y, x) label stack, its label table and lineage graph, without any user interface.
+
+    Supported operations (tuples), applied in the given order:
+    - ('convert', source, target[, time_points]): give the source label the target value (0 removes it)
+    - ('swap', label_a, label_b[, time_points]): exchange two label values
+    - ('delete', label[, time_points]): remove a label, same as converting it to 0
+    - ('set_parent', label, parent): change the parent of a label in the lineage graph
+
+    time_points defaults to all time points. The value changes of all operations are first combined into a single mapping per time point, so that every time point is read and written only once, and only inside the bounding boxes of the labels involved.
+    """
+
+    def __init__(self, data, label_df:pd.DataFrame, lineage:LineageGraph, label_index:LabelIndex = None):
+        self.data = data
+        self.label_df = label_df
+        self.lineage = lineage
+        self.label_index = label_index if label_index is not None else LabelIndex(data.shape[0])
+
+    def apply(self, operations:List[tuple], edit:SparseEdit = None) -> Dict[int, Box]:
+        """Apply the operations, recording the changed voxels in edit if given. Returns the region (bounding box) that changed per time point."""
+
+        mappings = {} # time point -> {original value: new value}
+        removal_candidates = set()
+        for operation in operations:
+            kind, label, other, time_points = _parse_operation(operation, self.data.shape[0])
+
+            if kind == 'set_parent':
+                self.lineage.set_parent(label, other)
+                continue
+
+            if kind == 'swap':
+                step = {label: other, other: label}
+            else:
+                step = {label: other}
+                removal_candidates.add(label)
+                if other != 0 and other not in self.lineage:
+                    self.lineage.set_parent(other, 0) # a new label starts a new lineage
+
+            # Combine with the earlier operations: voxels that currently have a value in step get the new value.
+            for t in time_points:
+                mapping = mappings.setdefault(t, {})
+                for original, current in mapping.items():
+                    if current in step:
+                        mapping[original] = step[current]
+                for value, new_value in step.items():
+                    if value not in mapping:
+                        mapping[value] = new_value
+
+        # Group the time points that have the same mapping, and drop the values that end up unchanged.
+        groups = {}
+        for t, mapping in mappings.items():
+            mapping = tuple(sorted((k, v) for k, v in mapping.items() if k != v))
+            if len(mapping) > 0:
+                groups.setdefault(mapping, []).append(t)
+
+        regions = {}
+        for mapping, time_points in groups.items():
+            regions.update(self.apply_mapping(dict(mapping), time_points, edit))
+            self.label_index.apply_mapping(dict(mapping), time_points)
+        self._update_table(groups)
+        present = set(self.label_df['label'].to_numpy().tolist())
+        for label in removal_candidates:
+            if label in self.lineage and label not in present:
+                self.lineage.remove(label)
+        return regions
+
+    def apply_mapping(self, mapping:Dict[int, int], time_points:Iterable[int], edit:SparseEdit = None) -> Dict[int, Box]:
+        """Replace label values following mapping (old value -> new value) in the given time points. Comparisons and writes are restricted to the bounding boxes of the mapped labels, so the cost depends on the object size rather than on the size of the data. The changed voxels are recorded in edit, if given. Returns the changed region per time point."""
+
+        time_points = list(time_points)
+        self.label_index.ensure_indexed(self.data, time_points)
+
+        # Collect the region per time point that contains any of the labels to be replaced.
+        regions = {}
+        for label in mapping:
+            for t, box in self.label_index.boxes(label, time_points).items():
+                regions[t] = union_boxes(regions[t], box) if t in regions else box
+
+        changed = {}
+        for t, box in sorted(regions.items()):
+            key = (t,) + box
+            sub = np.array(self.data[key], copy = True)
+            masks = [(sub == old, new) for old, new in mapping.items()] # compute all masks first, so that swaps do not interfere
+            if not any(mask.any() for mask, _ in masks):
+                continue
+            if edit is not None:
+                changed_mask = np.logical_or.reduce([mask for mask, _ in masks])
+                old_values = sub[changed_mask]
+            for mask, new in masks:
+                sub[mask] = new
+            self.data[key] = sub
+            changed[t] = box
+
+            if edit is not None:
+                # Store the changed voxels as flat indices into the full time point.
+                coords = tuple(c + b.start for c, b in zip(np.nonzero(changed_mask), box))
+                edit.add_voxels(t, np.ravel_multi_index(coords, self.data.shape[1:]), old_values, sub[changed_mask])
+
+        return changed
+
+    def _update_table(self, groups:Dict[tuple, List[int]]) -> None:
+        """Apply the value mappings (mapping -> time points) to the rows of the label table in a single pass, dropping the rows of labels that are converted to 0"""
+
+        time_point_column = self.label_df['time_point'].to_numpy()
+        old_labels = self.label_df['label'].to_numpy()
+        new_labels = old_labels.copy()
+        for mapping, time_points in groups.items():
+            mapping = dict(mapping)
+            rows = np.isin(time_point_column, time_points) & np.isin(old_labels, list(mapping.keys()))
+            new_labels[rows] = pd.Series(old_labels[rows]).map(mapping).to_numpy()
+
+        changed = new_labels != old_labels
+        if not changed.any():
+            return
+        df = self.label_df.copy()
+        df['label'] = new_labels
+        df.loc[changed, 'cell'] = ['Cell ' + str(label).zfill(5) for label in new_labels[changed]]
+        self.label_df = df[new_labels != 0]
+        self._merge_duplicate_rows()
+
+    def _merge_duplicate_rows(self) -> None:
+        """Combine the rows of labels that were merged into an existing label at the same time point, adding up their areas"""
+
+        duplicated = self.label_df.duplicated(subset = ['time_point', 'label'], keep = False)
+        if not duplicated.any():
+            return
+        aggregation = {column: 'first' for column in self.label_df.columns if column not in ('time_point', 'label')}
+        if 'area' in aggregation:
+            aggregation['area'] = 'sum'
+        merged = self.label_df[duplicated].groupby(['time_point', 'label'], as_index = False).agg(aggregation)
+        self.label_df = pd.concat([self.label_df[~duplicated], merged[self.label_df.columns]], ignore_index = True)
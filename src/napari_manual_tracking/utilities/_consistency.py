@@ -0,0 +1,117 @@
+import os
+
+import numpy                as np
+import pandas               as pd
+
+from typing                 import List
+
+from ._label_stats          import label_area_table
+from ._tiff_index           import list_tiff_files
+from ._atomic_save          import write_snapshot
+
+def _parent_table(annotations:pd.DataFrame) -> pd.DataFrame:
+    """One (label, parent) row per label, using the first parent listed for it"""
+
+    return annotations[['label', 'parent']].astype(int).drop_duplicates(subset = 'label').sort_values('label', ignore_index = True)
+
+def find_cycles(labels:np.ndarray, parents:np.ndarray) -> List[List[int]]:
+    """Find the cycles in a lineage given as arrays of labels and their parents (0 or -1 for none).
+
+    Every label points to its parent, and parents that are not in labels point to a shared end node. Following the parents with repeated squaring (log2(n) array lookups) brings every label either to the end node or onto a cycle, so only the few labels that are on a cycle are visited one by one.
+    """
+
+    labels = np.asarray(labels, dtype = np.int64)
+    parents = np.asarray(parents, dtype = np.int64)
+    n = len(labels)
+    if n == 0:
+        return []
+    order = np.argsort(labels)
+    sorted_labels = labels[order]
+    positions = np.clip(np.searchsorted(sorted_labels, parents), 0, n - 1)
+    known = (parents > 0) & (sorted_labels[positions] == parents)
+    next_node = np.append(np.where(known, order[positions], n), n) # node n is the end node, it points to itself
+
+    jump = next_node
+    for _ in range(int(np.ceil(np.log2(n + 1))) + 1):
+        jump = jump[jump]
+    on_cycle = np.unique(jump[jump != n])
+
+    cycles, visited = [], set()
+    for node in on_cycle.tolist():
+        if node in visited:
+            continue
+        cycle = []
+        while node not in visited:
+            visited.add(node)
+            cycle.append(int(labels[node]))
+            node = int(next_node[node])
+        cycles.append(cycle)
+    return cycles
+
+class ConsistencyReport:
+    """Differences between the label images and the label annotation table"""
+
+    def __init__(self, counts:pd.DataFrame, annotations:pd.DataFrame):
+        # Label 1 is reserved for objects that are not tracked, it is not kept in the table.
+        self.counts = counts.loc[counts['label'] > 1, ['time_point', 'label', 'area']]
+        self.annotations = annotations[annotations['label'] > 1]
+
+        # Compare the (time point, label) pairs of the images and the table in one merge.
+        merged = pd.merge(self.counts, self.annotations[['time_point', 'label']].drop_duplicates(), on = ['time_point', 'label'], how = 'outer', indicator = True)
+        self.missing_rows = merged.loc[merged['_merge'] == 'left_only', ['time_point', 'label', 'area']].reset_index(drop = True) # labels in the images that are not in the table
+        self.empty_rows = merged.loc[merged['_merge'] == 'right_only', ['time_point', 'label']].reset_index(drop = True) # table rows without any voxels
+
+        parents = _parent_table(self.annotations)
+        present = np.unique(self.counts['label'].to_numpy())
+        unknown = (parents['parent'] > 0) & ~np.isin(parents['parent'].to_numpy(), present)
+        self.unknown_parents = parents[unknown].reset_index(drop = True) # labels whose parent does not occur in the images
+        self.cycles = find_cycles(parents['label'].to_numpy(), parents['parent'].to_numpy())
+
+    @property
+    def is_consistent(self) -> bool:
+        return len(self.missing_rows) == 0 and len(self.empty_rows) == 0 and len(self.unknown_parents) == 0 and len(self.cycles) == 0
+
+    def summary(self) -> str:
+        """Describe the problems found, listing a few examples of each"""
+
+        if self.is_consistent:
+            return 'The label images and the label annotation table are consistent.'
+
+        def examples(items:List[str]) -> str:
+            return ', '.join(items[:5]) + (', ...' if len(items) > 5 else '')
+
+        lines = []
+        if len(self.missing_rows) > 0:
+            lines.append(f'{len(self.missing_rows)} label(s) in the images are missing from the table: ' + examples([f'{label} (time point {t})' for t, label in zip(self.missing_rows['time_point'], self.missing_rows['label'])]))
+        if len(self.empty_rows) > 0:
+            lines.append(f'{len(self.empty_rows)} table row(s) have no voxels in the images: ' + examples([f'{label} (time point {t})' for t, label in zip(self.empty_rows['time_point'], self.empty_rows['label'])]))
+        if len(self.unknown_parents) > 0:
+            lines.append(f'{len(self.unknown_parents)} label(s) have a parent that does not exist: ' + examples([f'{label} (parent {parent})' for label, parent in zip(self.unknown_parents['label'], self.unknown_parents['parent'])]))
+        if len(self.cycles) > 0:
+            lines.append(f'{len(self.cycles)} cycle(s) in the lineage: ' + examples([' -> '.join(str(label) for label in cycle) for cycle in self.cycles]))
+        return '\n'.join(lines)
+
+    def repaired_table(self) -> pd.DataFrame:
+        """Return a table that matches the label images: one row per label per time point with the counted area. Labels keep their parent; new labels get parent -1 (not tracked), parents that do not exist and one parent per cycle are set to 0 (start of a lineage)."""
+
+        parents = _parent_table(self.annotations)
+        parents.loc[parents['label'].isin(self.unknown_parents['label']), 'parent'] = 0
+        parents.loc[parents['label'].isin([min(cycle) for cycle in self.cycles]), 'parent'] = 0
+
+        table = pd.merge(self.counts, parents, on = 'label', how = 'left')
+        table['parent'] = table['parent'].fillna(-1).astype(int)
+        table['cell'] = np.char.add('Cell ', np.char.zfill(table['label'].to_numpy().astype(str), 5)).astype(object)
+        return table.sort_values(['time_point', 'label'], ignore_index = True)[['time_point', 'label', 'area', 'cell', 'parent']]
+
+def check_label_directory(directory:str, csv_name:str = 'LabelAnnotations.csv', max_workers:int = None) -> ConsistencyReport:
+    """Count the labels of all label images of a directory (in parallel, one bincount per time point) and compare them with its annotation table"""
+
+    counts = label_area_table(directory, list_tiff_files(directory), max_workers = max_workers)
+    annotations = pd.read_csv(os.path.join(directory, csv_name))
+    return ConsistencyReport(counts, annotations)
+
+def repair_label_directory(directory:str, report:ConsistencyReport, csv_name:str = 'LabelAnnotations.csv') -> None:
+    """Replace the annotation table of a directory by the repaired table of a report"""
+
+    for _ in write_snapshot(directory, {}, report.repaired_table(), csv_name):
+        pass
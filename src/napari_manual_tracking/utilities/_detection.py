@@ -0,0 +1,301 @@
+import os
+import json
+import hashlib
+import threading
+import trackpy
+import tifffile
+
+import numpy                as np
+import pandas               as pd
+
+from concurrent.futures     import ThreadPoolExecutor, as_completed
+from typing                 import Generator, List, Tuple
+
+from ._parallel_read        import read_tiff_stack
+
+try:
+    # The separate steps of trackpy.locate, to cache the filtered images. They are not all public, so without them every frame is detected with trackpy.locate.
+    from trackpy.preprocessing  import bandpass, convert_to_int
+    from trackpy.find           import grey_dilation, where_close
+    from trackpy.refine         import refine_com
+    from trackpy.masks          import N_binary_mask
+    from trackpy.uncertainty    import _static_error, measure_noise
+    from trackpy.utils          import validate_tuple, default_pos_columns
+except ImportError:
+    _static_error = None
+
+NOISE_SIZE = 1 # trackpy.locate defaults
+PERCENTILE = 64
+MAX_ITERATIONS = 10
+
+def preprocess_cache_available() -> bool:
+    return _static_error is not None
+
+def _locate_settings(raw_image:np.ndarray, diameter:Tuple[float, ...], separation:Tuple[float, ...]) -> Tuple[Tuple[int, ...], Tuple[float, ...], Tuple[int, ...], float]:
+    """Validate the parameters the way trackpy.locate does. Returns (diameter, separation, radius, threshold)."""
+
+    ndim = raw_image.ndim
+    diameter = tuple(int(x) for x in validate_tuple(diameter, ndim))
+    if not all(x & 1 for x in diameter):
+        raise ValueError("Feature diameter must be an odd integer. Round up.")
+    separation = validate_tuple(separation, ndim) if separation is not None else tuple(x + 1 for x in diameter)
+    radius = tuple(x // 2 for x in diameter)
+    threshold = 1 if np.issubdtype(raw_image.dtype, np.integer) else 1 / 255.
+    return diameter, separation, radius, threshold
+
+def preprocess_frame(raw_image:np.ndarray, diameter:Tuple[float, ...]) -> Tuple[np.ndarray, float]:
+    """The part of trackpy.locate that only depends on the image and the diameter: bandpass filtering and conversion to integers. Returns (image, scale factor)."""
+
+    raw_image = np.squeeze(raw_image)
+    diameter, _, _, threshold = _locate_settings(raw_image, diameter, None)
+    image = bandpass(raw_image, validate_tuple(NOISE_SIZE, raw_image.ndim), diameter, threshold)
+    dtype = raw_image.dtype if np.issubdtype(raw_image.dtype, np.integer) else np.uint8 # for float images, assume a bit depth of 8
+    scale_factor, image = convert_to_int(image, dtype)
+    return image, scale_factor
+
+def locate_preprocessed(raw_image:np.ndarray, image:np.ndarray, scale_factor:float, diameter:Tuple[float, ...], separation:Tuple[float, ...]) -> pd.DataFrame:
+    """The rest of trackpy.locate (with its default settings) on an image from preprocess_frame: finding the local maxima, refining them and characterizing the features. Gives the same result as trackpy.locate(raw_image, diameter, separation = separation)."""
+
+    raw_image = np.squeeze(raw_image)
+    diameter, separation, radius, _ = _locate_settings(raw_image, diameter, separation)
+    pos_columns = default_pos_columns(image.ndim)
+
+    # Find the local maxima, excluding the edges of the image.
+    margin = tuple(max(rad, sep // 2 - 1, sm // 2) for rad, sep, sm in zip(radius, separation, diameter))
+    coords = grey_dilation(image, separation, PERCENTILE, margin, precise = False)
+    refined_coords = refine_com(raw_image, image, radius, coords, max_iterations = MAX_ITERATIONS, engine = 'auto', characterize = True)
+    if len(refined_coords) == 0:
+        return refined_coords
+
+    # Flat peaks return multiple nearby maxima.
+    if np.all(np.greater(separation, 0)):
+        to_drop = where_close(refined_coords[pos_columns], separation, refined_coords['mass'])
+        refined_coords.drop(to_drop, axis = 0, inplace = True)
+        refined_coords.reset_index(drop = True, inplace = True)
+
+    refined_coords['mass'] /= scale_factor
+    if 'signal' in refined_coords:
+        refined_coords['signal'] /= scale_factor
+    condition = refined_coords['mass'] > 0
+    if not condition.all():
+        refined_coords = refined_coords.loc[condition].copy()
+    if len(refined_coords) == 0:
+        return refined_coords
+
+    # Estimate the uncertainty in position.
+    black_level, noise = measure_noise(image, raw_image, radius)
+    mass = refined_coords['raw_mass'].values - N_binary_mask(radius, raw_image.ndim) * black_level
+    ep = _static_error(mass, noise, radius, validate_tuple(NOISE_SIZE, raw_image.ndim))
+    if ep.ndim == 1:
+        refined_coords['ep'] = ep
+    else:
+        ep = pd.DataFrame(ep, columns = ['ep_' + cc for cc in pos_columns])
+        refined_coords = pd.concat([refined_coords, ep], axis = 1)
+    return refined_coords
+
+class PreprocessCache:
+    """Preprocessed (bandpass filtered) frames stored as .npy files in a scratch directory, which are memory-mapped when read.
+
+    An entry is keyed on the file name, size and modification time of the input image and the diameter, so that changing only the separation reuses it. Every input file keeps at most one entry: storing a frame for new settings replaces the old one.
+    """
+
+    def __init__(self, directory:str):
+        self.directory = directory
+
+    def _paths(self, path:str, diameter:Tuple[float, ...]) -> Tuple[str, str, str]:
+        stat = os.stat(path)
+        key = hashlib.sha1(repr((os.path.abspath(path), stat.st_size, stat.st_mtime_ns, tuple(float(d) for d in diameter), NOISE_SIZE, trackpy.__version__)).encode()).hexdigest()[:16]
+        prefix = os.path.join(self.directory, os.path.basename(path) + '.bandpass.')
+        return prefix, prefix + key + '.npy', prefix + key + '.json'
+
+    def load(self, path:str, diameter:Tuple[float, ...]) -> Tuple[np.ndarray, float]:
+        """Return (memory-mapped image, scale factor) for the input image, or None if it is not in the cache"""
+
+        _, npy_path, json_path = self._paths(path, diameter)
+        if not os.path.exists(json_path): # written last, so the entry is complete
+            return None
+        try:
+            with open(json_path) as f:
+                scale_factor = json.load(f)['scale_factor']
+            return np.load(npy_path, mmap_mode = 'r'), scale_factor
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def store(self, path:str, diameter:Tuple[float, ...], image:np.ndarray, scale_factor:float) -> None:
+        prefix, npy_path, json_path = self._paths(path, diameter)
+        os.makedirs(self.directory, exist_ok = True)
+        for f in os.listdir(self.directory):
+            old_path = os.path.join(self.directory, f)
+            if old_path.startswith(prefix) and old_path not in (npy_path, json_path):
+                os.remove(old_path)
+        np.save(npy_path + '.tmp.npy', image)
+        os.replace(npy_path + '.tmp.npy', npy_path)
+        with open(json_path + '.tmp', 'w') as f:
+            json.dump({'scale_factor': float(scale_factor)}, f)
+        os.replace(json_path + '.tmp', json_path)
+
+    def clear(self) -> None:
+        """Remove all preprocessed frames"""
+
+        if os.path.isdir(self.directory):
+            for f in os.listdir(self.directory):
+                if f.endswith(('.npy', '.json')):
+                    os.remove(os.path.join(self.directory, f))
+
+class DetectionCache:
+    """Detection tables per input file, stored column by column in uncompressed .npz files.
+
+    An entry is keyed on the directory of the input file, a fingerprint of the file (size and modification time) and on the diameter and separation. Entries for other settings are kept, so going back to earlier settings is instant as well; entries of an older version of a file are removed when a new one is stored. Files with the same name in other directories have their own entries.
+    """
+
+    def __init__(self, directory:str):
+        self.directory = directory
+
+    def _paths(self, path:str, diameter:Tuple[float, ...], separation:Tuple[float, ...]) -> Tuple[str, str]:
+        stat = os.stat(path)
+        path = os.path.abspath(path)
+        source = hashlib.sha1(os.path.dirname(path).encode()).hexdigest()[:8]
+        fingerprint = hashlib.sha1(repr((path, stat.st_size, stat.st_mtime_ns, trackpy.__version__)).encode()).hexdigest()[:16]
+        settings = hashlib.sha1(repr((tuple(float(d) for d in diameter), tuple(float(s) for s in separation))).encode()).hexdigest()[:16]
+        prefix = os.path.join(self.directory, os.path.basename(path) + '.' + source + '.detections.')
+        return prefix, prefix + fingerprint + '.' + settings + '.npz'
+
+    def load(self, path:str, diameter:Tuple[float, ...], separation:Tuple[float, ...]) -> pd.DataFrame:
+        """Return the detections of an input image, or None if they are not in the cache"""
+
+        _, npz_path = self._paths(path, diameter, separation)
+        if not os.path.exists(npz_path):
+            return None
+        try:
+            with np.load(npz_path, allow_pickle = False) as arrays:
+                columns = arrays['columns'].tolist()
+                return pd.DataFrame({c: arrays[f'column_{i}'] for i, c in enumerate(columns)}, index = arrays['index'], columns = columns)
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def store(self, path:str, diameter:Tuple[float, ...], separation:Tuple[float, ...], df:pd.DataFrame) -> None:
+        prefix, npz_path = self._paths(path, diameter, separation)
+        os.makedirs(self.directory, exist_ok = True)
+        current = npz_path[:-len('.npz')].rsplit('.', 1)[0] + '.' # prefix + fingerprint
+        for f in os.listdir(self.directory):
+            old_path = os.path.join(self.directory, f)
+            if old_path.startswith(prefix) and not old_path.startswith(current):
+                os.remove(old_path) # detections of an older version of the file
+        arrays = {f'column_{i}': df[c].to_numpy() for i, c in enumerate(df.columns)}
+        tmp_path = npz_path + '.tmp.npz'
+        np.savez(tmp_path, columns = np.array([str(c) for c in df.columns]), index = df.index.to_numpy(), **arrays)
+        os.replace(tmp_path, npz_path)
+
+    def clear(self) -> None:
+        """Remove all stored detections"""
+
+        if os.path.isdir(self.directory):
+            for f in os.listdir(self.directory):
+                if f.endswith('.npz'):
+                    os.remove(os.path.join(self.directory, f))
+
+def locate_frame(directory:str, file:str, time_point:int, diameter:Tuple[float, ...], separation:Tuple[float, ...], cache_dir:str = None, results_dir:str = None) -> pd.DataFrame:
+    """Read one intensity image and detect its objects like trackpy.locate. If cache_dir is given (and preprocess_cache_available()), the preprocessed image is taken from (or added to) the cache there, so that only the peak finding and refinement are repeated. If results_dir is given, the detections are stored there for later runs with the same settings."""
+
+    path = os.path.join(directory, file)
+    raw_image = tifffile.imread(path)
+    if cache_dir is None or not preprocess_cache_available():
+        d = trackpy.locate(raw_image, diameter = diameter, separation = separation)
+    else:
+        cache = PreprocessCache(cache_dir)
+        cached = cache.load(path, diameter)
+        if cached is None:
+            cached = preprocess_frame(raw_image, diameter)
+            cache.store(path, diameter, *cached)
+        d = locate_preprocessed(raw_image, cached[0], cached[1], diameter, separation)
+    if results_dir is not None:
+        DetectionCache(results_dir).store(path, diameter, separation, d)
+    d['time_point'] = time_point
+    return d
+
+def locate_region(directory:str, file:str, time_point:int, diameter:Tuple[float, ...], separation:Tuple[float, ...], box:Tuple[slice, ...] = None) -> pd.DataFrame:
+    """Detect the objects of a single time point with trackpy.locate, only inside box (a (z, y, x) region) if given. The coordinates are those of the full image.
+
+    The image is cropped to the box padded by a diameter on every side, so that objects at the edges of the box are filtered and refined as in the full image, and only the objects whose centre lies inside the box are kept.
+    """
+
+    image = tifffile.imread(os.path.join(directory, file))
+    if box is None:
+        d = trackpy.locate(image, diameter = diameter, separation = separation)
+        d['time_point'] = time_point
+        return d
+
+    box = [range(*s.indices(n)) for s, n in zip(box, image.shape)]
+    margins = np.ceil(np.broadcast_to(diameter, (image.ndim,))).astype(int)
+    crop = tuple(slice(max(r.start - m, 0), min(r.stop + m, n)) for r, m, n in zip(box, margins, image.shape))
+    d = trackpy.locate(image[crop], diameter = diameter, separation = separation)
+    inside = np.ones(len(d), dtype = bool)
+    for column, r, s in zip(['z', 'y', 'x'], box, crop):
+        d[column] += s.start
+        inside &= (d[column] >= r.start - 0.5) & (d[column] < r.stop - 0.5) # the centre is in one of the pixels of the box
+    d = d[inside].copy()
+    d['time_point'] = time_point
+    return d
+
+def _locate_unless_canceled(cancel:threading.Event, *args) -> pd.DataFrame:
+    """locate_frame, or None if the detection was canceled before this time point started"""
+
+    return None if cancel is not None and cancel.is_set() else locate_frame(*args)
+
+def locate_frames(directory:str, files:List[str], diameter:Tuple[float, ...], separation:Tuple[float, ...], max_workers:int = None, cache_dir:str = None, results_dir:str = None, cancel:threading.Event = None) -> Generator[Tuple[int, pd.DataFrame], None, None]:
+    """Detect the objects in every time point, yielding (time point, detections) as soon as a time point is done, which is not necessarily in time order.
+
+    Time points whose detections for these settings are in results_dir (if given) are loaded from there first. The other time points are distributed over a thread pool, every thread reading its own file. Decoding the files and the filtering in trackpy (scipy.ndimage) release the GIL, so the threads run in parallel without starting worker processes from the GUI process.
+    Once cancel (if given) is set, no new time points are started and the generator stops after the time points that are being processed.
+    """
+
+    done = set()
+    if results_dir is not None:
+        results = DetectionCache(results_dir)
+        for t, f in enumerate(files):
+            if cancel is not None and cancel.is_set():
+                return
+            d = results.load(os.path.join(directory, f), diameter, separation)
+            if d is not None:
+                d['time_point'] = t
+                done.add(t)
+                yield t, d
+        if len(done) > 0:
+            print('loaded the detections of', len(done), 'time point(s) from the cache')
+
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    max_workers = max(1, min(max_workers, len(files) - len(done)))
+
+    if max_workers > 1:
+        with ThreadPoolExecutor(max_workers = max_workers) as executor:
+            futures = {executor.submit(_locate_unless_canceled, cancel, directory, f, t, diameter, separation, cache_dir, results_dir): t for t, f in enumerate(files) if t not in done}
+            try:
+                for future in as_completed(futures):
+                    d = future.result()
+                    if cancel is not None and cancel.is_set():
+                        return
+                    yield futures[future], d
+            finally:
+                # Do not start the remaining time points if the caller stopped early.
+                for future in futures:
+                    future.cancel()
+        return
+
+    for t, f in enumerate(files):
+        if cancel is not None and cancel.is_set():
+            return
+        if t not in done:
+            yield t, locate_frame(directory, f, t, diameter, separation, cache_dir, results_dir)
+
+def detection_task(directory:str, files:List[str], diameter:Tuple[float, ...], separation:Tuple[float, ...], max_workers:int = None, cache_dir:str = None, results_dir:str = None, cancel:threading.Event = None) -> Generator[Tuple[str, object], None, pd.DataFrame]:
+    """Detection as a background task: yields ('images', intensity stack) once the images are read, then ('frame', (time point, detections)) whenever a time point is done. Returns the combined detections in time order, or None if cancel was set before all time points were done."""
+
+    yield 'images', read_tiff_stack(directory, files)
+    results = {}
+    for t, d in locate_frames(directory, files, diameter, separation, max_workers, cache_dir, results_dir, cancel):
+        results[t] = d
+        yield 'frame', (t, d)
+    if len(results) < len(files):
+        return None # canceled
+    return pd.concat([results[t] for t in range(len(files))])
@@ -0,0 +1,108 @@
+import numpy                as np
+import pandas               as pd
+
+from typing                 import Iterable
+
+class SparseEdit:
+    """Compact record of a single edit operation.
+
+    Stores only the voxels that changed (flat indices per time point with their old and new values), the parent table entries that changed, and the rows of the label table that belong to the labels and time points involved.
+    """
+
+    def __init__(self, description:str, labels:Iterable[int], time_points:Iterable[int], rows_before:pd.DataFrame):
+        self.description = description
+        self.labels = np.array(sorted({int(label) for label in labels}), dtype = int)
+        self.time_points = np.array(sorted({int(t) for t in time_points}), dtype = int)
+        self.voxels = {} # time point -> (flat indices, old values, new values)
+        self.parents = {} # label -> (old parent, new parent), None if the label was not in the parent table
+        self.rows_before = rows_before
+        self.rows_after = None
+
+    def add_voxels(self, t:int, flat_indices:np.ndarray, old_values:np.ndarray, new_values:np.ndarray) -> None:
+        """Record the voxels that changed in time point t"""
+
+        if len(flat_indices) == 0:
+            return
+        # Use the smallest index type that fits, to keep the record compact.
+        index_dtype = np.uint32 if flat_indices.max() < np.iinfo(np.uint32).max else np.uint64
+        self.voxels[int(t)] = (flat_indices.astype(index_dtype), old_values.copy(), new_values.copy())
+
+    @property
+    def is_empty(self) -> bool:
+        return len(self.voxels) == 0 and len(self.parents) == 0
+
+    @property
+    def nbytes(self) -> int:
+        """Approximate memory used by this record"""
+
+        n = sum(flat.nbytes + old.nbytes + new.nbytes for flat, old, new in self.voxels.values())
+        n += 3 * 8 * len(self.parents)
+        for rows in (self.rows_before, self.rows_after):
+            if rows is not None:
+                n += int(rows.memory_usage(index = True, deep = True).sum())
+        return n
+
+class EditHistory:
+    """Undo / redo history of SparseEdit records, limited to a maximum amount of memory"""
+
+    def __init__(self, max_bytes:int = 256 * 1024 ** 2):
+        self.max_bytes = max_bytes
+        self._undo_stack = []
+        self._redo_stack = []
+
+    @property
+    def nbytes(self) -> int:
+        return sum(edit.nbytes for edit in self._undo_stack + self._redo_stack)
+
+    def can_undo(self) -> bool:
+        return len(self._undo_stack) > 0
+
+    def can_redo(self) -> bool:
+        return len(self._redo_stack) > 0
+
+    def push(self, edit:SparseEdit) -> int:
+        """Add a new edit, clearing the redo stack, and drop the oldest edits if the memory limit is exceeded. Returns the number of dropped edits."""
+
+        if edit.is_empty:
+            return 0
+        self._redo_stack = []
+        self._undo_stack.append(edit)
+        return self._enforce_limit()
+
+    def _enforce_limit(self) -> int:
+        """Drop the oldest records until the history fits within max_bytes. Returns the number of dropped records."""
+
+        sizes = [edit.nbytes for edit in self._undo_stack]
+        total = sum(sizes)
+        n_drop = 0
+        while n_drop < len(sizes) and total > self.max_bytes:
+            total -= sizes[n_drop]
+            n_drop += 1
+        self._undo_stack = self._undo_stack[n_drop:]
+        return n_drop
+
+    def set_max_bytes(self, max_bytes:int) -> int:
+        self.max_bytes = max_bytes
+        return self._enforce_limit()
+
+    def undo(self) -> SparseEdit:
+        """Return the most recent edit to revert, or None"""
+
+        if not self.can_undo():
+            return None
+        edit = self._undo_stack.pop()
+        self._redo_stack.append(edit)
+        return edit
+
+    def redo(self) -> SparseEdit:
+        """Return the most recently reverted edit to apply again, or None"""
+
+        if not self.can_redo():
+            return None
+        edit = self._redo_stack.pop()
+        self._undo_stack.append(edit)
+        return edit
+
+    def clear(self) -> None:
+        self._undo_stack = []
+        self._redo_stack = []
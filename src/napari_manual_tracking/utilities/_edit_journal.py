@@ -0,0 +1,173 @@
+import io
+import os
+import shutil
+import struct
+import threading
+import zipfile
+
+import numpy                as np
+
+from typing                 import Dict, Generator, List, Tuple
+
+Box = Tuple[slice, ...]
+
+class JournalRecord:
+    """One autosave entry: the current content of the regions that were edited, and the parent table entries that changed"""
+
+    def __init__(self, regions:List[Tuple[int, Box, np.ndarray]], parents:Dict[int, int], removed_labels:List[int]):
+        self.regions = regions # (time point, box, label values inside the box)
+        self.parents = parents # label -> new parent
+        self.removed_labels = removed_labels # labels that were removed from the parent table
+
+    def to_bytes(self) -> bytes:
+        """Encode the record as a compressed npz archive"""
+
+        arrays = {
+            'time_points': np.array([t for t, _, _ in self.regions], dtype = np.int64),
+            'starts': np.array([[s.start for s in box] for _, box, _ in self.regions], dtype = np.int64),
+            'stops': np.array([[s.stop for s in box] for _, box, _ in self.regions], dtype = np.int64),
+            'parent_labels': np.array(list(self.parents.keys()), dtype = np.int64),
+            'parent_values': np.array(list(self.parents.values()), dtype = np.int64),
+            'removed_labels': np.array(self.removed_labels, dtype = np.int64),
+        }
+        for i, (_, _, data) in enumerate(self.regions):
+            arrays[f'data_{i}'] = data
+        buffer = io.BytesIO()
+        np.savez_compressed(buffer, **arrays)
+        return buffer.getvalue()
+
+    @classmethod
+    def from_bytes(cls, payload:bytes) -> 'JournalRecord':
+        with np.load(io.BytesIO(payload), allow_pickle = False) as arrays:
+            regions = []
+            for i, t in enumerate(arrays['time_points']):
+                box = tuple(slice(int(a), int(b)) for a, b in zip(arrays['starts'][i], arrays['stops'][i]))
+                regions.append((int(t), box, arrays[f'data_{i}']))
+            parents = dict(zip(arrays['parent_labels'].tolist(), arrays['parent_values'].tolist()))
+            return cls(regions, parents, arrays['removed_labels'].tolist())
+
+class EditJournal:
+    """Append-only crash-recovery journal of the edits made since the last save.
+
+    Every record is stored as an 8 byte length followed by the compressed record, so that a record that was only partly written (e.g. during a crash) can be detected and skipped. While a save is in progress, the journal is moved aside (rotate), so that edits made during the save end up in a new journal. After the save succeeded, the old journal is deleted (commit_rotation), otherwise the two are joined again (abort_rotation).
+    """
+
+    def __init__(self, path:str):
+        self.path = path
+        self.saving_path = path + '.saving'
+        self._lock = threading.Lock() # appending may happen in a worker thread
+
+    def exists(self) -> bool:
+        return os.path.exists(self.path) or os.path.exists(self.saving_path)
+
+    def is_newer_than(self, paths:List[str]) -> bool:
+        """Check whether the journal was written after the last modification of any of the given files"""
+
+        journal_times = [os.path.getmtime(p) for p in (self.path, self.saving_path) if os.path.exists(p)]
+        file_times = [os.path.getmtime(p) for p in paths if os.path.exists(p)]
+        if len(journal_times) == 0:
+            return False
+        return len(file_times) == 0 or max(journal_times) > max(file_times)
+
+    def append(self, record:JournalRecord) -> None:
+        """Add a record to the end of the journal"""
+
+        payload = record.to_bytes()
+        with self._lock:
+            with open(self.path, 'ab') as f:
+                f.write(struct.pack('<Q', len(payload)))
+                f.write(payload)
+                f.flush()
+                os.fsync(f.fileno())
+
+    def _read(self) -> Generator[Tuple[bytes, JournalRecord], None, None]:
+        """Read all complete records (and their encoded form), oldest first"""
+
+        for path in (self.saving_path, self.path):
+            if not os.path.exists(path):
+                continue
+            with open(path, 'rb') as f:
+                while True:
+                    header = f.read(8)
+                    if len(header) < 8:
+                        break
+                    payload = f.read(struct.unpack('<Q', header)[0])
+                    try:
+                        record = JournalRecord.from_bytes(payload)
+                    except (ValueError, zipfile.BadZipFile, KeyError, EOFError):
+                        print('skipping incomplete journal record in', path)
+                        break
+                    yield payload, record
+
+    def records(self) -> Generator[JournalRecord, None, None]:
+        """Read all complete records, oldest first"""
+
+        for _, record in self._read():
+            yield record
+
+    def compact(self) -> None:
+        """Rewrite the journal with only its complete records, so that records appended later are not hidden behind an incomplete one"""
+
+        with self._lock:
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'wb') as f:
+                for payload, _ in self._read():
+                    f.write(struct.pack('<Q', len(payload)))
+                    f.write(payload)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+            if os.path.exists(self.saving_path):
+                os.remove(self.saving_path)
+
+    def rotate(self) -> None:
+        """Move the current journal aside before saving"""
+
+        with self._lock:
+            if not os.path.exists(self.path):
+                return
+            if os.path.exists(self.saving_path):
+                # an earlier save failed, keep the older records in front
+                self._join(self.saving_path, self.path)
+                os.remove(self.path)
+            else:
+                os.replace(self.path, self.saving_path)
+
+    def commit_rotation(self) -> None:
+        """The save succeeded, the journal that was moved aside is no longer needed"""
+
+        with self._lock:
+            if os.path.exists(self.saving_path):
+                os.remove(self.saving_path)
+
+    def abort_rotation(self) -> None:
+        """The save failed, put the records that were moved aside back in front of the journal"""
+
+        with self._lock:
+            if not os.path.exists(self.saving_path):
+                return
+            if os.path.exists(self.path):
+                self._join(self.saving_path, self.path)
+            os.replace(self.saving_path, self.path)
+
+    def clear(self) -> None:
+        """Delete the journal"""
+
+        with self._lock:
+            for path in (self.path, self.saving_path):
+                if os.path.exists(path):
+                    os.remove(path)
+
+    @staticmethod
+    def _join(first:str, second:str) -> None:
+        """Append the contents of second to first"""
+
+        with open(first, 'ab') as dst, open(second, 'rb') as src:
+            shutil.copyfileobj(src, dst)
+
+def append_before(journal:EditJournal, record:JournalRecord, task:Generator) -> Generator:
+    """Append a record to the journal and then run a save task (a generator, e.g. write_snapshot), in the same background thread. Yields and returns what the task yields and returns."""
+
+    if record is not None:
+        journal.append(record)
+    return (yield from task)
@@ -0,0 +1,61 @@
+from qtpy.QtCore           import QObject, QTimer
+
+from typing                 import Callable, Dict, Set, Tuple
+
+from ._label_index          import union_boxes
+
+Box = Tuple[slice, ...]
+
+class EventCoalescer(QObject):
+    """Collects label updates (time point, label and painted region) over a short time window and hands them to a callback as a single batch.
+
+    The window starts at the first update after a batch was processed, so a long paint stroke still refreshes regularly. With a window of 0 ms every update is processed immediately.
+    """
+
+    def __init__(self, callback:Callable[[Dict[int, Box], Set[int]], None], interval_ms:int = 100):
+        super().__init__()
+        self.callback = callback
+        self._regions = {} # time point -> bounding box of all painted regions, None means the full frame
+        self._labels = set()
+        self._timer = QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.timeout.connect(self.flush)
+        self.set_interval(interval_ms)
+
+    @property
+    def pending(self) -> bool:
+        return len(self._regions) > 0 or len(self._labels) > 0
+
+    def set_interval(self, interval_ms:int) -> None:
+        self._timer.setInterval(max(0, int(interval_ms)))
+
+    def add(self, time_point:int, label:int, box:Box = None) -> None:
+        """Register an update. If box is None, the entire time point is counted again."""
+
+        if time_point in self._regions:
+            previous = self._regions[time_point]
+            self._regions[time_point] = None if previous is None or box is None else union_boxes(previous, box)
+        else:
+            self._regions[time_point] = box
+        self._labels.add(label)
+
+        if self._timer.interval() == 0:
+            self.flush()
+        elif not self._timer.isActive():
+            self._timer.start()
+
+    def flush(self) -> None:
+        """Process all pending updates now"""
+
+        self._timer.stop()
+        if not self.pending:
+            return
+        regions, labels = self._regions, self._labels
+        self._regions, self._labels = {}, set()
+        self.callback(regions, labels)
+
+    def clear(self) -> None:
+        """Drop all pending updates without processing them"""
+
+        self._timer.stop()
+        self._regions, self._labels = {}, set()
@@ -0,0 +1,82 @@
+import numpy                as np
+
+from typing                 import Tuple
+
+LABEL_DTYPES = (np.uint8, np.uint16, np.uint32, np.uint64)
+
+def smallest_label_dtype(max_label:int, minimum = np.uint8) -> np.dtype:
+    """Return the smallest unsigned integer dtype (at least minimum) that can hold label values up to max_label"""
+
+    max_label = max(int(max_label), 0)
+    for dtype in LABEL_DTYPES:
+        if np.dtype(dtype).itemsize >= np.dtype(minimum).itemsize and max_label <= np.iinfo(dtype).max:
+            return np.dtype(dtype)
+    raise OverflowError(f'Label value {max_label} does not fit in any unsigned integer dtype')
+
+def label_fits(dtype, label:int) -> bool:
+    """Check whether a label value can be stored in dtype"""
+
+    dtype = np.dtype(dtype)
+    if dtype.kind not in 'ui':
+        return False
+    return np.iinfo(dtype).min <= int(label) <= np.iinfo(dtype).max
+
+def promoted_label_dtype(dtype, label:int) -> np.dtype:
+    """Return dtype if it can hold label, otherwise the smallest unsigned dtype that can (never smaller than dtype)"""
+
+    dtype = np.dtype(dtype)
+    if label_fits(dtype, label):
+        return dtype
+    new_dtype = smallest_label_dtype(label)
+    if dtype.kind in 'ui' and dtype.itemsize > new_dtype.itemsize:
+        # e.g. a negative value in an unsigned array, keep the width
+        new_dtype = np.dtype(f'uint{dtype.itemsize * 8}')
+    return new_dtype
+
+def promote_label_dtype(*dtypes) -> np.dtype:
+    """Return a dtype that can hold the data of all given dtypes. Integer data is taken to be labels, which are never negative, so a mix of integer dtypes gives the widest unsigned dtype among them (np.result_type gives float64 for e.g. uint64 and int64). Other data uses np.result_type."""
+
+    dtypes = [np.dtype(dtype) for dtype in dtypes]
+    if len(dtypes) == 0:
+        raise ValueError('At least one dtype is required')
+    if all(dtype == dtypes[0] for dtype in dtypes):
+        return dtypes[0]
+    if all(dtype.kind in 'ui' for dtype in dtypes):
+        return np.dtype(f'uint{max(dtype.itemsize for dtype in dtypes) * 8}')
+    return np.result_type(*dtypes)
+
+def format_bytes(n:float) -> str:
+    """Format a number of bytes for display"""
+
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if abs(n) < 1024:
+            return f'{n:.1f} {unit}'
+        n /= 1024
+    return f'{n:.1f} TB'
+
+def memory_report(shape:Tuple[int, ...], old_dtype, new_dtype) -> str:
+    """Describe the memory used by an array of this shape in new_dtype compared to old_dtype, or on its own if old_dtype is None (a new array)"""
+
+    n = int(np.prod(shape))
+    if old_dtype is None:
+        return f'labels stored as {np.dtype(new_dtype)} ({format_bytes(n * np.dtype(new_dtype).itemsize)})'
+    old_bytes = n * np.dtype(old_dtype).itemsize
+    new_bytes = n * np.dtype(new_dtype).itemsize
+    if new_bytes < old_bytes:
+        return f'labels stored as {np.dtype(new_dtype)} instead of {np.dtype(old_dtype)}: {format_bytes(new_bytes)} instead of {format_bytes(old_bytes)}, saving {format_bytes(old_bytes - new_bytes)}'
+    if new_bytes > old_bytes:
+        return f'labels promoted from {np.dtype(old_dtype)} to {np.dtype(new_dtype)}: {format_bytes(new_bytes)} instead of {format_bytes(old_bytes)}'
+    return f'labels stored as {np.dtype(new_dtype)} ({format_bytes(new_bytes)})'
+
+def compact_labels(labels:np.ndarray, minimum = np.uint8) -> np.ndarray:
+    """Convert a label array to the smallest unsigned dtype (at least minimum) that fits its largest label. Use memory_report to describe the memory saved."""
+
+    labels = np.asarray(labels)
+    if labels.size == 0:
+        return labels
+    if labels.dtype.kind == 'i' and labels.min() < 0:
+        raise ValueError('Label images cannot contain negative values')
+    dtype = smallest_label_dtype(labels.max(), minimum)
+    if dtype != labels.dtype:
+        labels = labels.astype(dtype)
+    return labels
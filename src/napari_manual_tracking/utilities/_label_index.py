@@ -0,0 +1,138 @@
+import numpy                as np
+
+from scipy                  import ndimage
+from typing                 import Dict, Iterable, Set, Tuple
+
+Box = Tuple[slice, ...]
+
+def union_boxes(a:Box, b:Box) -> Box:
+    """Smallest bounding box containing both boxes"""
+
+    return tuple(slice(min(x.start, y.start), max(x.stop, y.stop)) for x, y in zip(a, b))
+
+def paint_regions(atoms:Iterable) -> Dict[int, Tuple[Box, Set[int]]]:
+    """Determine per time point the spatial bounding box and the painted label values of the history atoms of a napari Labels paint event.
+
+    An atom is either a mask-based edit (bounding box, mask, old values, new value), or a (indices, old values, new values) tuple of coordinate arrays.
+    """
+
+    regions = {}
+    for atom in atoms:
+        if isinstance(atom[0][0], slice):
+            slice_key, new_values = atom[0], np.atleast_1d(atom[3])
+            for t in range(slice_key[0].start, slice_key[0].stop):
+                _add_paint_region(regions, t, tuple(slice_key[1:]), new_values)
+            continue
+        indices, _, new_values = atom
+        coords = np.broadcast_arrays(*[np.asarray(i) for i in indices])
+        new_values = np.broadcast_to(np.asarray(new_values), coords[0].shape)
+        for t in np.unique(coords[0]):
+            mask = coords[0] == t
+            box = tuple(slice(int(c[mask].min()), int(c[mask].max()) + 1) for c in coords[1:])
+            _add_paint_region(regions, int(t), box, new_values[mask])
+    return regions
+
+def _add_paint_region(regions:Dict[int, Tuple[Box, Set[int]]], t:int, box:Box, values:np.ndarray) -> None:
+    labels = {int(v) for v in np.unique(values)}
+    if t in regions:
+        previous_box, previous_labels = regions[t]
+        regions[t] = (union_boxes(previous_box, box), previous_labels | labels)
+    else:
+        regions[t] = (box, labels)
+
+class LabelIndex:
+    """Index from each label to the time points and the bounding boxes it occupies in a 4D (t, z, y, x) label stack.
+
+    Time points are only scanned the first time they are needed, so that building the index does not require reading all data at once. The bounding boxes are conservative: after paint events they may be larger than the label itself, but never smaller.
+    """
+
+    def __init__(self, n_time_points:int):
+        self._boxes = {} # label -> {time point: bounding box}
+        self._frame_labels = {} # time point -> set of labels present in the index for that time point
+        self._indexed = np.zeros(n_time_points, dtype = bool)
+
+    def _set(self, label:int, t:int, box:Box) -> None:
+        """Store the bounding box of a label at time point t, growing any box that is already present"""
+
+        boxes = self._boxes.setdefault(label, {})
+        boxes[t] = union_boxes(boxes[t], box) if t in boxes else box
+        self._frame_labels.setdefault(t, set()).add(label)
+
+    def _pop(self, label:int, t:int) -> Box:
+        """Remove the bounding box of a label at time point t and return it (None if absent)"""
+
+        boxes = self._boxes.get(label)
+        if boxes is None or t not in boxes:
+            return None
+        box = boxes.pop(t)
+        if len(boxes) == 0:
+            del self._boxes[label]
+        self._frame_labels[t].discard(label)
+        return box
+
+    def index_frame(self, t:int, frame:np.ndarray) -> None:
+        """(Re)compute the bounding boxes of all labels in a single time point"""
+
+        self.invalidate([t])
+        for i, box in enumerate(ndimage.find_objects(frame)):
+            if box is not None:
+                self._set(i + 1, t, box)
+        self._indexed[t] = True
+
+    def is_indexed(self, t:int) -> bool:
+        return bool(self._indexed[t])
+
+    def ensure_indexed(self, data, time_points:Iterable[int]) -> None:
+        """Scan the time points that have not been indexed yet"""
+
+        for t in time_points:
+            if not self._indexed[t]:
+                self.index_frame(t, np.asarray(data[t]))
+
+    def invalidate(self, time_points:Iterable[int]) -> None:
+        """Forget the bounding boxes of the given time points, they will be scanned again when they are needed"""
+
+        for t in time_points:
+            for label in self._frame_labels.pop(t, set()):
+                boxes = self._boxes.get(label)
+                if boxes is not None:
+                    boxes.pop(t, None)
+                    if len(boxes) == 0:
+                        del self._boxes[label]
+            self._indexed[t] = False
+
+    def boxes(self, label:int, time_points:Iterable[int] = None) -> Dict[int, Box]:
+        """Return the bounding box per time point of a label, optionally restricted to the given time points"""
+
+        boxes = self._boxes.get(label, {})
+        if time_points is None:
+            return dict(boxes)
+        return {t: boxes[t] for t in time_points if t in boxes}
+
+    def labels_in_region(self, t:int, box:Box) -> Dict[int, Box]:
+        """Return the labels (with their bounding box) whose bounding box at time point t intersects box"""
+
+        found = {}
+        for label in self._frame_labels.get(t, set()):
+            label_box = self._boxes[label][t]
+            if all(a.start < b.stop and b.start < a.stop for a, b in zip(label_box, box)):
+                found[label] = label_box
+        return found
+
+    def add_region(self, t:int, labels:Iterable[int], box:Box) -> None:
+        """Register that the given labels were painted inside box at time point t"""
+
+        if not self._indexed[t]:
+            return # the time point will be scanned completely when it is needed
+        for label in labels:
+            if label != 0:
+                self._set(int(label), t, box)
+
+    def apply_mapping(self, mapping:Dict[int, int], time_points:Iterable[int]) -> None:
+        """Move the bounding boxes following a label value mapping (old value -> new value, 0 removes)"""
+
+        for t in time_points:
+            boxes = {label: self._pop(label, t) for label in mapping}
+            for label, box in boxes.items():
+                if box is not None and mapping[label] != 0:
+                    self._set(mapping[label], t, box)
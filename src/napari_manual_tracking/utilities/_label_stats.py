@@ -0,0 +1,67 @@
+import os
+
+import numpy                as np
+import pandas               as pd
+
+from concurrent.futures     import ThreadPoolExecutor
+from typing                 import Dict, List, Tuple, Union
+
+from ._label_store          import has_zarr_labels, open_zarr_labels, read_label_frame
+
+def label_areas(image:np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Count the number of voxels of every nonzero label in an image. Returns the labels present and their areas."""
+
+    values = np.asarray(image).ravel()
+    if values.size == 0:
+        return np.array([], dtype = int), np.array([], dtype = int)
+
+    max_label = int(values.max())
+    if max_label <= values.size:
+        # bincount is fastest, as long as the largest label does not make the count array much larger than the image
+        counts = np.bincount(values, minlength = max_label + 1)
+        labels = np.flatnonzero(counts)
+        areas = counts[labels]
+    else:
+        labels, areas = np.unique(values, return_counts = True)
+
+    nonzero = labels != 0
+    return labels[nonzero].astype(int), areas[nonzero].astype(int)
+
+def label_areas_in_boxes(frame:np.ndarray, boxes:Dict[int, Tuple[slice, ...]]) -> Dict[int, int]:
+    """Count the voxels of each label only inside its bounding box, so that the cost depends on the object size rather than on the frame size"""
+
+    return {label: int(np.count_nonzero(frame[box] == label)) for label, box in boxes.items()}
+
+def _frame_label_areas(source:Tuple[str, Union[str, int]]) -> Tuple[np.ndarray, np.ndarray]:
+    """Read a label image (directory, file name or time point in the zarr store) from disk and count its label areas"""
+
+    return label_areas(read_label_frame(*source))
+
+def label_area_table(directory:str, files:List[str], max_workers:int = None) -> pd.DataFrame:
+    """Build the label annotation table (time_point, label, area, parent, cell) of a directory of label images (tif files, or a zarr store), with the parent of all labels set to -1.
+
+    The time points are read and counted in a thread pool. Decoding the files and np.bincount release the GIL, so the threads run in parallel without starting worker processes from the GUI process.
+    """
+
+    if has_zarr_labels(directory):
+        paths = [(directory, t) for t in range(open_zarr_labels(directory).shape[0])]
+    else:
+        paths = [(directory, f) for f in files]
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    max_workers = max(1, min(max_workers, len(paths)))
+
+    if max_workers == 1:
+        results = [_frame_label_areas(path) for path in paths]
+    else:
+        with ThreadPoolExecutor(max_workers = max_workers) as executor:
+            results = list(executor.map(_frame_label_areas, paths))
+
+    # Combine all time points at once.
+    n_labels = [len(labels) for labels, _ in results]
+    labels = np.concatenate([labels for labels, _ in results]) if len(results) > 0 else np.array([], dtype = int)
+    areas = np.concatenate([areas for _, areas in results]) if len(results) > 0 else np.array([], dtype = int)
+    time_points = np.repeat(np.arange(len(results)), n_labels)
+    cells = np.char.add('Cell ', np.char.zfill(labels.astype(str), 5))
+
+    return pd.DataFrame({'label': labels, 'area': areas, 'time_point': time_points, 'parent': -1, 'cell': cells.astype(object)})
@@ -0,0 +1,206 @@
+import os
+import json
+import shutil
+import contextlib
+import tifffile
+
+import numpy                as np
+import pandas               as pd
+
+from typing                 import Dict, Generator, List, Tuple
+
+from ._parallel_read        import read_tiff_stack
+
+try:
+    import zarr
+except ImportError:
+    zarr = None
+
+ZARR_STORE_NAME = 'labels.zarr'
+MANIFEST_NAME = 'manifest.json'
+LABEL_FORMATS = ['TIFF (one file per time point)', 'Zarr (chunked, compressed)']
+
+def zarr_available() -> bool:
+    return zarr is not None
+
+def _require_zarr() -> None:
+    if zarr is None:
+        raise ImportError('Reading or writing labels in the Zarr format requires the zarr package, install it with "pip install zarr"')
+
+def zarr_store_path(directory:str) -> str:
+    return os.path.join(directory, ZARR_STORE_NAME)
+
+def has_zarr_labels(directory:str) -> bool:
+    """Check whether a directory holds its labels in a zarr store instead of tif files"""
+
+    return os.path.isdir(zarr_store_path(directory))
+
+def default_chunks(shape:Tuple[int, ...]) -> Tuple[int, ...]:
+    """Chunk a (t, z, y, x) stack per time point, in blocks of at most 32 x 256 x 256 voxels"""
+
+    return (1,) + tuple(min(n, c) for n, c in zip(shape[1:], (32, 256, 256)))
+
+def create_zarr_labels(directory:str, shape:Tuple[int, ...], dtype) -> 'zarr.Array':
+    """Create an empty compressed (t, z, y, x) label store in a directory. Chunks that only contain background are not written to disk."""
+
+    _require_zarr()
+    return _create_zarr_array(zarr_store_path(directory), shape, dtype)
+
+def _create_zarr_array(path:str, shape:Tuple[int, ...], dtype, chunks:Tuple[int, ...] = None) -> 'zarr.Array':
+    kwargs = {}
+    if int(zarr.__version__.split('.')[0]) < 3:
+        kwargs['write_empty_chunks'] = False # this is the default from zarr 3 onwards
+    chunks = tuple(chunks) if chunks is not None else default_chunks(shape)
+    return zarr.open_array(path, mode = 'w', shape = tuple(shape), chunks = chunks, dtype = dtype, fill_value = 0, **kwargs)
+
+def open_zarr_labels(directory:str, mode:str = 'r') -> 'zarr.Array':
+    """Open the label store of a directory"""
+
+    _require_zarr()
+    return zarr.open_array(zarr_store_path(directory), mode = mode)
+
+def promote_zarr_labels(directory:str, dtype, stack = None) -> 'zarr.Array':
+    """Convert the label store of a directory to a larger dtype. Zarr arrays cannot change their dtype in place, so the time points are copied to a new store that then replaces the old one. Returns the new store.
+
+    If stack (a LazyZarrStack reading from the store) is given, it is switched to the new store while it cannot read, so that it never reads the new data with the old dtype.
+    """
+
+    _require_zarr()
+    path = zarr_store_path(directory)
+    old_store = open_zarr_labels(directory)
+    tmp_path = path + '.promote'
+    if os.path.exists(tmp_path):
+        shutil.rmtree(tmp_path)
+    new_store = _create_zarr_array(tmp_path, old_store.shape, dtype, old_store.chunks)
+    for t in range(old_store.shape[0]):
+        frame = np.asarray(old_store[t])
+        if frame.any():
+            new_store[t] = frame.astype(dtype)
+
+    # Swap the stores, the old one is only deleted once the new one is in place.
+    old_path = path + '.old'
+    with stack.store_lock if stack is not None else contextlib.nullcontext():
+        os.replace(path, old_path)
+        os.replace(tmp_path, path)
+        new_store = open_zarr_labels(directory, mode = 'r+')
+        if stack is not None:
+            stack.store = new_store
+    shutil.rmtree(old_path)
+    return new_store
+
+def recover_zarr_labels(directory:str) -> bool:
+    """Finish or undo a save of the label store that was interrupted, e.g. by a crash. Returns whether anything had to be recovered."""
+
+    path = zarr_store_path(directory)
+    recovered = False
+    if not os.path.isdir(path) and os.path.isdir(path + '.old'):
+        # interrupted while swapping in a promoted store: the copy is complete once the old store was moved aside
+        os.replace(path + '.promote' if os.path.isdir(path + '.promote') else path + '.old', path)
+        recovered = True
+    for leftover in (path + '.promote', path + '.old'):
+        if os.path.isdir(leftover) and os.path.isdir(path):
+            shutil.rmtree(leftover)
+    return commit_zarr_snapshot(directory) or recovered
+
+def read_label_frame(directory:str, frame) -> np.ndarray:
+    """Read a single label image: a time point (int) of the zarr store of directory, or a tif file name"""
+
+    if isinstance(frame, (int, np.integer)):
+        return np.asarray(open_zarr_labels(directory)[int(frame)])
+    return tifffile.imread(os.path.join(directory, frame))
+
+def read_label_stack(directory:str, files:List[str], max_workers:int = None) -> np.ndarray:
+    """Read all label images of a directory into one 4D (t, z, y, x) array, from its zarr store if it has one, otherwise from the given tif files (read in parallel)"""
+
+    if has_zarr_labels(directory):
+        return np.asarray(open_zarr_labels(directory)[:])
+    return read_tiff_stack(directory, files, max_workers)
+
+def changed_chunks(store:'zarr.Array', t:int, frame:np.ndarray) -> List[Tuple[slice, ...]]:
+    """Return the (z, y, x) regions of the chunks of time point t whose content in the store differs from frame"""
+
+    old_frame = np.asarray(store[t])
+    chunks = store.chunks[1:]
+    boxes = []
+    for index in np.ndindex(*[-(-n // c) for n, c in zip(frame.shape, chunks)]):
+        box = tuple(slice(i * c, min((i + 1) * c, n)) for i, c, n in zip(index, chunks, frame.shape))
+        if not np.array_equal(old_frame[box], frame[box]):
+            boxes.append(box)
+    return boxes
+
+def save_label_stack(directory:str, stack:np.ndarray, label_format:str, filename:str, dtype = None) -> None:
+    """Save a 4D (t, z, y, x) label stack as one tif per time point (filename_TP0000.tif, ...), or as a zarr store. The time points are converted to dtype one by one, if given."""
+
+    dtype = np.dtype(dtype if dtype is not None else stack.dtype)
+    if label_format == LABEL_FORMATS[1]:
+        store = create_zarr_labels(directory, stack.shape, dtype)
+        for t in range(stack.shape[0]):
+            store[t] = np.asarray(stack[t], dtype = dtype)
+    else:
+        for t in range(stack.shape[0]):
+            tifffile.imwrite(os.path.join(directory, filename + "_TP" + str(t).zfill(4) + '.tif'), np.asarray(stack[t], dtype = dtype))
+
+def _staging_path(directory:str) -> str:
+    return zarr_store_path(directory) + '.saving'
+
+def write_zarr_snapshot(directory:str, frames:Dict[int, np.ndarray], annotations:pd.DataFrame = None, csv_name:str = 'LabelAnnotations.csv', dtype = None, stack = None) -> Generator[Tuple[int, int], None, 'zarr.Array']:
+    """Write edited time points (time point -> data) to the zarr store of a directory, rewriting only the chunks that changed, and write the annotation table. Yields (written, total) progress.
+
+    The changed chunks and the table are first written to a staging store next to the label store, followed by a manifest that lists them. Only then are they copied into the label store (see commit_zarr_snapshot). A save that is interrupted before the manifest is written leaves the label store unchanged, one that is interrupted while copying is completed by recover_zarr_labels.
+
+    If dtype is larger than the dtype of the store, the store is promoted first (see promote_zarr_labels, stack is switched to the new store). Returns the new store in that case, otherwise None.
+    """
+
+    store = open_zarr_labels(directory, mode = 'r+')
+    promoted = None
+    if dtype is not None and np.dtype(dtype).itemsize > store.dtype.itemsize:
+        store = promoted = promote_zarr_labels(directory, dtype, stack)
+
+    staging_path = _staging_path(directory)
+    if os.path.exists(staging_path):
+        shutil.rmtree(staging_path)
+    staging = _create_zarr_array(staging_path, store.shape, store.dtype, store.chunks)
+    n_total = len(frames) + 1
+    manifest = {'chunks': [], 'csv_name': None}
+    for i, (t, data) in enumerate(sorted(frames.items())):
+        for box in changed_chunks(store, t, data):
+            staging[(t,) + box] = data[box]
+            manifest['chunks'].append([int(t), [[s.start, s.stop] for s in box]])
+        yield i + 1, n_total
+
+    if annotations is not None:
+        annotations.to_csv(os.path.join(staging_path, csv_name), index = False)
+        manifest['csv_name'] = csv_name
+    manifest_path = os.path.join(staging_path, MANIFEST_NAME)
+    with open(manifest_path + '.tmp', 'w') as f:
+        json.dump(manifest, f)
+    os.replace(manifest_path + '.tmp', manifest_path) # from here on, the snapshot is complete
+
+    commit_zarr_snapshot(directory)
+    yield n_total, n_total
+    return promoted
+
+def commit_zarr_snapshot(directory:str) -> bool:
+    """Copy the chunks and the annotation table of a complete staged snapshot into the label directory, and remove the staging store. A staged snapshot without manifest is incomplete and is discarded. Copying again after an interruption gives the same result. Returns whether a snapshot was copied."""
+
+    staging_path = _staging_path(directory)
+    if not os.path.isdir(staging_path):
+        return False
+    manifest_path = os.path.join(staging_path, MANIFEST_NAME)
+    if not os.path.exists(manifest_path):
+        shutil.rmtree(staging_path)
+        return False
+
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+    store = open_zarr_labels(directory, mode = 'r+')
+    staging = zarr.open_array(staging_path, mode = 'r')
+    for t, box in manifest['chunks']:
+        key = (t,) + tuple(slice(start, stop) for start, stop in box)
+        store[key] = staging[key]
+    if manifest['csv_name'] is not None:
+        staged_csv = os.path.join(staging_path, manifest['csv_name'])
+        if os.path.exists(staged_csv): # already moved if an earlier commit was interrupted
+            os.replace(staged_csv, os.path.join(directory, manifest['csv_name']))
+    shutil.rmtree(staging_path)
+    return True
@@ -0,0 +1,287 @@
+import os
+import threading
+import tifffile
+
+import numpy                as np
+
+from collections            import OrderedDict
+from concurrent.futures     import ThreadPoolExecutor
+from typing                 import List, Tuple
+
+from ._tiff_index           import index_tiff_directory, read_tiff_info
+from ._label_dtype          import promote_label_dtype
+
+class LazyTiffStack:
+    """Array-like 4D (t, z, y, x) view on a directory of 3D tif files, with one chunk per time point.
+
+    Frames are only read from disk when they are accessed, and are kept in a bounded least-recently-used cache. Frames that have been written to are kept in memory until they have been saved, so that edits are never lost when a frame would otherwise be evicted from the cache.
+    """
+
+    def __init__(self, directory:str, files:List[str], cache_size:int = 8):
+        self.directory = directory
+        self.files = list(files)
+        self.cache_size = max(int(cache_size), 1)
+        self._cache = OrderedDict()
+        self._edited = {}
+        self._lock = threading.RLock()
+        self._window = None # (first, last) time point kept in memory, None keeps the most recently used time points
+        self._prefetcher = None
+        self._prefetching = {}
+        self.shape, self.dtype = self._stack_layout()
+
+    def _stack_layout(self) -> Tuple[Tuple[int, ...], np.dtype]:
+        """Return the (t, z, y, x) shape and the dtype of the stack.
+
+        Only the (cached) file headers are needed. Files saved after a label was promoted to a larger dtype may differ, the stack uses the largest.
+        """
+
+        index = index_tiff_directory(self.directory)
+        headers = {e.name: e for e in index.entries}
+        dtypes = [headers[f].dtype if f in headers else read_tiff_info(os.path.join(self.directory, f)).dtype for f in self.files]
+        frame_shape = headers[self.files[0]].shape if self.files[0] in headers else read_tiff_info(os.path.join(self.directory, self.files[0])).shape
+        return (len(self.files),) + frame_shape, promote_label_dtype(*dtypes)
+
+    @property
+    def ndim(self) -> int:
+        return len(self.shape)
+
+    @property
+    def size(self) -> int:
+        return int(np.prod(self.shape))
+
+    @property
+    def nbytes(self) -> int:
+        return self.size * self.dtype.itemsize
+
+    @property
+    def edited_frames(self) -> List[int]:
+        """Time points holding edits that have not been saved yet"""
+
+        return sorted(self._edited.keys())
+
+    def __len__(self) -> int:
+        return self.shape[0]
+
+    def __array__(self, dtype = None, copy = None) -> np.ndarray:
+        """Materialize the full stack. Only use this on small data, as it loads every time point into memory."""
+
+        arr = np.stack([self.get_frame(t) for t in range(self.shape[0])], axis = 0)
+        if dtype is not None:
+            arr = arr.astype(dtype, copy = False)
+        return arr
+
+    def _read_frame(self, t:int) -> np.ndarray:
+        """Read a single time point from disk"""
+
+        frame = tifffile.imread(os.path.join(self.directory, self.files[t]))
+        if frame.shape != self.shape[1:]:
+            raise ValueError(f'{self.files[t]} has shape {frame.shape}, expected {self.shape[1:]}')
+        return frame
+
+    def get_frame(self, t:int) -> np.ndarray:
+        """Return the data of time point t, reading it from disk if it is not in memory yet"""
+
+        t = int(t)
+        if t < 0:
+            t += self.shape[0]
+        with self._lock:
+            if t in self._edited:
+                return self._edited[t]
+            if t in self._cache:
+                self._cache.move_to_end(t)
+                return self._cache[t]
+
+        frame = self._load_frame(t)
+        with self._lock:
+            self._cache[t] = frame
+            self._trim_cache()
+        return frame
+
+    def _load_frame(self, t:int) -> np.ndarray:
+        frame = self._read_frame(t)
+        if frame.dtype != self.dtype:
+            frame = frame.astype(self.dtype) # the stack was promoted to a larger dtype, or the files on disk differ in dtype
+        return frame
+
+    def _trim_cache(self) -> None:
+        """Drop the least recently used frames that do not fit in the cache, never dropping frames inside the window"""
+
+        evictable = [t for t in self._cache if self._window is None or not (self._window[0] <= t <= self._window[1])]
+        for t in evictable[:max(len(self._cache) - self.cache_size, 0)]:
+            del self._cache[t]
+
+    def set_window(self, center:int, radius:int, direction:int = 0) -> List[int]:
+        """Keep the time points within radius of center in memory and drop all others from the cache. Missing time points in the window are read in a background thread, those ahead in the direction of travel (+1 or -1) first. Returns the edited time points outside the window, which stay in memory until they are saved."""
+
+        first, last = max(center - radius, 0), min(center + radius, self.shape[0] - 1)
+        ahead = range(center + 1, last + 1) if direction >= 0 else range(center - 1, first - 1, -1)
+        behind = range(center - 1, first - 1, -1) if direction >= 0 else range(center + 1, last + 1)
+        with self._lock:
+            self._window = (first, last)
+            for t in [t for t in self._cache if not first <= t <= last]:
+                del self._cache[t]
+            self._prefetching = {t: future for t, future in self._prefetching.items() if not future.done()}
+            missing = [t for t in [center, *ahead, *behind] if t not in self._cache and t not in self._edited and t not in self._prefetching]
+            outside = [t for t in self._edited if not first <= t <= last]
+
+        if len(missing) > 0:
+            if self._prefetcher is None:
+                self._prefetcher = ThreadPoolExecutor(max_workers = 1)
+            with self._lock:
+                for t in missing:
+                    self._prefetching[t] = self._prefetcher.submit(self._prefetch, t)
+        return sorted(outside)
+
+    def clear_window(self) -> None:
+        """Go back to keeping the most recently used time points"""
+
+        with self._lock:
+            self._window = None
+            self._trim_cache()
+
+    def _prefetch(self, t:int) -> None:
+        """Read a time point into the cache in the background, unless it left the window in the meantime"""
+
+        with self._lock:
+            if self._window is None or not self._window[0] <= t <= self._window[1] or t in self._cache or t in self._edited:
+                return
+        frame = self._load_frame(t)
+        with self._lock:
+            if self._window is not None and self._window[0] <= t <= self._window[1] and t not in self._cache and t not in self._edited:
+                self._cache[t] = frame
+
+    def wait_for_prefetch(self) -> None:
+        """Block until the background reads have finished, e.g. before the files on disk are replaced"""
+
+        with self._lock:
+            futures = list(self._prefetching.values())
+        for future in futures:
+            future.exception() # a failed read is raised again when the time point is accessed
+
+
+    def _editable_frame(self, t:int) -> np.ndarray:
+        """Return the in-memory frame for time point t and pin it, so that it is not evicted before it is saved"""
+
+        t = int(t)
+        if t < 0:
+            t += self.shape[0]
+        with self._lock:
+            if t not in self._edited:
+                frame = self.get_frame(t)
+                self._cache.pop(t, None)
+                if not frame.flags.writeable:
+                    frame = frame.copy()
+                self._edited[t] = frame
+            return self._edited[t]
+
+    def promote(self, dtype) -> None:
+        """Hold the time points in a larger dtype from now on, converting the frames that are already in memory"""
+
+        with self._lock:
+            self.dtype = np.dtype(dtype)
+            self._cache = OrderedDict((t, frame.astype(self.dtype)) for t, frame in self._cache.items())
+            self._edited = {t: frame.astype(self.dtype) for t, frame in self._edited.items()}
+
+    def mark_saved(self, time_points:List[int] = None) -> None:
+        """Release the pinned frames after they have been written to disk, moving them back to the cache"""
+
+        with self._lock:
+            if time_points is None:
+                time_points = list(self._edited.keys())
+            for t in time_points:
+                frame = self._edited.pop(t, None)
+                if frame is not None and (self._window is None or self._window[0] <= t <= self._window[1]):
+                    self._cache[t] = frame
+            self._trim_cache()
+
+    def _normalize_key(self, key) -> Tuple:
+        """Expand the key to a tuple with one entry per dimension"""
+
+        if not isinstance(key, tuple):
+            key = (key,)
+
+        # Boolean masks consume as many dimensions as they have.
+        n_used = sum(k.ndim if isinstance(k, np.ndarray) and k.dtype == bool else 1 for k in key if k is not Ellipsis)
+        n_missing = self.ndim - n_used
+        if any(k is Ellipsis for k in key):
+            i = [j for j, k in enumerate(key) if k is Ellipsis][0]
+            key = key[:i] + (slice(None),) * n_missing + key[i + 1:]
+        else:
+            key = key + (slice(None),) * n_missing
+        return key
+
+    def __getitem__(self, key):
+        if isinstance(key, np.ndarray) and key.dtype == bool and key.ndim == self.ndim:
+            return np.concatenate([self.get_frame(t)[key[t]] for t in range(self.shape[0])])
+
+        key = self._normalize_key(key)
+        t_key, rest = key[0], key[1:]
+
+        if isinstance(t_key, (int, np.integer)):
+            return self.get_frame(t_key)[rest]
+
+        if isinstance(t_key, slice):
+            time_points = range(*t_key.indices(self.shape[0]))
+            if len(time_points) == 0:
+                return np.empty((0,) + self.shape[1:], dtype = self.dtype)[(slice(None),) + rest]
+            return np.stack([self.get_frame(t)[rest] for t in time_points], axis = 0)
+
+        # Fancy indexing with coordinate arrays, as used by napari when painting.
+        t_key = np.asarray(t_key)
+        if all(isinstance(k, (np.ndarray, list)) for k in rest):
+            coords = np.broadcast_arrays(t_key, *[np.asarray(k) for k in rest])
+            result = np.empty(coords[0].shape, dtype = self.dtype)
+            for t in np.unique(coords[0]):
+                mask = coords[0] == t
+                result[mask] = self.get_frame(t)[tuple(c[mask] for c in coords[1:])]
+            return result
+
+        frames = [self.get_frame(t)[rest] for t in t_key.ravel()]
+        return np.stack(frames, axis = 0).reshape(t_key.shape + frames[0].shape)
+
+    def __setitem__(self, key, value) -> None:
+        if isinstance(key, np.ndarray) and key.dtype == bool and key.ndim == self.ndim:
+            for t in np.flatnonzero(key.reshape(self.shape[0], -1).any(axis = 1)):
+                self._editable_frame(t)[key[t]] = value
+            return
+
+        key = self._normalize_key(key)
+        t_key, rest = key[0], key[1:]
+
+        if isinstance(t_key, (int, np.integer)):
+            self._editable_frame(t_key)[rest] = value
+            return
+
+        if isinstance(t_key, slice):
+            time_points = range(*t_key.indices(self.shape[0]))
+            indexed_shape = np.broadcast_to(np.zeros((), dtype = bool), self.shape[1:])[rest].shape # without reading or allocating a frame
+            value = np.broadcast_to(np.asarray(value), (len(time_points),) + indexed_shape)
+            for i, t in enumerate(time_points):
+                self._editable_frame(t)[rest] = value[i]
+            return
+
+        # Fancy indexing with coordinate arrays, as used by napari when painting.
+        t_key = np.asarray(t_key)
+        coords = np.broadcast_arrays(t_key, *[np.asarray(k) for k in rest])
+        value = np.asarray(value)
+        for t in np.unique(coords[0]):
+            mask = coords[0] == t
+            v = value[mask] if value.shape == coords[0].shape else value
+            self._editable_frame(t)[tuple(c[mask] for c in coords[1:])] = v
+
+class LazyZarrStack(LazyTiffStack):
+    """LazyTiffStack that reads its time points from a chunked (t, z, y, x) zarr array instead of a directory of tif files"""
+
+    def __init__(self, store, cache_size:int = 8):
+        self.store = store
+        self.store_lock = threading.Lock() # held while reading, so that the store can be replaced (see promote_zarr_labels)
+        super().__init__(None, [], cache_size)
+
+    def _stack_layout(self) -> Tuple[Tuple[int, ...], np.dtype]:
+        return tuple(self.store.shape), np.dtype(self.store.dtype)
+
+    def _read_frame(self, t:int) -> np.ndarray:
+        """Read a single time point from the store"""
+
+        with self.store_lock:
+            return np.asarray(self.store[t])
@@ -0,0 +1,208 @@
+import bisect
+
+import numpy                as np
+import pandas               as pd
+
+from typing                 import Dict, Iterable, List, Set, Tuple
+
+class LineageGraph:
+    """Lineage tree of the labels, stored as child -> parent and parent -> children maps.
+
+    A parent value of 0 marks the start of a lineage, and a parent value of -1 marks a label that has not been tracked yet.
+    """
+
+    def __init__(self, parents:Dict[int, int] = None):
+        self.parents = {} # label -> parent
+        self._children = {} # parent -> sorted list of children
+        self.version = 0 # incremented on every change, so that derived data can be cached
+        self._recording = None # label -> parent before the first change since start_recording, or None when not recording
+        self._table = None # cached (version, dataframe) of to_dataframe
+        self._log = [] # labels changed per version, in order: self._log[i] was changed in version self._log_start + i + 1
+        self._log_start = 0
+        if parents is not None:
+            for label, parent in parents.items():
+                self.set_parent(label, parent)
+
+    @classmethod
+    def from_dataframe(cls, df:pd.DataFrame) -> 'LineageGraph':
+        """Create a lineage graph from a dataframe with 'label' and 'parent' columns"""
+
+        pairs = df[['label', 'parent']].drop_duplicates()
+        return cls(dict(zip(pairs['label'].astype(int), pairs['parent'].astype(int))))
+
+    def __contains__(self, label:int) -> bool:
+        return label in self.parents
+
+    def __len__(self) -> int:
+        return len(self.parents)
+
+    def parent(self, label:int) -> int:
+        """Return the parent of a label, or None if the label is unknown"""
+
+        return self.parents.get(label)
+
+    def children(self, label:int) -> List[int]:
+        """Return the (sorted) children of a label"""
+
+        return list(self._children.get(label, []))
+
+    def set_parent(self, label:int, parent:int) -> None:
+        """Add a label or change its parent"""
+
+        label, parent = int(label), int(parent)
+        old_parent = self.parents.get(label)
+        if old_parent == parent:
+            return
+        self._record(label, old_parent)
+        if old_parent is not None:
+            self._detach(label, old_parent)
+        self.parents[label] = parent
+        if parent > 0:
+            bisect.insort(self._children.setdefault(parent, []), label)
+
+    def remove(self, label:int) -> None:
+        """Remove a label from the graph. Its children keep their parent value."""
+
+        old_parent = self.parents.pop(label, None)
+        if old_parent is not None:
+            self._record(label, old_parent)
+            self._detach(label, old_parent)
+
+    def _record(self, label:int, old_parent:int) -> None:
+        """Register a change, keeping the parent the label had when recording started"""
+
+        self.version += 1
+        self._log.append(label)
+        if len(self._log) > max(1024, 2 * len(self.parents)):
+            # Keep the log bounded, callers that are further behind rebuild from scratch.
+            n_drop = len(self._log) // 2
+            self._log = self._log[n_drop:]
+            self._log_start += n_drop
+        if self._recording is not None and label not in self._recording:
+            self._recording[label] = old_parent
+
+    def start_recording(self) -> None:
+        """Start collecting the changes made to the graph"""
+
+        self._recording = {}
+
+    def stop_recording(self) -> Dict[int, Tuple[int, int]]:
+        """Stop collecting changes, and return label -> (old parent, new parent) for every label that changed since start_recording"""
+
+        recorded, self._recording = self._recording or {}, None
+        return {label: (old_parent, self.parents.get(label)) for label, old_parent in recorded.items() if old_parent != self.parents.get(label)}
+
+    def changed_since(self, version:int) -> Set[int]:
+        """Return the labels that were added, removed or got a new parent after the given version, or None if that version is too old to tell"""
+
+        if version < self._log_start or version > self.version:
+            return None
+        return set(self._log[version - self._log_start:])
+
+    def to_dataframe(self) -> pd.DataFrame:
+        """Return the graph as a dataframe with 'label' and 'parent' columns, sorted by label. The result is cached until the graph changes and should not be modified."""
+
+        if self._table is None or self._table[0] != self.version:
+            labels = np.array(sorted(self.parents), dtype = int)
+            parents = np.array([self.parents[label] for label in labels], dtype = int)
+            self._table = (self.version, pd.DataFrame({'label': labels, 'parent': parents}))
+        return self._table[1]
+
+    def _detach(self, label:int, parent:int) -> None:
+        """Remove label from the children list of parent"""
+
+        children = self._children.get(parent)
+        if children is None:
+            return
+        i = bisect.bisect_left(children, label)
+        if i < len(children) and children[i] == label:
+            children.pop(i)
+        if len(children) == 0:
+            del self._children[parent]
+
+    def changes_to(self, parents:Dict[int, int]) -> Dict[int, Tuple[int, int]]:
+        """Compare with a label -> parent mapping, and return label -> (current parent, new parent) for every label that differs. None means that the label is absent."""
+
+        return {label: (self.parents.get(label), parents.get(label)) for label in set(self.parents) | set(parents) if self.parents.get(label) != parents.get(label)}
+
+    def apply_changes(self, changes:Dict[int, Tuple[int, int]], revert:bool = False) -> None:
+        """Apply the new parents of a changes dictionary (or the old ones if revert is True)"""
+
+        for label, (old_parent, new_parent) in changes.items():
+            parent = old_parent if revert else new_parent
+            if parent is None:
+                self.remove(label)
+            else:
+                self.set_parent(label, parent)
+
+    def root(self, label:int) -> int:
+        """Return the earliest ancestor of a label: the first label upwards whose parent is 0, -1, or unknown"""
+
+        visited = {label}
+        parent = self.parents.get(label)
+        while parent is not None and parent > 0 and parent not in visited:
+            grandparent = self.parents.get(parent)
+            if grandparent is None or grandparent in (0, -1):
+                return parent
+            visited.add(parent)
+            label, parent = parent, grandparent
+        return label
+
+    def ancestors(self, label:int) -> List[int]:
+        """Return the ancestors of a label, from its parent upwards"""
+
+        ancestors = []
+        visited = {label}
+        parent = self.parents.get(label)
+        while parent is not None and parent > 0 and parent not in visited:
+            ancestors.append(parent)
+            visited.add(parent)
+            parent = self.parents.get(parent)
+        return ancestors
+
+    def descendants(self, label:int) -> List[int]:
+        """Return all descendants of a label, breadth first"""
+
+        descendants = []
+        visited = {label}
+        queue = list(self._children.get(label, []))
+        i = 0
+        while i < len(queue):
+            child = queue[i]
+            i += 1
+            if child in visited:
+                continue
+            visited.add(child)
+            descendants.append(child)
+            queue.extend(self._children.get(child, []))
+        return descendants
+
+    def plot_order(self, starting_points:Iterable[int]) -> List[int]:
+        """Determine the y-axis order of the tree plot from the starting points downward, placing each label between its first and its remaining children"""
+
+        order = []
+        visited = set()
+        stack = [(label, False) for label in reversed(list(starting_points))]
+        while len(stack) > 0:
+            label, expanded = stack.pop()
+            if expanded:
+                order.append(label)
+                continue
+            if label in visited:
+                continue
+            visited.add(label)
+            children = self._children.get(label, [])
+            for child in reversed(children[1:]):
+                stack.append((child, False))
+            stack.append((label, True))
+            if len(children) > 0:
+                stack.append((children[0], False))
+        return order
+
+    def lineage(self, label:int) -> List[int]:
+        """Return the entire lineage a label belongs to, in plot order. Labels that have not been tracked (parent -1) or are unknown do not belong to a lineage."""
+
+        parent = self.parents.get(label)
+        if parent is None or parent == -1:
+            return []
+        return self.plot_order([self.root(label)])
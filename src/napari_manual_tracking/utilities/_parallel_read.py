@@ -0,0 +1,51 @@
+import os
+import tifffile
+
+import numpy                as np
+
+from concurrent.futures     import ThreadPoolExecutor
+from typing                 import List
+
+from ._tiff_index           import index_tiff_directory
+from ._label_dtype          import promote_label_dtype
+
+DEFAULT_READ_WORKERS = min(8, os.cpu_count() or 1)
+
+def _read_into(path:str, out:np.ndarray, dtype:np.dtype) -> None:
+    """Decode a tif file directly into out, or convert it if it is stored in a different dtype"""
+
+    if dtype == out.dtype:
+        tifffile.imread(path, out = out)
+    else:
+        frame = tifffile.imread(path)
+        if frame.shape != out.shape:
+            raise ValueError(f'{os.path.basename(path)} has shape {frame.shape}, expected {out.shape}')
+        out[...] = frame
+
+def read_tiff_stack(directory:str, files:List[str], max_workers:int = None) -> np.ndarray:
+    """Read the tif files (one per time point) into a single 4D (t, z, y, x) array, using several threads.
+
+    The array is allocated once from the file headers and every file is decoded straight into its own time point, so the data is never held twice in memory as with a list of frames and np.stack. Decoding in tifffile releases the GIL, so threads overlap both the disk reads and the decompression.
+    """
+
+    headers = {e.name: e for e in index_tiff_directory(directory).entries}
+    missing = [f for f in files if f not in headers]
+    if len(missing) > 0:
+        raise FileNotFoundError(f'{missing[0]} was not found in {directory}')
+    frame_shape = headers[files[0]].shape
+    for f in files:
+        if headers[f].shape != frame_shape:
+            raise ValueError(f'{f} has shape {headers[f].shape}, expected {frame_shape}')
+
+    stack = np.empty((len(files),) + frame_shape, dtype = promote_label_dtype(*[headers[f].dtype for f in files]))
+    max_workers = max(int(max_workers if max_workers is not None else DEFAULT_READ_WORKERS), 1)
+    if max_workers == 1 or len(files) == 1:
+        for i, f in enumerate(files):
+            _read_into(os.path.join(directory, f), stack[i], headers[f].dtype)
+        return stack
+
+    with ThreadPoolExecutor(max_workers = max_workers) as executor:
+        futures = [executor.submit(_read_into, os.path.join(directory, f), stack[i], headers[f].dtype) for i, f in enumerate(files)]
+        for future in futures:
+            future.result() # raise the first error, if any
+    return stack
@@ -1,6 +1,5 @@
 import os
 from pathlib                            import Path 
-from typing                              import List
 
 import napari.layers
 
@@ -13,6 +12,7 @@ from matplotlib.backends.backend_qt5agg import FigureCanvas, NavigationToolbar2Q
 from qtpy.QtWidgets                     import QHBoxLayout, QVBoxLayout, QWidget, QComboBox, QLabel, QRadioButton, QButtonGroup, QGroupBox
 from qtpy.QtGui                         import QIcon
 from ._save_plot_figure                 import CustomNavigationToolbar
+from ._lineage_graph                    import LineageGraph
 
 ICON_ROOT = Path(__file__).parent / "icons"
 
@@ -22,12 +22,15 @@ class PlotWidget(QWidget):
     Intended for interactive plotting of features in a pandas dataframe (props) belonging to a labels layer (labels).
     """
 
-    def __init__(self, props: pd.DataFrame, labels: napari.layers.Labels):
+    def __init__(self, props: pd.DataFrame, labels: napari.layers.Labels, lineage: LineageGraph = None):
         super().__init__()
 
         self.labels = labels
         self.props = props
         self.cmap = self.labels.colormap
+        self.lineage = lineage if lineage is not None else LineageGraph.from_dataframe(props) # kept up to date by the caller, the plot follows its version
+        self._drawn_version = None # lineage version of the last redraw
+        self._order_cache = (None, None) # ((mode, label, lineage version), y-axis order) of the last tree layout
 
         # Main plot.
         self.fig = plt.figure(constrained_layout=True)
@@ -142,8 +145,6 @@ class PlotWidget(QWidget):
     def _get_lineage_data(self, mode: Literal['all', 'tracked', 'lineage', 'selected', 'loose'] = 'all') -> pd.DataFrame:
         """Generate a new pandas dataframe containing the data to be plotted, depending on the 'mode', and with a new column for the colors and the y-axis order."""
 
-        parent_labels = self.props[['label', 'parent']].copy().drop_duplicates()
-
         if mode == 'all':
             y_axis_order = sorted(self.props['label'].unique())
 
@@ -151,20 +152,16 @@ class PlotWidget(QWidget):
             y_axis_order = [self.labels.selected_label]
         
         if mode == 'loose':
-            starting_points = parent_labels.loc[parent_labels['parent'] == -1, 'label']
-            y_axis_order = sorted([s for s in starting_points])
+            y_axis_order = sorted(self.props.loc[self.props['parent'] == -1, 'label'].unique()) # includes labels the lineage graph does not know yet
         
         if mode == 'tracked':
             # plot all the tracked lineages starting with a parent = 0 label. 
-            starting_points = parent_labels.loc[parent_labels['parent'] == 0, 'label'] # find all the labels that have a parent = 0 to find the origins of the tracks
-            y_axis_order = self._determine_label_plot_order(parent_labels, starting_points) 
+            y_axis_order = self._tree_order('tracked')
         
         if mode == 'lineage':
             current_label = self.labels.selected_label
-            try: 
-                parent = parent_labels.loc[parent_labels['label'] == current_label, 'parent'].iloc[0]
-                print(parent)
-            except IndexError:
+            parent = self.lineage.parent(current_label)
+            if parent is None:
                 print('this label does not exist in parent labels')
                 return pd.DataFrame({'time_point': pd.Series(dtype = 'int'), 'label': pd.Series(dtype = 'int'), 'parent': pd.Series(dtype = 'int'), 'cell': pd.Series(dtype = 'str'), 'y_axis_order': pd.Series(dtype = 'int'), 'label_color': pd.Series(dtype = 'object')})
             
@@ -172,46 +169,41 @@ class PlotWidget(QWidget):
             if parent == -1:
                 print('this label has not been tracked yet and therefore does not belong to a lineage')
                 return pd.DataFrame({'time_point': pd.Series(dtype = 'int'), 'label': pd.Series(dtype = 'int'), 'parent': pd.Series(dtype = 'int'), 'cell': pd.Series(dtype = 'str'), 'y_axis_order': pd.Series(dtype = 'int'), 'label_color': pd.Series(dtype = 'object')})
-            elif parent == 0:
-                y_axis_order = self._determine_label_plot_order(parent_labels, [current_label])      
-            else: 
-                print('searching parents...')
-                while parent > 0:
-                    new_parent = parent_labels.loc[parent_labels['label'] == parent, 'parent'].iloc[0]
-                    print('new parent', new_parent)
-                    if (new_parent == 0) or (new_parent == -1) :
-                        break
-                    else:
-                        parent = new_parent
-                y_axis_order = self._determine_label_plot_order(parent_labels, [parent])      
+            else:
+                y_axis_order = self._tree_order('lineage', current_label)
       
         
         plotting_data = self.props[self.props['label'].isin(y_axis_order)].copy() # keep only the labels that are in the y_axis_order.
         if not plotting_data.empty:
-            plotting_data['y_axis_order'] = plotting_data['label'].apply(lambda label: y_axis_order.index(label))
+            y_axis_position = {label: i for i, label in enumerate(y_axis_order)}
+            plotting_data['y_axis_order'] = plotting_data['label'].map(y_axis_position)
             plotting_data.loc[:, 'cell'] = plotting_data.apply(lambda row: 'Cell ' + str(int(row.label)).zfill(5), axis = 1)
             plotting_data.loc[:, 'label_color'] = plotting_data.apply(lambda row: to_rgb(self.cmap.map(row.label)), axis = 1)
             plotting_data = plotting_data.sort_values(by = 'y_axis_order', axis = 0)
 
         return plotting_data
 
-    def _determine_label_plot_order(self, parent_labels: pd.DataFrame, starting_points: List[int]) -> List[int]:
-        """Determines the y-axis order of the tree plot, from the starting points downward"""
-        
-        y_axis_order = [s for s in starting_points]
-
-        # Find the children of each of the starting points, and work down the tree.
-        while len(starting_points) > 0:
-            children_list = []
-            for l in starting_points:
-                children = list(parent_labels.loc[parent_labels['parent'] == l, 'label'])
-                for i, c in enumerate(children):
-                    [children_list.append(c)]
-                    y_axis_order.insert(y_axis_order.index(l) + i, c)
-            starting_points = children_list
-
-        return y_axis_order
-    
+    def _tree_order(self, mode: Literal['tracked', 'lineage'], label: int = None) -> list:
+        """Return the y-axis order of all tracked lineages, or of the lineage of label. The order is computed again only when the lineage graph has changed."""
+
+        key = (mode, label, self.lineage.version)
+        if self._order_cache[0] != key:
+            if mode == 'tracked':
+                # plot all the tracked lineages starting with a parent = 0 label, the origins of the tracks
+                order = self.lineage.plot_order(sorted(label for label, parent in self.lineage.parents.items() if parent == 0))
+            else:
+                order = self.lineage.plot_order([self.lineage.root(label)])
+            self._order_cache = (key, order)
+        return self._order_cache[1]
+
+    def update_data(self, props: pd.DataFrame) -> None:
+        """Show new data, redrawing only if the data or the lineage graph changed since the last redraw"""
+
+        if self._drawn_version == self.lineage.version and props.equals(self.props):
+            return
+        self.props = props
+        self._update_plot()
+
     def _update_plot_option(self) -> None: 
         """conditionally specify whether to bind or not to bind to selected_label event"""
         if self.labels.show_selected_label or self.show_lineage_radio.isChecked(): 
@@ -231,6 +223,7 @@ class PlotWidget(QWidget):
         """
 
         print('call to update plot!')
+        self._drawn_version = self.lineage.version
         x_axis_property = self.x_combo.currentText()
         y_axis_property = self.y_combo.currentText()
         group = self.group_combo.currentText()
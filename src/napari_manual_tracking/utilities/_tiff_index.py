@@ -0,0 +1,103 @@
+import os
+import re
+import threading
+import tifffile
+
+import numpy                as np
+
+from typing                 import List, NamedTuple, Tuple
+
+TIFF_EXTENSIONS = ('.tif', '.tiff')
+
+class TiffInfo(NamedTuple):
+    """Header information of a single tif file"""
+
+    name: str
+    shape: Tuple[int, ...]
+    dtype: np.dtype
+    compression: str
+    size: int # file size in bytes
+    mtime: int # modification time in nanoseconds
+
+def natural_sort_key(name:str) -> List:
+    """Sort key that orders numbers by value, so that 't2.tif' comes before 't10.tif'"""
+
+    return [int(part) if part.isdigit() else part.lower() for part in re.split(r'(\d+)', name)]
+
+def is_tiff_file(name:str) -> bool:
+    return name.lower().endswith(TIFF_EXTENSIONS) and not name.startswith('.')
+
+def read_tiff_info(path:str) -> TiffInfo:
+    """Read the shape, dtype and compression of a tif file from its header, without reading the image data"""
+
+    stat = os.stat(path)
+    with tifffile.TiffFile(path) as tif:
+        series = tif.series[0]
+        compression = tif.pages[0].compression
+        return TiffInfo(os.path.basename(path), tuple(series.shape), np.dtype(series.dtype), getattr(compression, 'name', str(compression)), stat.st_size, stat.st_mtime_ns)
+
+class TiffDirectoryIndex:
+    """Header information of the tif files (one per time point) in a directory, in natural sort order"""
+
+    def __init__(self, directory:str, entries:List[TiffInfo]):
+        self.directory = directory
+        self.entries = sorted(entries, key = lambda e: natural_sort_key(e.name))
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    @property
+    def files(self) -> List[str]:
+        return [e.name for e in self.entries]
+
+    @property
+    def frame_shape(self) -> Tuple[int, ...]:
+        """Shape of a single time point (of the first file, see validate for the others)"""
+
+        return self.entries[0].shape if len(self.entries) > 0 else ()
+
+    def validate(self, frame_shape:Tuple[int, ...] = None, n_frames:int = None, integer:bool = False) -> List[str]:
+        """Return a description of every problem found: files with a different shape than the first file (or frame_shape if given), a different number of files than n_frames, or (if integer is True) non-integer data"""
+
+        problems = []
+        if len(self.entries) == 0:
+            return ['No tif files were found in ' + self.directory]
+        expected = tuple(frame_shape) if frame_shape is not None else self.frame_shape
+        for e in self.entries:
+            if e.shape != expected:
+                problems.append(f'{e.name} has shape {e.shape}, expected {expected}')
+            if integer and e.dtype.kind not in 'ui':
+                problems.append(f'{e.name} has data type {e.dtype}, expected integer labels')
+        if n_frames is not None and len(self.entries) != n_frames:
+            problems.append(f'{self.directory} contains {len(self.entries)} tif files, expected {n_frames}')
+        return problems
+
+_cache = {} # directory -> {file name: TiffInfo}
+_cache_lock = threading.Lock()
+
+def index_tiff_directory(directory:str) -> TiffDirectoryIndex:
+    """List the tif files in a directory and read their headers. Headers are cached per directory and only read again for files whose size or modification time changed."""
+
+    directory = os.path.abspath(directory)
+    with _cache_lock:
+        cached = dict(_cache.get(directory, {}))
+
+    entries = {}
+    with os.scandir(directory) as it:
+        for entry in it:
+            if not entry.is_file() or not is_tiff_file(entry.name):
+                continue
+            stat = entry.stat()
+            info = cached.get(entry.name)
+            if info is None or info.size != stat.st_size or info.mtime != stat.st_mtime_ns:
+                info = read_tiff_info(entry.path)
+            entries[entry.name] = info
+
+    with _cache_lock:
+        _cache[directory] = entries
+    return TiffDirectoryIndex(directory, list(entries.values()))
+
+def list_tiff_files(directory:str) -> List[str]:
+    """Return the names of the tif files in a directory, in natural sort order"""
+
+    return index_tiff_directory(directory).files